@@ -1,7 +1,8 @@
 from django.contrib import admin
 from .models import (Student, StudentIdentificationDocument, Course, CoursePage,
-CourseViewInstance, CoursePageViewInstance, CourseTest, MultipleChoiceAnswer, MultipleChoiceTestQuestion,
- CoursePageMedia, CourseTestInstance, CourseTestQuestionInstance, CourseTestQuestionAnswerOption)
+CourseViewInstance, CoursePageViewInstance, CoursePageViewRollup, CourseTest, MultipleChoiceAnswer, MultipleChoiceTestQuestion,
+ CoursePageMedia, CourseTestInstance, CourseTestQuestionInstance, CourseTestQuestionAnswerOption,
+ CourseActivityDay, StudentCourseActivityDay)
 from django.contrib.auth.admin import UserAdmin as DjangoUserAdmin
 from django.utils.translation import gettext_lazy as _
 
@@ -50,12 +51,19 @@ class CourseAdmin(admin.ModelAdmin):
 
 admin.site.register(Course, CourseAdmin)
 
+@admin.action(description='Re-render markdown for selected items')
+def rerender_markdown(modeladmin, request, queryset):
+    for instance in queryset:
+        instance.prerender_markdown(refresh=True)
+    modeladmin.message_user(request, 'Re-rendered markdown for %s items' % len(queryset))
+
 class CoursePageMediaInline(admin.TabularInline):
     model = CoursePageMedia
 
 class CoursePageAdmin(admin.ModelAdmin):
     list_display = ('course', 'page_number', 'page_title', 'page_contents')
     inlines = (CoursePageMediaInline, )
+    actions = (rerender_markdown, )
 
 admin.site.register(CoursePage, CoursePageAdmin)
 
@@ -82,6 +90,7 @@ class MultipleChoiceTestQuestionAdmin(admin.ModelAdmin):
         'correct_multiple_choice_answer', 'multiple_choice_answer_length')
 
     inlines = (MultipleChoiceOtherAnswerInline, )
+    actions = (rerender_markdown, )
 
 admin.site.register(MultipleChoiceTestQuestion, MultipleChoiceTestQuestionAdmin)
 
@@ -90,6 +99,33 @@ class CoursePageViewInstanceAdmin(admin.ModelAdmin):
 
 admin.site.register(CoursePageViewInstance,CoursePageViewInstanceAdmin)
 
-admin.site.register(CourseTestInstance, admin.ModelAdmin)
+class CoursePageViewRollupAdmin(admin.ModelAdmin):
+    list_display = ('day', 'url', 'course_view_instance', 'view_count', 'total_seconds_spent')
+    list_select_related = ('course_view_instance__course', 'course_view_instance__student')
+
+admin.site.register(CoursePageViewRollup, CoursePageViewRollupAdmin)
+
+class CourseActivityDayAdmin(admin.ModelAdmin):
+    list_display = ('day', 'course', 'seconds_credited', 'pages_viewed', 'tests_started', 'tests_finished',
+        'tests_passed')
+    list_filter = ('course',)
+    list_select_related = ('course',)
+    date_hierarchy = 'day'
+
+admin.site.register(CourseActivityDay, CourseActivityDayAdmin)
+
+class StudentCourseActivityDayAdmin(CourseActivityDayAdmin):
+    list_display = ('day', 'course', 'student') + CourseActivityDayAdmin.list_display[2:]
+    list_select_related = ('course', 'student')
+
+admin.site.register(StudentCourseActivityDay, StudentCourseActivityDayAdmin)
+
+class CourseTestInstanceAdmin(admin.ModelAdmin):
+    list_display = ('course_test', 'student', 'is_practice', 'test_started_on', 'test_finished_on',
+        'correct_answer_count', 'question_count', 'score_percent', 'passed')
+    list_select_related = ('course_test__course', 'student')
+    readonly_fields = ('question_count', 'correct_answer_count', 'score_percent', 'passed', 'scored_on')
+
+admin.site.register(CourseTestInstance, CourseTestInstanceAdmin)
 admin.site.register(CourseTestQuestionInstance, admin.ModelAdmin)
 admin.site.register(CourseTestQuestionAnswerOption, admin.ModelAdmin)
@@ -0,0 +1,124 @@
+import threading
+import time
+import uuid
+from collections import Counter
+
+from django.conf import settings
+from django.core.cache import cache
+from django.db import transaction
+
+CACHE_KEY_PREFIX = 'core'
+
+# Versions name the things cached entries are built from. Entries built from a course's content
+# put the course's version in their key, and saving anything in the course just changes the
+# version instead of hunting down every key. Versions are random rather than counters, so an
+# evicted version can't come back with an old number and revive stale entries.
+COURSE_CATALOG = ('course_catalog',)
+
+# every namespace read through get_or_build, anything else is counted under 'other'
+CACHE_STATS_NAMESPACES = ('course_page_nav', 'course_recent_history', 'course_structure', 'markdown',
+    'student_dashboard', 'student_principal', 'test_navigation', 'test_payload', 'other')
+
+
+def cache_key(*parts):
+    # every core cache key is namespaced and built the same way, e.g. core:student_principal:<guid>
+    return ':'.join([CACHE_KEY_PREFIX] + [str(part) for part in parts])
+
+
+def course_content(course_pk):
+    return ('course_content', course_pk)
+
+
+def course_test_content(course_test_pk):
+    return ('course_test_content', course_test_pk)
+
+
+def cache_version(scope):
+    key = cache_key('version', *scope)
+    version = cache.get(key)
+    if version is None:
+        cache.add(key, uuid.uuid4().hex, None)
+        version = cache.get(key)
+    return version
+
+
+def bump_cache_version(*scopes):
+    if not scopes:
+        return
+    def bump():
+        cache.set_many({cache_key('version', *scope): uuid.uuid4().hex for scope in scopes}, None)
+    # and again once the edit commits, so an entry rebuilt from the old rows in between
+    # isn't left cached under the new version
+    bump()
+    transaction.on_commit(bump)
+
+
+def versioned_cache_key(scope, *parts):
+    return cache_key(*parts, cache_version(scope))
+
+
+class CacheStats:
+    '''
+    Hit and miss counts per key namespace. Counted in process and added to shared counters in
+    the cache every CACHE_STATS_FLUSH_SECONDS so the cache_stats command sees every worker.
+    Namespaces are a fixed list with one counter per namespace and kind, and flushes only add
+    to them, so workers flushing at the same time can't lose each other's counts.
+    '''
+
+    def __init__(self):
+        self.counts = Counter()
+        self.flushed_at = time.monotonic()
+        self._lock = threading.Lock()
+
+    def record(self, key, hit):
+        namespace = key.split(':')[1]
+        if namespace not in CACHE_STATS_NAMESPACES:
+            namespace = 'other'
+        with self._lock:
+            self.counts[namespace, 'hits' if hit else 'misses'] += 1
+            if time.monotonic() - self.flushed_at < settings.CACHE_STATS_FLUSH_SECONDS:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            counts, self.counts = self.counts, Counter()
+            self.flushed_at = time.monotonic()
+        for (namespace, kind), count in counts.items():
+            key = cache_key('stats', namespace, kind)
+            cache.add(key, 0, None)
+            try:
+                cache.incr(key, count)
+            except ValueError:
+                # evicted between the add and the incr
+                cache.set(key, count, None)
+
+    def keys(self):
+        return {(namespace, kind): cache_key('stats', namespace, kind)
+            for namespace in CACHE_STATS_NAMESPACES for kind in ('hits', 'misses')}
+
+    def shared(self):
+        # {namespace: (hits, misses)} across every process that has flushed, namespaces with reads only
+        keys = self.keys()
+        values = cache.get_many(keys.values())
+        stats = {namespace: (values.get(keys[namespace, 'hits'], 0), values.get(keys[namespace, 'misses'], 0))
+            for namespace in CACHE_STATS_NAMESPACES}
+        return {namespace: counts for namespace, counts in stats.items() if any(counts)}
+
+    def reset(self):
+        cache.delete_many(self.keys().values())
+
+
+cache_stats = CacheStats()
+
+
+def get_or_build(key, build, timeout, refresh=False):
+    # read through the cache, counting the hit or miss. Nothing is cached if build() returns None
+    value = None if refresh else cache.get(key)
+    if not refresh:
+        cache_stats.record(key, value is not None)
+    if value is None:
+        value = build()
+        if value is not None:
+            cache.set(key, value, timeout)
+    return value
@@ -0,0 +1,73 @@
+from django.conf import settings
+
+from .cache import cache, cache_key
+
+TRACKING_CURSOR_CACHE = 'cache'
+TRACKING_CURSOR_SESSION = 'session'
+
+_missing = object()
+
+
+class TrackingCursor:
+    '''
+    Per browser session tracking state read and written on almost every request:
+        page_view_instance_guid   the page view the next request closes out
+        live_test_guid            the live test the session is locked to, None if there isn't one
+        question_view             the question the one page test UI is showing, and its page view
+    Kept in the cache under the session key and written once at the end of the request, so
+    tracking doesn't rewrite the session row every time. With TRACKING_CURSOR_STORE = 'session'
+    it lives in the session like it used to.
+    '''
+
+    def __init__(self, request):
+        self.request = request
+        self.modified = False
+        self._state = None
+
+    @property
+    def uses_session(self):
+        return settings.TRACKING_CURSOR_STORE == TRACKING_CURSOR_SESSION
+
+    @property
+    def key(self):
+        session_key = self.request.session.session_key
+        return cache_key('tracking_cursor', session_key) if session_key else None
+
+    @property
+    def state(self):
+        if self._state is None:
+            if self.uses_session:
+                self._state = self.request.session
+            else:
+                key = self.key
+                self._state = (cache.get(key) if key else None) or {}
+        return self._state
+
+    def __contains__(self, name):
+        return name in self.state
+
+    def __getitem__(self, name):
+        return self.state[name]
+
+    def __setitem__(self, name, value):
+        if self.state.get(name, _missing) != value:
+            self.state[name] = value
+            self.modified = True
+
+    def get(self, name, default=None):
+        return self.state.get(name, default)
+
+    def pop(self, name, default=None):
+        if name not in self.state:
+            return default
+        self.modified = True
+        return self.state.pop(name)
+
+    def save(self):
+        # the session saves itself when the cursor lives in it
+        if not self.modified or self.uses_session:
+            return
+        key = self.key
+        if key:
+            cache.set(key, self._state, settings.TRACKING_CURSOR_CACHE_SECONDS)
+        self.modified = False
@@ -0,0 +1,107 @@
+from django.conf import settings
+from django.db.models import Count, IntegerField, Max, OuterRef, Subquery
+from django.db.models.functions import Coalesce
+from django.urls import reverse
+
+from .cache import COURSE_CATALOG, cache, cache_key, cache_version, get_or_build
+from .utils import human_time_duration
+
+TEST_STATUS_NONE = 'No tests'
+TEST_STATUS_NOT_STARTED = 'Not started'
+TEST_STATUS_IN_PROGRESS = 'In progress'
+TEST_STATUS_PASSED = 'Passed'
+TEST_STATUS_FAILED = 'Failed'
+
+
+def dashboard_cache_key(student_pk, catalog_version=None):
+    # cards show course names, page counts and live tests, so they follow the course catalog version
+    return cache_key('student_dashboard', student_pk, catalog_version or cache_version(COURSE_CATALOG))
+
+
+def invalidate_student_dashboard(*student_pks):
+    student_pks = [pk for pk in student_pks if pk]
+    if not student_pks:
+        return
+    catalog_version = cache_version(COURSE_CATALOG)
+    cache.delete_many([dashboard_cache_key(pk, catalog_version) for pk in student_pks])
+
+
+def progress_percent(course, course_view_instance):
+    if course_view_instance is None:
+        return 0
+    if course.enforce_minimum_time:
+        if not course.minimum_time_seconds:
+            return 100
+        return min(100, int(course_view_instance.total_seconds_spent * 100 / course.minimum_time_seconds))
+    # without a time requirement progress is how far into the pages the student has read
+    if not course.last_page_number or course_view_instance.last_course_page is None:
+        return 0
+    return min(100, int(course_view_instance.last_course_page.page_number * 100 / course.last_page_number))
+
+
+def test_status(live_test_count, test_instances):
+    if not live_test_count:
+        return TEST_STATUS_NONE
+    if not test_instances:
+        return TEST_STATUS_NOT_STARTED
+    if any(instance.test_finished_on is None for instance in test_instances):
+        return TEST_STATUS_IN_PROGRESS
+    passed = [instance for instance in test_instances if instance.test_passed]
+    if len(passed) >= live_test_count:
+        return TEST_STATUS_PASSED
+    if len(test_instances) >= live_test_count:
+        return TEST_STATUS_FAILED
+    return TEST_STATUS_IN_PROGRESS
+
+
+def build_student_dashboard_cards(student_pk):
+    # fixed number of queries no matter how many courses are published:
+    # courses, course view instances, current live test attempts with their stored scores
+    from .models import Course, CoursePage, CourseTest, CourseViewInstance, CourseTestInstance
+
+    courses = list(Course.objects.filter(published=True).annotate(
+        last_page_number=Subquery(CoursePage.objects.filter(course=OuterRef('pk')).order_by()
+            .values('course').annotate(last=Max('page_number')).values('last'),
+            output_field=IntegerField()),
+        live_test_count=Coalesce(Subquery(CourseTest.objects.filter(course=OuterRef('pk'),
+            only_practice_test=False).order_by().values('course').annotate(total=Count('pk'))
+            .values('total'), output_field=IntegerField()), 0),
+    ).order_by('pk'))
+
+    course_view_instances = {
+        instance.course_id: instance
+        for instance in CourseViewInstance.objects.filter(student_id=student_pk,
+            course__published=True).select_related('last_course_page')
+    }
+
+    test_instances = {}
+    for instance in CourseTestInstance.objects.filter(student_id=student_pk, is_practice=False,
+        retake__isnull=True, course_test__course__published=True,
+        course_test__only_practice_test=False).select_related('course_test'):
+        test_instances.setdefault(instance.course_test.course_id, []).append(instance)
+
+    cards = []
+    for course in courses:
+        course_view_instance = course_view_instances.get(course.pk)
+        time_remaining = ''
+        if course.enforce_minimum_time:
+            seconds_spent = course_view_instance.total_seconds_spent if course_view_instance else 0
+            seconds_remaining = max(course.minimum_time_seconds - seconds_spent, 0)
+            if seconds_remaining:
+                time_remaining = human_time_duration(seconds_remaining)
+        cards.append({
+            'course_guid': str(course.guid),
+            'name': course.name,
+            'home_url': reverse('course_home', kwargs={'course_guid':course.guid}),
+            'resume_url': course_view_instance.last_url if course_view_instance else '',
+            'progress_percent': progress_percent(course, course_view_instance),
+            'time_remaining': time_remaining,
+            'test_status': test_status(course.live_test_count, test_instances.get(course.pk, [])),
+        })
+    return cards
+
+
+def student_dashboard_cards(student_pk):
+    # takes the pk from the cached principal, the dashboard never needs the student row
+    return get_or_build(dashboard_cache_key(student_pk), lambda: build_student_dashboard_cards(student_pk),
+        settings.STUDENT_DASHBOARD_CACHE_SECONDS)
@@ -1,12 +1,15 @@
 from django.conf import settings
-from django.http import HttpResponseRedirect
+from django.http import HttpResponseRedirect, Http404
+from django.core.exceptions import ObjectDoesNotExist, ValidationError
 from django.contrib import messages
 from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
 
 
 from .models import (Student, StudentIdentificationDocument, Course, CoursePage,
     CoursePageMedia, CourseTest, MultipleChoiceAnswer, MultipleChoiceTestQuestion,
     CourseViewInstance, CoursePageViewInstance, CourseTestQuestionInstance)
+from .tracking import record_page_view_start, record_page_view_stop
 
 def student_login_required(function):
     def wrapper(request, *args, **kwargs):
@@ -18,11 +21,18 @@ def student_login_required(function):
             student = Student.objects.get_or_create_from_user(user=user)
             student_id = str(student.guid)
             request.session['student_id'] = student_id
-        request.student = Student.objects.get(guid=student_id)
-        if request.student.is_verified:
+        principal = Student.objects.get_principal(student_id)
+        if principal is None:
+            # stale session pointing at a deleted student, start over
+            request.session.pop('student_id', None)
+            return HttpResponseRedirect('/accounts/login')
+        request.student_principal = principal
+        # the student row is only loaded if the view or template actually uses it
+        request.student = SimpleLazyObject(lambda: Student.objects.get(pk=principal['pk']))
+        if principal['verified']:
             return function(request, *args, **kwargs)
         elif request.path != settings.LOGIN_REDIRECT_URL:
-            if request.student.verification_ready_on:
+            if principal['verification_ready']:
                 messages.add_message(request, messages.SUCCESS, '''
                     All of your verification documents have been uploaded. You will receive an email
                     when you account has been verified''')
@@ -34,74 +44,134 @@ def student_login_required(function):
         return HttpResponseRedirect(settings.STUDENT_PROFILE_URL)
     return wrapper
 
-def get_tracking_models(request, *args, **kwargs):
-    student, course_obj, course_page, course_test, test_question, course_test_instance = (None,
-        None, None, None, None, None)
-    
-    student_id = request.session.get('student_id', None)
-    if student_id:
-        student = Student.objects.get(guid=student_id)
-    else:
-        student = Student.objects.get(user=request.user)
-
-    if 'course_guid' in kwargs:
-        course_obj = Course.objects.get(guid=kwargs['course_guid'])
-    if 'page_guid' in kwargs:
-        course_page = CoursePage.objects.get(guid=kwargs['page_guid'])
-    if 'test_guid' in kwargs:
-        course_test = CourseTest.objects.get(guid=kwargs['test_guid'])
-    if 'question_guid' in kwargs:
-        test_question = MultipleChoiceTestQuestion.objects.get(guid=kwargs['question_guid'])
-        course_test = test_question.course_test
-    if 'question_instance_guid' in kwargs:
-        test_question_instance = CourseTestQuestionInstance.objects.get(
-            guid=kwargs['question_instance_guid'])
-        course_test_instance = test_question_instance.course_test_instance
-        test_question = test_question_instance.course_test_question
-        course_test = course_test_instance.course_test
-
-    if course_obj is None and course_page:
-        course_obj = course_page.course
-    if course_obj is None and course_test:
-        course_obj = course_test.course
-
-    return (student, course_obj, course_page, course_test, test_question, course_test_instance)
-
-def get_or_create_course_view_instance(student, course_obj):
+class TrackingContext:
+    '''
+    Everything page tracking needs for one request. Each url kind is resolved with a single
+    select_related query and the instances are handed to the view on request.tracking so
+    the view doesn't look them up again.
+    '''
+
+    def __init__(self, student_id=None, course=None, course_page=None, course_test=None,
+        test_question=None, course_test_instance=None, test_question_instance=None):
+        self.student_id = student_id
+        self.course = course
+        self.course_page = course_page
+        self.course_test = course_test
+        self.test_question = test_question
+        self.course_test_instance = course_test_instance
+        self.test_question_instance = test_question_instance
+        self.course_view_instance = None
+        self.page_view_instance = None
+
+    @classmethod
+    def from_url_kwargs(cls, student_id, **kwargs):
+        try:
+            if 'question_instance_guid' in kwargs:
+                test_question_instance = CourseTestQuestionInstance.objects.select_related(
+                    'course_test_instance__course_test__course', 'course_test_question',
+                ).get(guid=kwargs['question_instance_guid'])
+                course_test_instance = test_question_instance.course_test_instance
+                course_test = course_test_instance.course_test
+                return cls(student_id=student_id, course=course_test.course, course_test=course_test,
+                    test_question=test_question_instance.course_test_question,
+                    course_test_instance=course_test_instance,
+                    test_question_instance=test_question_instance)
+            if 'question_guid' in kwargs:
+                test_question = MultipleChoiceTestQuestion.objects.select_related(
+                    'course_test__course').get(guid=kwargs['question_guid'])
+                return cls(student_id=student_id, course=test_question.course_test.course,
+                    course_test=test_question.course_test, test_question=test_question)
+            if 'page_guid' in kwargs:
+                course_page = CoursePage.objects.select_related('course').get(guid=kwargs['page_guid'])
+                return cls(student_id=student_id, course=course_page.course, course_page=course_page)
+            if 'test_guid' in kwargs:
+                course_test = CourseTest.objects.select_related('course').get(guid=kwargs['test_guid'])
+                return cls(student_id=student_id, course=course_test.course, course_test=course_test)
+            if 'course_guid' in kwargs:
+                return cls(student_id=student_id, course=Course.objects.get(guid=kwargs['course_guid']))
+        except (ObjectDoesNotExist, ValidationError):
+            raise Http404
+        return cls(student_id=student_id)
+
+def get_tracking_context(request, *args, **kwargs):
+    # tracking only needs the student's pk, which student_login_required has already cached
+    return TrackingContext.from_url_kwargs(request.student_principal['pk'], **kwargs)
+
+def get_or_create_course_view_instance(student_id, course_obj):
     try:
-        course_view_instance = CourseViewInstance.objects.get(student=student, course=course_obj)
+        course_view_instance = CourseViewInstance.objects.get(student_id=student_id, course=course_obj)
     except CourseViewInstance.DoesNotExist:
-        course_view_instance = CourseViewInstance.objects.create(student=student, course=course_obj,
+        course_view_instance = CourseViewInstance.objects.create(student_id=student_id, course=course_obj,
             course_view_start=timezone.now(), pages_require_signature=course_obj.pages_require_signature,
             page_signature_description=course_obj.page_signature_description)
-        course_view_instance.save()
-        return get_or_create_course_view_instance(student, course_obj)
+    # reuse the course we already hold instead of lazy loading it again
+    course_view_instance.course = course_obj
 
     return course_view_instance
 
-def create_page_view_instance(request, student, course_obj, course_page, course_test,
+def create_page_view_instance(request, student_id, course_obj, course_page, course_test,
  test_question, course_view_instance, course_test_instance):
-    page_view_instance = CoursePageViewInstance.objects.create(url=request.path, 
+    page_view_instance = CoursePageViewInstance(url=request.path, 
         course_view_instance=course_view_instance, page_view_start=timezone.now(), 
         course_page=course_page, course_test=course_test, 
-        course_test_question=test_question, student=student,
+        course_test_question=test_question, student_id=student_id,
         course_test_instance=course_test_instance)
-    page_view_instance.save()
-    # add page view guid to session so middleware can mark it complete
+    # written now or queued for the background flusher depending on PAGE_VIEW_TRACKING_MODE
+    record_page_view_start(page_view_instance)
+    # add page view guid to the tracking cursor so middleware can mark it complete
     # even outside of page tracking
-    request.session['page_view_instance_guid'] = str(page_view_instance.guid)
+    request.tracking_cursor['page_view_instance_guid'] = str(page_view_instance.guid)
+
+    return page_view_instance
+
+def stop_question_view(request, question_instance_guid=None):
+    # closes the question view on the tracking cursor, only if it's for the given question when
+    # one is given. Each view is closed once, so a resent beacon can't credit it again
+    question_view = request.tracking_cursor.get('question_view')
+    if not question_view or (question_instance_guid is not None and
+        question_view['question_instance_guid'] != str(question_instance_guid)):
+        return None
+    request.tracking_cursor.pop('question_view')
+    record_page_view_stop(question_view['page_view_instance_guid'], timezone.now())
+    return question_view['page_view_instance_guid']
+
+def start_question_view(request, student_id, question_instance):
+    # the client side test UI reports by beacon when a question is shown and hidden instead of
+    # loading pages. Both ends are timed here, so the view is credited and clamped to the
+    # course's maximum idle time like any other page view
+    stop_question_view(request)
+    course_test_instance = question_instance.course_test_instance
+    course_view_instance = get_or_create_course_view_instance(student_id,
+        course_test_instance.course_test.course)
+    page_view_instance = CoursePageViewInstance(url=question_instance.url,
+        course_view_instance=course_view_instance, page_view_start=timezone.now(),
+        course_test=course_test_instance.course_test,
+        course_test_question=question_instance.course_test_question, student_id=student_id,
+        course_test_instance=course_test_instance)
+    record_page_view_start(page_view_instance)
+    request.tracking_cursor['question_view'] = {
+        'page_view_instance_guid': str(page_view_instance.guid),
+        'question_instance_guid': str(question_instance.guid),
+    }
 
     return page_view_instance
 
 
 def page_tracking_enabled(function):
     def wrapper(request, *args, **kwargs):
-        (student, course_obj, course_page, course_test, 
-            test_question, course_test_instance) = get_tracking_models(request, *args, **kwargs)
-        request.course_view_instance = get_or_create_course_view_instance(student, course_obj)
-        request.page_view_instance = create_page_view_instance(request, student, course_obj, course_page,
-            course_test, test_question, request.course_view_instance, course_test_instance)
+        tracking = get_tracking_context(request, *args, **kwargs)
+        tracking.course_view_instance = get_or_create_course_view_instance(tracking.student_id,
+            tracking.course)
+        tracking.page_view_instance = create_page_view_instance(request, tracking.student_id,
+            tracking.course, tracking.course_page, tracking.course_test, tracking.test_question,
+            tracking.course_view_instance, tracking.course_test_instance)
+        if tracking.test_question_instance:
+            tracking.page_view_instance.question_number = tracking.test_question_instance.order
+        tracking.course.push_url_recent_history(tracking.student_id, tracking.page_view_instance)
+        request.tracking = tracking
+        request.course_view_instance = tracking.course_view_instance
+        request.page_view_instance = tracking.page_view_instance
 
         return function(request, *args, **kwargs)
 
-    return wrapper
\ No newline at end of file
+    return wrapper
@@ -1,20 +1,11 @@
 from django import forms
 from .models import (Student, StudentIdentificationDocument, Course, CoursePage,
-    CoursePageMedia, CourseTest, MultipleChoiceAnswer, MultipleChoiceTestQuestion, 
-    CourseTestQuestionAnswerOption)
+    CoursePageMedia, CourseTest, MultipleChoiceAnswer, MultipleChoiceTestQuestion)
 from django.utils.safestring import mark_safe
 from intl_tel_input.widgets import IntlTelInputWidget
 from django.core.exceptions import ValidationError
-from uuid import UUID
 
 
-def is_valid_uuid(uuid_to_test, version=4):
-    try:
-        uuid_obj = UUID(uuid_to_test, version=version)
-    except ValueError:
-        return False
-    return str(uuid_obj) == uuid_to_test
-
 class CourseStudentSignatureForm(forms.Form):
     pass
 
@@ -37,17 +28,14 @@ class TestQuestionInstanceForm(forms.Form):
     def __init__(self, *args, **kwargs):
         question_instance = kwargs.pop('question_instance')
         retval = super(TestQuestionInstanceForm, self).__init__(*args, **kwargs)
-        CHOICES = [(answer.guid,answer.value) for answer in question_instance.answer_options ]
+        # the question's own options, already loaded for display. Only these are valid answers
+        self.answer_options = {str(option.guid): option for option in question_instance.answer_options}
+        CHOICES = [(guid, option.value) for guid, option in self.answer_options.items()]
         self.fields['answer']=forms.CharField(label='', widget=forms.RadioSelect(choices=CHOICES))
 
     def clean_answer(self):
-        guid = self.cleaned_data['answer']
-        if not is_valid_uuid(guid):
-            raise ValidationError("Invalid multiple choice answer")
-        # valid uuid safe to look up
-        try:
-            answer_option = CourseTestQuestionAnswerOption.objects.get(guid=guid)
-        except CourseTestQuestionAnswerOption.DoesNotExist:
+        answer_option = self.answer_options.get(self.cleaned_data['answer'])
+        if answer_option is None:
             raise ValidationError("Invalid multiple choice answer")
         return answer_option.answer_option
         
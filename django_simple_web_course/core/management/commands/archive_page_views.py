@@ -0,0 +1,48 @@
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+from django.utils import timezone
+
+from core.models import CoursePageViewInstance
+
+
+class Command(BaseCommand):
+    help = ('Roll page views older than PAGE_VIEW_RETENTION_DAYS up into daily rollups and delete '
+        'them from the page view table, in batches. Course time totals are unchanged.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--days', type=int, default=settings.PAGE_VIEW_RETENTION_DAYS,
+            help='Archive page views older than this many days')
+        parser.add_argument('--batch-size', type=int, default=settings.PAGE_VIEW_ARCHIVE_BATCH_SIZE)
+        parser.add_argument('--dry-run', action='store_true',
+            help='Only report how many page views would be archived')
+        parser.add_argument('--loop', action='store_true',
+            help='Keep running and archive every PAGE_VIEW_ARCHIVE_INTERVAL_SECONDS')
+        parser.add_argument('--interval', type=int, default=settings.PAGE_VIEW_ARCHIVE_INTERVAL_SECONDS)
+
+    def archive(self, before, batch_size):
+        archived = 0
+        while True:
+            # each batch is its own short transaction so tracking writes are never held up for long
+            batch = CoursePageViewInstance.objects.archive_batch(before, batch_size)
+            if not batch:
+                return archived
+            archived += batch
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            before = timezone.now() - timedelta(days=options['days'])
+            if options['dry_run']:
+                self.stdout.write('%s page views older than %s days would be archived' % (
+                    CoursePageViewInstance.objects.archivable(before).count(), options['days']))
+                return
+            archived = self.archive(before, options['batch_size'])
+            if archived or not options['loop']:
+                self.stdout.write('Archived %s page views' % archived)
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,64 @@
+import multiprocessing
+from datetime import date, timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connections
+from django.db.models import Min
+from django.utils import timezone
+
+from core.models import CoursePageViewInstance, CoursePageViewRollup, CourseTestInstance
+from core.reporting import activity_day, rebuild_activity
+
+
+def rebuild_chunk(days):
+    # runs in a worker process with its own database connection
+    try:
+        return days, rebuild_activity(*days)
+    finally:
+        connections.close_all()
+
+
+class Command(BaseCommand):
+    help = ('Rebuild the daily activity rollups from the page view and test tables, a chunk of days '
+        'per worker process. Defaults to everything up to yesterday; today is kept current by tracking.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--since', type=date.fromisoformat, help='First day to rebuild, YYYY-MM-DD')
+        parser.add_argument('--until', type=date.fromisoformat, help='Last day to rebuild, YYYY-MM-DD')
+        parser.add_argument('--chunk-days', type=int, default=7)
+        parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count())
+
+    def first_activity_day(self):
+        days = [activity_day(first) for first in (
+            CoursePageViewInstance.objects.aggregate(first=Min('created'))['first'],
+            CourseTestInstance.objects.filter(is_practice=False).aggregate(first=Min('test_started_on'))['first'],
+        ) if first]
+        first_archived_day = CoursePageViewRollup.objects.aggregate(first=Min('day'))['first']
+        if first_archived_day:
+            days.append(first_archived_day)
+        return min(days, default=None)
+
+    def handle(self, *args, **options):
+        first_day = options['since'] or self.first_activity_day()
+        last_day = options['until'] or activity_day(timezone.now()) - timedelta(days=1)
+        if first_day is None or first_day > last_day:
+            self.stdout.write('Nothing to backfill')
+            return
+        if options['chunk_days'] < 1 or options['workers'] < 1:
+            raise CommandError('--chunk-days and --workers must be at least 1')
+
+        chunks = []
+        while first_day <= last_day:
+            chunk_last_day = min(first_day + timedelta(days=options['chunk_days'] - 1), last_day)
+            chunks.append((first_day, chunk_last_day))
+            first_day = chunk_last_day + timedelta(days=1)
+
+        # forked workers must not share the parent's connection
+        connections.close_all()
+        with multiprocessing.get_context('fork').Pool(min(options['workers'], len(chunks))) as pool:
+            total = 0
+            for (chunk_first_day, chunk_last_day), rows in pool.imap_unordered(rebuild_chunk, chunks):
+                total += rows
+                self.stdout.write('%s to %s: %s student rows' % (chunk_first_day, chunk_last_day, rows))
+        self.stdout.write(self.style.SUCCESS('Rebuilt %s days of activity, %s student rows' % (
+            (last_day - chunks[0][0]).days + 1, total)))
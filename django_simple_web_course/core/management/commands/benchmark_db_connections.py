@@ -0,0 +1,55 @@
+import statistics
+import time
+
+from django.core import signals
+from django.core.management.base import BaseCommand
+from django.db import connection
+
+from core.models import Course
+
+
+class Command(BaseCommand):
+    help = ('Time a cheap request (one query between request_started and request_finished, the '
+        'same points where Django opens and closes connections) with a new connection per request '
+        'and then with the configured persistent connections.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=200)
+        parser.add_argument('--conn-max-age', type=int,
+            help='Persistent connection age to compare against, defaults to CONN_MAX_AGE')
+
+    def simulate_requests(self, count, conn_max_age):
+        connection.close()
+        connection.settings_dict['CONN_MAX_AGE'] = conn_max_age
+        timings, connects, last_connection = [], 0, None
+        for i in range(count):
+            start = time.perf_counter()
+            signals.request_started.send(sender=self.__class__)
+            list(Course.objects.filter(published=True).values_list('pk')[:1])
+            if connection.connection is not last_connection:
+                connects += 1
+                last_connection = connection.connection
+            signals.request_finished.send(sender=self.__class__)
+            timings.append((time.perf_counter() - start) * 1000)
+        connection.close()
+        return timings, connects
+
+    def report(self, label, timings, connects):
+        timings = sorted(timings)
+        self.stdout.write('%-32s connects %5s  p50 %7.2fms  p95 %7.2fms  mean %7.2fms' % (label, connects,
+            statistics.median(timings), timings[int(len(timings) * 0.95) - 1], statistics.mean(timings)))
+
+    def handle(self, *args, **options):
+        configured_max_age = connection.settings_dict['CONN_MAX_AGE']
+        conn_max_age = configured_max_age if options['conn_max_age'] is None else options['conn_max_age']
+        # one throwaway connection so neither run pays for the first connect on its own
+        self.simulate_requests(1, 0)
+        try:
+            before = self.simulate_requests(options['requests'], 0)
+            after = self.simulate_requests(options['requests'], conn_max_age)
+        finally:
+            connection.settings_dict['CONN_MAX_AGE'] = configured_max_age
+        self.report('connection per request', *before)
+        self.report('CONN_MAX_AGE=%s' % conn_max_age, *after)
+        saved = statistics.median(before[0]) - statistics.median(after[0])
+        self.stdout.write(self.style.SUCCESS('Persistent connections save %.2fms per request at p50' % saved))
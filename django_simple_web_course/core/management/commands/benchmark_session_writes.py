@@ -0,0 +1,69 @@
+import time
+
+from django.conf import settings
+from django.contrib.sessions.models import Session
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test import Client
+from django.test.utils import CaptureQueriesContext, override_settings
+from django.urls import reverse
+from django.utils import timezone
+
+from core.cursors import TRACKING_CURSOR_CACHE, TRACKING_CURSOR_SESSION
+from core.models import Course, CoursePage, Student
+from users.models import User
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Browse course pages as a seeded student with the tracking cursors kept in the session and '
+        'then in the cache, and count the session table writes per request. Everything is rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=50)
+
+    def seed(self):
+        user = User.objects.create_user(email='benchmark-session-writes@example.com', password=None)
+        student = Student.objects.get_or_create_from_user(user=user)
+        student.verified_on = timezone.now()
+        student.save()
+        course = Course.objects.create(name='Session write benchmark', published=True)
+        pages = CoursePage.objects.bulk_create([CoursePage(course=course, page_number=number,
+            page_title='Page %s' % number) for number in range(1, 11)])
+        return user, [reverse('course_page', kwargs={'page_guid':page.guid}) for page in pages]
+
+    def browse(self, user, urls, requests):
+        client = Client()
+        client.force_login(user)
+        # first request sets up the student and cursors, it isn't counted
+        client.get(urls[0])
+        session_table = Session._meta.db_table
+        writes, timings = 0, []
+        for i in range(requests):
+            with CaptureQueriesContext(connection) as queries:
+                start = time.perf_counter()
+                client.get(urls[i % len(urls)])
+                timings.append((time.perf_counter() - start) * 1000)
+            writes += len([query for query in queries.captured_queries if session_table in query['sql']
+                and query['sql'].lstrip().upper().startswith(('UPDATE', 'INSERT'))])
+        return writes / requests, sum(timings) / requests
+
+    def handle(self, *args, **options):
+        results = []
+        try:
+            with transaction.atomic(), override_settings(PAGE_VIEW_TRACKING_MODE='sync',
+                ALLOWED_HOSTS=settings.ALLOWED_HOSTS + ['testserver']):
+                user, urls = self.seed()
+                for store in (TRACKING_CURSOR_SESSION, TRACKING_CURSOR_CACHE):
+                    with override_settings(TRACKING_CURSOR_STORE=store):
+                        results.append((store,) + self.browse(user, urls, options['requests']))
+                raise Rollback
+        except Rollback:
+            pass
+        self.stdout.write('SESSION_ENGINE %s' % settings.SESSION_ENGINE)
+        for store, writes, mean in results:
+            self.stdout.write('cursors in %-8s session writes per request %.2f  mean %.2fms' % (store, writes,
+                mean))
@@ -0,0 +1,22 @@
+from django.core.management.base import BaseCommand
+
+from core.cache import cache_stats
+
+
+class Command(BaseCommand):
+    help = 'Show cache hits and misses per key namespace, summed over every process'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--reset', action='store_true', help='Zero the counters after showing them')
+
+    def handle(self, *args, **options):
+        cache_stats.flush()
+        stats = cache_stats.shared()
+        if not stats:
+            self.stdout.write('No cache reads counted yet')
+        for namespace, (hits, misses) in sorted(stats.items()):
+            total = hits + misses
+            self.stdout.write('%-28s hits %8s  misses %8s  hit rate %5.1f%%' % (namespace, hits, misses,
+                hits * 100 / total if total else 0))
+        if options['reset']:
+            cache_stats.reset()
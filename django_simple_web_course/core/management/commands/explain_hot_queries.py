@@ -0,0 +1,159 @@
+import random
+import re
+from datetime import timedelta
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection, transaction
+from django.utils import timezone
+
+from core.models import (Course, CoursePage, CoursePageViewInstance, CourseTest, CourseTestInstance,
+    CourseTestQuestionAnswerOption, CourseTestQuestionInstance, CourseViewInstance, MultipleChoiceAnswer,
+    MultipleChoiceTestQuestion, Student)
+from users.models import User
+
+INDEX_USED = re.compile(r'(?:Index Scan|Index Only Scan) using (\w+)|Bitmap Index Scan on (\w+)')
+
+
+class Rollback(Exception):
+    pass
+
+
+class Command(BaseCommand):
+    help = ('Seed a large throwaway dataset, EXPLAIN every hot query shape against it and fail if '
+        'any of them doesn\'t use the index added for it. Everything runs in a transaction that is '
+        'rolled back.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--students', type=int, default=200)
+        parser.add_argument('--courses', type=int, default=40)
+        parser.add_argument('--pages', type=int, default=50, help='Pages per course')
+        parser.add_argument('--page-views', type=int, default=200, help='Page views per student')
+        parser.add_argument('--tests', type=int, default=5, help='Finished practice tests per student')
+        parser.add_argument('--seed', type=int, default=0)
+        parser.add_argument('--verbose-plans', action='store_true', help='Print every query plan')
+
+    def seed(self, options):
+        rng = random.Random(options['seed'])
+        now = timezone.now()
+
+        courses = Course.objects.bulk_create([Course(name='Explain course %s' % i, published=True)
+            for i in range(options['courses'])])
+        pages = CoursePage.objects.bulk_create([CoursePage(course=course, page_number=number,
+            page_title='Page %s' % number) for course in courses for number in range(1, options['pages'] + 1)])
+        course_tests = CourseTest.objects.bulk_create([CourseTest(course=course, order=1, test_is_timed=True)
+            for course in courses])
+        answers = MultipleChoiceAnswer.objects.bulk_create([MultipleChoiceAnswer(value='Answer %s' % i)
+            for i in range(40)])
+        questions = MultipleChoiceTestQuestion.objects.bulk_create([
+            MultipleChoiceTestQuestion(course_test=course_test, question_contents='Question %s' % i,
+                correct_multiple_choice_answer=answers[i])
+            for course_test in course_tests for i in range(10)])
+
+        users = User.objects.bulk_create([User(email='explain-%s-%s@example.com' % (options['seed'], i),
+            password='!') for i in range(options['students'])])
+        students = Student.objects.bulk_create([Student(user=user) for user in users])
+
+        course_view_instances = CourseViewInstance.objects.bulk_create([
+            CourseViewInstance(student=student, course=course) for student in students for course in courses])
+        course_pages = {}
+        for page in pages:
+            course_pages.setdefault(page.course_id, []).append(page)
+        CoursePageViewInstance.objects.bulk_create([
+            CoursePageViewInstance(course_view_instance=course_view_instance,
+                student_id=course_view_instance.student_id, course_page=page,
+                url='/course_page/%s/' % page.guid, page_view_start=now, page_view_stop=now)
+            for course_view_instance in course_view_instances
+            for page in rng.choices(course_pages[course_view_instance.course_id],
+                k=options['page_views'] // len(courses))], batch_size=5000)
+
+        test_instances = []
+        for student in students:
+            for course_test in rng.sample(course_tests, min(2, len(course_tests))):
+                for i in range(options['tests']):
+                    test_instances.append(CourseTestInstance(student=student, course_test=course_test,
+                        is_practice=True, test_started_on=now, deadline_at=now, test_finished_on=now))
+                test_instances.append(CourseTestInstance(student=student, course_test=course_test,
+                    is_practice=False, test_started_on=now, deadline_at=now + timedelta(hours=1)))
+        # a few pooled practice tests nobody has claimed yet
+        for course_test in course_tests:
+            test_instances.extend(CourseTestInstance(course_test=course_test, is_practice=True)
+                for i in range(20))
+        test_instances = CourseTestInstance.objects.bulk_create(test_instances, batch_size=5000)
+
+        course_questions = {}
+        for question in questions:
+            course_questions.setdefault(question.course_test_id, []).append(question)
+        question_instances = CourseTestQuestionInstance.objects.bulk_create([
+            CourseTestQuestionInstance(course_test_instance=test_instance, course_test_question=question,
+                order=order)
+            for test_instance in test_instances
+            for order, question in enumerate(course_questions[test_instance.course_test_id], start=1)],
+            batch_size=5000)
+        CourseTestQuestionAnswerOption.objects.bulk_create([
+            CourseTestQuestionAnswerOption(question_instance=question_instance, answer_option=answer,
+                order=order)
+            for question_instance in question_instances
+            for order, answer in enumerate(rng.sample(answers, 4), start=1)], batch_size=5000)
+
+        with connection.cursor() as cursor:
+            cursor.execute('ANALYZE')
+        return rng.choice(students), rng.choice(courses), course_tests[0], rng.choice(question_instances)
+
+    def hot_queries(self, student, course, course_test, question_instance):
+        course_view_instance = CourseViewInstance.objects.filter(student=student, course=course).first()
+        test_instance = question_instance.course_test_instance
+        return [
+            # (name, queryset, index the plan has to use)
+            ('left nav recent history', course.recent_history_queryset(student.pk),
+                'page_view_cvi_created_idx'),
+            ('newest page views of a course view', CoursePageViewInstance.objects.filter(
+                course_view_instance=course_view_instance).order_by('-created')[:1],
+                'page_view_cvi_created_idx'),
+            ('active practice test lookup', course_test.course_test_instances.filter(student=student,
+                test_finished_on__isnull=True, is_practice=True).exclude(deadline_at__lte=timezone.now()),
+                'test_instance_student_idx'),
+            ('live test detection', CourseTestInstance.objects.filter(is_practice=False, student=student,
+                test_started_on__isnull=False, test_finished_on__isnull=True), 'test_instance_active_idx'),
+            ('live test lookup', course_test.course_test_instances.filter(student=student, is_practice=False,
+                retake__isnull=True), 'test_instance_student_idx'),
+            ('practice pool claim', CourseTestInstance.objects.practice_pool(course_test).order_by(
+                'created')[:1], 'test_instance_pool_idx'),
+            ('expired test sweep', CourseTestInstance.objects.expired(), 'test_instance_deadline_idx'),
+            ('question instances of a test', CourseTestQuestionInstance.objects.filter(
+                course_test_instance=test_instance).order_by('order'), 'unique_test_question_order'),
+            ('answer options of a question', CourseTestQuestionAnswerOption.objects.filter(
+                question_instance=question_instance).order_by('order'), 'answer_option_question_idx'),
+            ('pages of a course', CoursePage.objects.filter(course=course).order_by('page_number'),
+                'unique_course_page_number'),
+        ]
+
+    def check_plans(self, hot_queries, verbose):
+        failures = []
+        for name, queryset, index in hot_queries:
+            plan = queryset.explain()
+            indexes = sorted({used for match in INDEX_USED.findall(plan) for used in match if used})
+            missed = index not in indexes
+            if missed:
+                failures.append(name)
+                self.stdout.write(self.style.ERROR('%s: %s not used, plan used %s' % (name, index,
+                    ', '.join(indexes) or 'no index')))
+            else:
+                self.stdout.write(self.style.SUCCESS('%s: %s' % (name, ', '.join(indexes))))
+            if verbose or missed:
+                self.stdout.write(plan)
+        return failures
+
+    def handle(self, *args, **options):
+        if connection.vendor != 'postgresql':
+            raise CommandError('explain_hot_queries needs PostgreSQL')
+        failures = []
+        try:
+            with transaction.atomic():
+                self.stdout.write('Seeding %(students)s students, %(courses)s courses...' % options)
+                failures = self.check_plans(self.hot_queries(*self.seed(options)), options['verbose_plans'])
+                raise Rollback
+        except Rollback:
+            pass
+        if failures:
+            raise CommandError('%s hot queries don\'t use their index: %s' % (len(failures),
+                ', '.join(failures)))
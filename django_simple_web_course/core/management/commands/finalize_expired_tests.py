@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.dashboard import invalidate_student_dashboard
+from core.models import CourseTestInstance
+from core.routing import record_routing_test_finished
+
+
+class Command(BaseCommand):
+    help = 'Finish and score every timed test that has passed its deadline'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--loop', action='store_true',
+            help='Keep running and sweep every EXPIRED_TEST_SWEEP_INTERVAL_SECONDS')
+        parser.add_argument('--interval', type=int, default=settings.EXPIRED_TEST_SWEEP_INTERVAL_SECONDS)
+
+    def sweep(self):
+        expired_tests = CourseTestInstance.objects.finalize_expired()
+        for pk, guid, student_id in expired_tests:
+            record_routing_test_finished(guid)
+        invalidate_student_dashboard(*{student_id for pk, guid, student_id in expired_tests})
+        return len(expired_tests)
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            finalized = self.sweep()
+            if finalized or not options['loop']:
+                self.stdout.write('Finalized %s expired tests' % finalized)
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.models import CourseViewInstance
+
+
+class Command(BaseCommand):
+    help = ('Recalculate every CourseViewInstance.total_seconds_spent from its page views '
+        'in one set based UPDATE. Repairs drift in the incrementally maintained totals.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--dry-run', action='store_true',
+            help='Only report how many course totals have drifted')
+
+    def handle(self, *args, **options):
+        drifted_count = CourseViewInstance.objects.drifted().count()
+        self.stdout.write('%s course view instance totals have drifted' % drifted_count)
+        if options['dry_run'] or not drifted_count:
+            return
+
+        with transaction.atomic():
+            updated = CourseViewInstance.objects.reconcile_time_spent()
+        self.stdout.write(self.style.SUCCESS('Reconciled %s course view instance totals' % updated))
@@ -0,0 +1,35 @@
+import time
+
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import close_old_connections
+
+from core.models import CourseTest
+
+
+class Command(BaseCommand):
+    help = 'Top up the pool of ready made practice tests for every course test'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--depth', type=int, default=settings.PRACTICE_TEST_POOL_DEPTH,
+            help='Number of unassigned practice tests to keep per course test')
+        parser.add_argument('--loop', action='store_true',
+            help='Keep running and refill every PRACTICE_TEST_POOL_REFILL_INTERVAL_SECONDS')
+        parser.add_argument('--interval', type=int,
+            default=settings.PRACTICE_TEST_POOL_REFILL_INTERVAL_SECONDS)
+
+    def refill(self, depth):
+        generated = 0
+        for course_test in CourseTest.objects.filter(allow_practice_tests=True):
+            generated += course_test.refill_practice_test_pool(depth)
+        return generated
+
+    def handle(self, *args, **options):
+        while True:
+            close_old_connections()
+            generated = self.refill(options['depth'])
+            if generated or not options['loop']:
+                self.stdout.write('Generated %s practice tests' % generated)
+            if not options['loop']:
+                return
+            time.sleep(options['interval'])
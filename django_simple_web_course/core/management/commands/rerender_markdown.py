@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from core.models import CoursePage, MultipleChoiceTestQuestion
+
+
+class Command(BaseCommand):
+    help = 'Re-render the markdown of every course page and test question into the cache'
+
+    def handle(self, *args, **options):
+        for model in (CoursePage, MultipleChoiceTestQuestion):
+            rendered = 0
+            for instance in model.objects.only(*model.markdown_fields).iterator():
+                instance.prerender_markdown(refresh=True)
+                rendered += 1
+            self.stdout.write('Re-rendered %s %s' % (rendered, model._meta.verbose_name_plural))
@@ -0,0 +1,34 @@
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from core.dashboard import invalidate_student_dashboard
+from core.models import CourseTestInstance
+
+
+class Command(BaseCommand):
+    help = ('Re-score finished tests in set based UPDATEs. Run it after changing an answer key '
+        'or a passing percentage.')
+
+    def add_arguments(self, parser):
+        parser.add_argument('--course-test', dest='course_test_guid',
+            help='Only re-score instances of the course test with this guid')
+        parser.add_argument('--unscored', action='store_true',
+            help='Only score finished tests that have no stored score yet')
+
+    def handle(self, *args, **options):
+        filters = {}
+        if options['course_test_guid']:
+            filters['course_test__guid'] = options['course_test_guid']
+        if options['unscored']:
+            # pinned to pks, they stop matching scored_on__isnull once they're scored
+            filters = {'pk__in': list(CourseTestInstance.objects.filter(test_finished_on__isnull=False,
+                scored_on__isnull=True, **filters).values_list('pk', flat=True))}
+
+        with transaction.atomic():
+            # pass counts in the reporting rollups move with the scores
+            CourseTestInstance.objects.record_finished_activity(sign=-1, **filters)
+            updated = CourseTestInstance.objects.rescore(**filters)
+            CourseTestInstance.objects.record_finished_activity(**filters)
+        invalidate_student_dashboard(*CourseTestInstance.objects.filter(test_finished_on__isnull=False,
+            **filters).values_list('student_id', flat=True).distinct())
+        self.stdout.write(self.style.SUCCESS('Re-scored %s tests' % updated))
@@ -1,4 +1,7 @@
-from django.db import models
+from django.db import models, transaction
+from django.db.models import (Case, Count, F, FloatField, IntegerField, Max, Min, OuterRef, Subquery,
+    Sum, Value, When)
+from django.db.models.functions import Cast, Coalesce, Now, Round, TruncDate
 from django.conf import settings
 from django.utils import timezone
 from django.urls import reverse
@@ -9,6 +12,32 @@ class StudentIdentificationDocumentManager(models.Manager):
     needs_implementaion = True
 
 class StudentManager(models.Manager):
+    def principal_cache_key(self, student_guid):
+        from .cache import cache_key
+        return cache_key('student_principal', student_guid)
+
+    def get_principal(self, student_guid):
+        # identity and verification state for student_login_required. Cached so verified
+        # students don't cost any queries to authenticate
+        from .cache import get_or_build
+        def build_principal():
+            try:
+                student = self.get(guid=student_guid)
+            except self.model.DoesNotExist:
+                return None
+            return {
+                'pk': student.pk,
+                'guid': str(student.guid),
+                'verified': student.is_verified,
+                'verification_ready': student.verification_ready_on is not None,
+            }
+        return get_or_build(self.principal_cache_key(student_guid), build_principal,
+            settings.STUDENT_PRINCIPAL_CACHE_SECONDS)
+
+    def invalidate_principal(self, student_guid):
+        from .cache import cache
+        cache.delete(self.principal_cache_key(student_guid))
+
     def get_or_create_from_user(self, user=None):
         from .models import StudentIdentificationDocument
         if user is None:
@@ -34,4 +63,184 @@ class StudentManager(models.Manager):
                 student.verification_ready_on = timezone.now()
                 student.save()
 
-        return student
\ No newline at end of file
+        return student
+
+class CourseManager(models.Manager):
+    def resume_urls_for_student(self, student):
+        # course pk -> continue url for every published course the student has started, one query
+        from .models import CourseViewInstance
+        return dict(CourseViewInstance.objects.filter(student=student, course__published=True)
+            .exclude(last_url='').values_list('course_id', 'last_url'))
+
+class CourseViewInstanceManager(models.Manager):
+    def record_resume_pointers(self, page_view_instances):
+        # move each course's resume pointers to the newest of the given page views
+        last_urls, last_pages = {}, {}
+        for page_view_instance in page_view_instances:
+            last_urls[page_view_instance.course_view_instance_id] = page_view_instance.url
+            if page_view_instance.course_page_id:
+                last_pages[page_view_instance.course_view_instance_id] = page_view_instance.course_page_id
+        if len(last_urls) == 1:
+            (pk, url), = last_urls.items()
+            fields = {'last_url': url}
+            if pk in last_pages:
+                fields['last_course_page_id'] = last_pages[pk]
+            return self.filter(pk=pk).update(**fields)
+        self.bulk_update([self.model(pk=pk, last_url=url) for pk, url in last_urls.items()],
+            ['last_url'])
+        self.bulk_update([self.model(pk=pk, last_course_page_id=page_id)
+            for pk, page_id in last_pages.items()], ['last_course_page'])
+
+    def credit_seconds(self, deltas):
+        # deltas maps course view instance pk -> seconds to add. One atomic UPDATE
+        # for every course in the batch, no read of the page view history
+        deltas = {pk: seconds for pk, seconds in deltas.items() if pk and seconds}
+        if not deltas:
+            return 0
+        if len(deltas) == 1:
+            (pk, seconds), = deltas.items()
+            return self.filter(pk=pk).update(total_seconds_spent=F('total_seconds_spent') + seconds)
+        return self.filter(pk__in=deltas.keys()).update(total_seconds_spent=F('total_seconds_spent') + Case(
+            *[When(pk=pk, then=Value(seconds)) for pk, seconds in deltas.items()],
+            default=Value(0), output_field=models.BigIntegerField()))
+
+    def recorded_seconds_subquery(self):
+        # seconds of the page views still in the hot table plus the ones already archived
+        from .models import CoursePageViewInstance, CoursePageViewRollup
+        def seconds(model):
+            return Coalesce(Subquery(
+                model.objects.filter(course_view_instance=OuterRef('pk'))
+                    .order_by().values('course_view_instance')
+                    .annotate(total=Sum('total_seconds_spent')).values('total')
+            ), 0, output_field=models.BigIntegerField())
+        return seconds(CoursePageViewInstance) + seconds(CoursePageViewRollup)
+
+    def drifted(self):
+        # course view instances whose running total no longer matches their page views
+        return self.annotate(recorded_seconds=self.recorded_seconds_subquery()).exclude(
+            total_seconds_spent=F('recorded_seconds'))
+
+    def reconcile_time_spent(self):
+        # set based repair of every running total in a single UPDATE
+        return self.update(total_seconds_spent=self.recorded_seconds_subquery())
+
+class CoursePageViewInstanceManager(models.Manager):
+    def archivable(self, before):
+        return self.filter(created__lt=before)
+
+    def archive_batch(self, before, batch_size):
+        # roll the oldest page views up into one row per (course view, url, day), adding to the
+        # day's rollup if an earlier batch already made one, then delete them. Returns how many
+        # page views were archived
+        from .models import CoursePageViewRollup
+        with transaction.atomic():
+            pks = list(self.archivable(before).select_for_update(skip_locked=True).order_by(
+                'created').values_list('pk', flat=True)[:batch_size])
+            if not pks:
+                return 0
+            rollups = self.filter(pk__in=pks).annotate(day=TruncDate('created')).order_by().values(
+                'course_view_instance', 'url', 'day').annotate(student=Max('student'),
+                course_page=Max('course_page'), view_count=Count('pk'),
+                total_seconds_spent=Sum('total_seconds_spent'), first_view_start=Min('page_view_start'),
+                last_view_stop=Max('page_view_stop'))
+            rollups = {(rollup['course_view_instance'], rollup['url'], rollup['day']): rollup
+                for rollup in rollups}
+
+            existing = CoursePageViewRollup.objects.select_for_update().filter(
+                course_view_instance__in={key[0] for key in rollups}, day__in={key[2] for key in rollups})
+            updated = []
+            for rollup in existing:
+                values = rollups.pop((rollup.course_view_instance_id, rollup.url, rollup.day), None)
+                if values is None:
+                    continue
+                rollup.add(values)
+                updated.append(rollup)
+            CoursePageViewRollup.objects.bulk_update(updated, ['view_count', 'total_seconds_spent',
+                'first_view_start', 'last_view_stop'])
+            CoursePageViewRollup.objects.bulk_create([CoursePageViewRollup(
+                course_view_instance_id=values['course_view_instance'], url=values['url'], day=values['day'],
+                student_id=values['student'], course_page_id=values['course_page'],
+                view_count=values['view_count'], total_seconds_spent=values['total_seconds_spent'],
+                first_view_start=values['first_view_start'], last_view_stop=values['last_view_stop'])
+                for values in rollups.values()])
+
+            self.filter(pk__in=pks).delete()
+        return len(pks)
+
+class CourseTestInstanceManager(models.Manager):
+    def practice_pool(self, course_test):
+        # generated practice tests nobody has been handed yet
+        return self.filter(course_test=course_test, is_practice=True, student__isnull=True,
+            test_started_on__isnull=True)
+
+    def claim_practice_test(self, course_test, student):
+        # hand the oldest pooled test to the student. SKIP LOCKED lets concurrent claims
+        # each take a different test instead of queueing on the same row
+        with transaction.atomic():
+            instance = self.practice_pool(course_test).select_for_update(skip_locked=True).order_by(
+                'created').first()
+            if instance is None:
+                return None
+            instance.student = student
+            instance.save(update_fields=['student', 'updated'])
+        return instance
+
+    def discard_practice_pool(self, course_test_id):
+        # pooled tests were generated from the old questions, throw them away
+        return self.filter(course_test_id=course_test_id, is_practice=True, student__isnull=True,
+            test_started_on__isnull=True).delete()
+
+    def rescore(self, **filters):
+        # re-score every finished test matching filters in three UPDATEs, for when an
+        # answer key or passing percentage changes after tests were taken
+        from .models import CourseTest, CourseTestQuestionInstance
+        finished_tests = self.filter(test_finished_on__isnull=False, **filters)
+        question_instances = CourseTestQuestionInstance.objects.filter(
+            course_test_instance=OuterRef('pk')).order_by().values('course_test_instance')
+        correct_question_instances = question_instances.filter(
+            course_test_question__correct_multiple_choice_answer=F('course_test_answer_instance__answer_chosen'))
+        updated = finished_tests.update(
+            question_count=Coalesce(Subquery(question_instances.annotate(total=Count('pk')).values('total'),
+                output_field=IntegerField()), 0),
+            correct_answer_count=Coalesce(Subquery(correct_question_instances.annotate(
+                total=Count('pk')).values('total'), output_field=IntegerField()), 0),
+            scored_on=Now(),
+        )
+        finished_tests.update(score_percent=Case(
+            When(question_count=0, then=Value(0.0)),
+            default=Round(Cast('correct_answer_count', FloatField()) * 100 / F('question_count'), 2),
+            output_field=FloatField(),
+        ))
+        finished_tests.update(passed=Case(
+            When(score_percent__gte=Subquery(CourseTest.objects.filter(pk=OuterRef('course_test_id'))
+                .values('passing_percentage')), then=Value(True)),
+            default=Value(False),
+        ))
+        return updated
+
+    def expired(self):
+        return self.filter(test_finished_on__isnull=True, deadline_at__lte=timezone.now())
+
+    def finalize_expired(self):
+        # finish every expired test in one UPDATE and score them in set, returns what was finished
+        with transaction.atomic():
+            expired_tests = list(self.expired().select_for_update(skip_locked=True).values_list(
+                'pk', 'guid', 'student_id'))
+            if not expired_tests:
+                return []
+            pks = [pk for pk, guid, student_id in expired_tests]
+            self.filter(pk__in=pks, test_finished_on__isnull=True).update(test_finished_on=F('deadline_at'))
+            self.rescore(pk__in=pks)
+            self.record_finished_activity(pk__in=pks)
+        return expired_tests
+
+    def record_finished_activity(self, sign=1, **filters):
+        # add finished live tests to the reporting rollups, sign=-1 takes them back out
+        from .reporting import activity_day, add_activity, record_activity
+        activity = {}
+        for course_id, student_id, finished_on, passed in self.filter(is_practice=False,
+            test_finished_on__isnull=False, **filters).values_list('course_test__course_id', 'student_id',
+            'test_finished_on', 'passed'):
+            add_activity(activity, activity_day(finished_on), course_id, student_id, tests_finished=sign,
+                tests_passed=sign * int(bool(passed)))
+        record_activity(activity)
@@ -1,29 +1,32 @@
 from django.utils import timezone
-from .models import CoursePageViewInstance, Student, CourseTestInstance
+from .models import Student, CourseTestInstance
+from .tracking import record_page_view_stop
+from .routing import get_routing_record, routing_record_is_finished
+from .cursors import TrackingCursor
 from django.http import HttpResponseRedirect
 
+class TrackingCursorMiddleware:
+    def __init__(self, get_response):
+        self.get_response = get_response
+
+    def __call__(self, request):
+        # page view and live test cursors, saved once after the response instead of in the session
+        request.tracking_cursor = TrackingCursor(request)
+
+        response = self.get_response(request)
+
+        request.tracking_cursor.save()
+        return response
+
 class PageViewInstanceMiddleware:
     def __init__(self, get_response):
         self.get_response = get_response
 
     def __call__(self, request):
-        # if a page view is found on the session it was made from a previous request
-        page_view_instance_guid = request.session.pop('page_view_instance_guid', None)
+        # if a page view is found on the cursor it was made from a previous request
+        page_view_instance_guid = request.tracking_cursor.pop('page_view_instance_guid', None)
         if page_view_instance_guid:
-            try:
-                page_view_instance = CoursePageViewInstance.objects.get(guid=page_view_instance_guid)
-            except CoursePageViewInstance.DoesNotExist:
-                page_view_instance = None
-                print('page view instance with guid %s does not exist' % page_view_instance_guid)
-            # we've detected a previous instance, mark it finished, calculate time credit
-            if page_view_instance:
-                page_view_instance.page_view_stop = timezone.now()
-                if page_view_instance.credit_page_view_time:
-                    seconds_diff = (page_view_instance.page_view_stop - page_view_instance.page_view_start).seconds
-                    page_view_instance.total_seconds_spent = min(seconds_diff,
-                        page_view_instance.maximum_idle_time_seconds)
-                    page_view_instance.save()
-
+            record_page_view_stop(page_view_instance_guid, timezone.now())
 
         response = self.get_response(request)
 
@@ -34,9 +37,9 @@ class LiveTestRoutingMiddleware:
         self.get_response = get_response
 
     def __call__(self, request):
-        # if the guid is missing from the session, rather than set to None, initialize
-        if 'live_test_guid' not in request.session and not request.user.is_anonymous:
-            request.session['live_test_guid'] = None
+        # if the guid is missing from the cursor, rather than set to None, initialize
+        if 'live_test_guid' not in request.tracking_cursor and not request.user.is_anonymous:
+            request.tracking_cursor['live_test_guid'] = None
             try:
                 student = Student.objects.get(user=request.user)
             except Student.DoesNotExist:
@@ -48,16 +51,18 @@ class LiveTestRoutingMiddleware:
             
             for test in potential_live_tests:
                 if not test.is_complete:
-                    request.session['live_test_guid'] = str(test.guid)
+                    request.tracking_cursor['live_test_guid'] = str(test.guid)
            
-        if 'live_test_guid' in request.session and request.session['live_test_guid']:
-            test = CourseTestInstance.objects.get(guid=request.session['live_test_guid'])
-            # if the test is finished remove from session
-            if test.is_complete:
-                removed_guid = request.session.pop('live_test_guid')
+        if 'live_test_guid' in request.tracking_cursor and request.tracking_cursor['live_test_guid']:
+            # cached routing record, no queries unless the record has to be rebuilt
+            record = get_routing_record(request.tracking_cursor['live_test_guid'])
+            # if the test is finished remove from the cursor
+            # tests that ran out of time are finished by the finalize_expired_tests sweeper
+            if record is None or routing_record_is_finished(record):
+                request.tracking_cursor.pop('live_test_guid')
             # test isn't done and you are not where you are supposed to be, redirect to test home
-            elif not request.path in test.live_test_allowed_urls:
-                return HttpResponseRedirect(test.home_url)
+            elif not request.path in record['allowed_paths']:
+                return HttpResponseRedirect(record['home_url'])
 
         response = self.get_response(request)
 
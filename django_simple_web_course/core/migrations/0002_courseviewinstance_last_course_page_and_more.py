@@ -0,0 +1,39 @@
+# Generated by Django 4.1.3 on 2026-10-18 14:04
+
+from django.db import migrations, models
+from django.db.models import OuterRef, Subquery, Value
+from django.db.models.functions import Coalesce
+import django.db.models.deletion
+
+
+def backfill_resume_pointers(apps, schema_editor):
+    # set based, one UPDATE per pointer for every course view instance
+    CourseViewInstance = apps.get_model('core', 'CourseViewInstance')
+    CoursePageViewInstance = apps.get_model('core', 'CoursePageViewInstance')
+    latest_views = CoursePageViewInstance.objects.filter(
+        course_view_instance=OuterRef('pk')).order_by('-created')
+    CourseViewInstance.objects.update(last_url=Coalesce(
+        Subquery(latest_views.values('url')[:1]), Value('')))
+    CourseViewInstance.objects.update(last_course_page=Subquery(
+        latest_views.filter(course_page__isnull=False).values('course_page')[:1]))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0001_initial'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='courseviewinstance',
+            name='last_course_page',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.coursepage'),
+        ),
+        migrations.AddField(
+            model_name='courseviewinstance',
+            name='last_url',
+            field=models.TextField(blank=True, default=''),
+        ),
+        migrations.RunPython(backfill_resume_pointers, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,38 @@
+# Generated by Django 4.1.3 on 2026-10-18 14:10
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0002_courseviewinstance_last_course_page_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coursetestinstance',
+            name='correct_answer_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coursetestinstance',
+            name='passed',
+            field=models.BooleanField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coursetestinstance',
+            name='question_count',
+            field=models.IntegerField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coursetestinstance',
+            name='score_percent',
+            field=models.FloatField(blank=True, null=True),
+        ),
+        migrations.AddField(
+            model_name='coursetestinstance',
+            name='scored_on',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+    ]
@@ -0,0 +1,33 @@
+# Generated by Django 4.1.3 on 2026-10-18 14:11
+
+import datetime
+
+from django.db import migrations, models
+from django.db.models import DurationField, ExpressionWrapper, F, OuterRef, Subquery
+
+
+def backfill_deadlines(apps, schema_editor):
+    # started timed tests get started on + the course test time limit, in one UPDATE
+    CourseTest = apps.get_model('core', 'CourseTest')
+    CourseTestInstance = apps.get_model('core', 'CourseTestInstance')
+    time_limit = Subquery(CourseTest.objects.filter(pk=OuterRef('course_test_id'))
+        .values('maximum_time_seconds')[:1])
+    CourseTestInstance.objects.filter(test_started_on__isnull=False,
+        course_test__test_is_timed=True).update(deadline_at=F('test_started_on') + ExpressionWrapper(
+        time_limit * datetime.timedelta(seconds=1), output_field=DurationField()))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0003_coursetestinstance_score'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='coursetestinstance',
+            name='deadline_at',
+            field=models.DateTimeField(blank=True, null=True),
+        ),
+        migrations.RunPython(backfill_deadlines, migrations.RunPython.noop),
+    ]
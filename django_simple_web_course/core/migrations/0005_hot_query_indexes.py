@@ -0,0 +1,67 @@
+# Generated by Django 4.1.3 on 2026-10-18 14:18
+
+from django.db import migrations, models
+from django.db.models import Count
+
+
+def renumber_duplicates(model, parent_field, order_field):
+    # renumber 1..n, in the current order, the rows of any parent that repeats a number
+    duplicated_parents = model.objects.values(parent_field, order_field).annotate(
+        total=Count('pk')).filter(total__gt=1).values_list(parent_field, flat=True).distinct()
+    for parent_id in duplicated_parents:
+        rows = list(model.objects.filter(**{parent_field: parent_id}).order_by(order_field, 'created', 'pk'))
+        for number, row in enumerate(rows, start=1):
+            setattr(row, order_field, number)
+        model.objects.bulk_update(rows, [order_field])
+
+
+def remove_duplicate_numbers(apps, schema_editor):
+    renumber_duplicates(apps.get_model('core', 'CoursePage'), 'course', 'page_number')
+    renumber_duplicates(apps.get_model('core', 'CourseTestQuestionInstance'), 'course_test_instance', 'order')
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0004_coursetestinstance_deadline_at'),
+    ]
+
+    operations = [
+        migrations.RunPython(remove_duplicate_numbers, migrations.RunPython.noop),
+        migrations.AddIndex(
+            model_name='coursepageviewinstance',
+            index=models.Index(fields=['course_view_instance', '-created'], name='page_view_cvi_created_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coursepageviewinstance',
+            index=models.Index(fields=['course_view_instance', 'url', '-created'], name='page_view_cvi_url_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coursetestinstance',
+            index=models.Index(fields=['student', 'course_test', 'is_practice'], name='test_instance_student_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coursetestinstance',
+            index=models.Index(condition=models.Q(('test_finished_on__isnull', True)), fields=['student', 'is_practice'], name='test_instance_active_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coursetestinstance',
+            index=models.Index(condition=models.Q(('is_practice', True), ('student__isnull', True), ('test_started_on__isnull', True)), fields=['course_test', 'created'], name='test_instance_pool_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coursetestinstance',
+            index=models.Index(condition=models.Q(('deadline_at__isnull', False), ('test_finished_on__isnull', True)), fields=['deadline_at'], name='test_instance_deadline_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='coursetestquestionansweroption',
+            index=models.Index(fields=['question_instance', 'order'], name='answer_option_question_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='coursepage',
+            constraint=models.UniqueConstraint(fields=('course', 'page_number'), name='unique_course_page_number'),
+        ),
+        migrations.AddConstraint(
+            model_name='coursetestquestioninstance',
+            constraint=models.UniqueConstraint(fields=('course_test_instance', 'order'), name='unique_test_question_order'),
+        ),
+    ]
@@ -0,0 +1,37 @@
+# Generated by Django 4.1.3 on 2026-10-18 14:22
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0005_hot_query_indexes'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='CoursePageViewRollup',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('url', models.TextField(blank=True, default='')),
+                ('day', models.DateField()),
+                ('view_count', models.IntegerField(default=0)),
+                ('total_seconds_spent', models.BigIntegerField(default=0)),
+                ('first_view_start', models.DateTimeField(null=True)),
+                ('last_view_stop', models.DateTimeField(null=True)),
+                ('course_page', models.ForeignKey(null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='+', to='core.coursepage')),
+                ('course_view_instance', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='course_page_view_rollups', to='core.courseviewinstance')),
+                ('student', models.ForeignKey(null=True, on_delete=django.db.models.deletion.CASCADE, related_name='course_page_view_rollups', to='core.student')),
+            ],
+        ),
+        migrations.AddConstraint(
+            model_name='coursepageviewrollup',
+            constraint=models.UniqueConstraint(fields=('course_view_instance', 'url', 'day'), name='unique_page_view_rollup'),
+        ),
+    ]
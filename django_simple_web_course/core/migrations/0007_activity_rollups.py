@@ -0,0 +1,68 @@
+# Generated by Django 4.1.3 on 2026-10-18 14:24
+
+from django.db import migrations, models
+import django.db.models.deletion
+import uuid
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0006_coursepageviewrollup'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='StudentCourseActivityDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('seconds_credited', models.BigIntegerField(default=0)),
+                ('pages_viewed', models.IntegerField(default=0)),
+                ('tests_started', models.IntegerField(default=0)),
+                ('tests_finished', models.IntegerField(default=0)),
+                ('tests_passed', models.IntegerField(default=0)),
+                ('day', models.DateField()),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.course')),
+                ('student', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.student')),
+            ],
+        ),
+        migrations.CreateModel(
+            name='CourseActivityDay',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('guid', models.UUIDField(default=uuid.uuid4, editable=False, unique=True)),
+                ('created', models.DateTimeField(auto_now_add=True)),
+                ('updated', models.DateTimeField(auto_now=True)),
+                ('seconds_credited', models.BigIntegerField(default=0)),
+                ('pages_viewed', models.IntegerField(default=0)),
+                ('tests_started', models.IntegerField(default=0)),
+                ('tests_finished', models.IntegerField(default=0)),
+                ('tests_passed', models.IntegerField(default=0)),
+                ('day', models.DateField()),
+                ('course', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='+', to='core.course')),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='studentcourseactivityday',
+            index=models.Index(fields=['course', 'day'], name='student_activity_course_idx'),
+        ),
+        migrations.AddIndex(
+            model_name='studentcourseactivityday',
+            index=models.Index(fields=['student', 'day'], name='student_activity_student_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='studentcourseactivityday',
+            constraint=models.UniqueConstraint(fields=('day', 'course', 'student'), name='unique_student_course_activity_day'),
+        ),
+        migrations.AddIndex(
+            model_name='courseactivityday',
+            index=models.Index(fields=['course', 'day'], name='course_activity_course_idx'),
+        ),
+        migrations.AddConstraint(
+            model_name='courseactivityday',
+            constraint=models.UniqueConstraint(fields=('day', 'course'), name='unique_course_activity_day'),
+        ),
+    ]
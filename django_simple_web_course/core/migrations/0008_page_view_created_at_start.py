@@ -0,0 +1,19 @@
+# Generated by Django 4.1.3 on 2026-10-18 14:37
+
+from django.db import migrations, models
+import django.utils.timezone
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0007_activity_rollups'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='coursepageviewinstance',
+            name='created',
+            field=models.DateTimeField(default=django.utils.timezone.now, editable=False),
+        ),
+    ]
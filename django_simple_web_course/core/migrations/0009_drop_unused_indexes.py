@@ -0,0 +1,43 @@
+# Generated by Django 4.1.3 on 2026-10-18 14:59
+
+from django.db import migrations, models
+import django.db.models.deletion
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0008_page_view_created_at_start'),
+    ]
+
+    operations = [
+        migrations.RemoveIndex(
+            model_name='coursepageviewinstance',
+            name='page_view_cvi_url_idx',
+        ),
+        migrations.AlterField(
+            model_name='coursepage',
+            name='course',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='course_pages', to='core.course'),
+        ),
+        migrations.AlterField(
+            model_name='coursepageviewinstance',
+            name='course_view_instance',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='course_page_view_instances', to='core.courseviewinstance'),
+        ),
+        migrations.AlterField(
+            model_name='coursetestinstance',
+            name='student',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='course_test_instances', to='core.student'),
+        ),
+        migrations.AlterField(
+            model_name='coursetestquestionansweroption',
+            name='question_instance',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='course_test_answer_option_instances', to='core.coursetestquestioninstance'),
+        ),
+        migrations.AlterField(
+            model_name='coursetestquestioninstance',
+            name='course_test_instance',
+            field=models.ForeignKey(db_index=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='course_test_question_instances', to='core.coursetestinstance'),
+        ),
+    ]
@@ -1,19 +1,27 @@
-from django.db import models
+from django.db import models, transaction
 from django.db.models import Sum
 from django.contrib.auth.models import User
 from django.conf import settings
 from django.utils.translation import gettext_lazy as _
 from phonenumber_field.modelfields import PhoneNumberField
 from django.utils.safestring import mark_safe
-from django.db.models import F, Q
+from django.db.models import F, Q, Count, OuterRef, Subquery
 from .managers import *
-from django.db.models.signals import post_save
+from django.db.models.signals import post_save, post_delete, pre_delete, pre_save, m2m_changed
 from django.dispatch import receiver
 from django.utils import timezone
 from django.urls import reverse
 from .email_dispatchers import dispatch_student_verification_email
-from .utils import human_time_duration
-import uuid, math
+from .utils import human_time_duration, render_markdown_html
+from .routing import record_routing_answers, record_routing_test_finished
+from .navigation import (get_navigation_map, question_position, question_url, record_navigation_answers,
+    course_page_navigation_html)
+from .structure import get_course_structure
+from .cache import (COURSE_CATALOG, bump_cache_version, cache, course_content,
+    course_test_content, get_or_build, versioned_cache_key)
+from .dashboard import invalidate_student_dashboard
+from .reporting import activity_day, add_activity, page_view_activity, queue_activity
+import uuid, math, random
 
 # Create your models here.
 class BaseModel(models.Model):
@@ -96,6 +104,18 @@ class LegalNameModel(models.Model):
         abstract = True
 
 
+class MarkdownContentModel(models.Model):
+    # text fields rendered with the render_markdown filter, prerendered into the cache on save
+    markdown_fields = ()
+
+    def prerender_markdown(self, refresh=False):
+        for field_name in self.markdown_fields:
+            render_markdown_html(getattr(self, field_name), refresh=refresh)
+
+    class Meta:
+        abstract = True
+
+
 class ContactInfoModel(models.Model):
     email_address = models.CharField(max_length=200, blank=True)
     primary_phone_number = PhoneNumberField(blank=True)
@@ -135,7 +155,7 @@ class Student(LegalNameModel, ContactInfoModel, BaseModel):
     def is_verified(self):
         if self.verified_on:
             return True
-        unverified_required_documents = StudentIdentificationDocument.objects.filter(pk=self.pk,
+        unverified_required_documents = StudentIdentificationDocument.objects.filter(student=self,
             verification_required=True, verified=False)
         return unverified_required_documents.count() == 0
 
@@ -175,6 +195,8 @@ class StudentIdentificationDocument(BaseModel):
 @receiver(post_save, sender=StudentIdentificationDocument, dispatch_uid="student_verification_ready")
 def student_verification_ready(sender, instance, **kwargs):
     student = instance.student
+    # document changes can change verification state, drop the cached principal
+    Student.objects.invalidate_principal(student.guid)
     if not student.verification_ready_on:
         total_verification_documents = StudentIdentificationDocument.objects.filter(student=student,
             verification_required=True)
@@ -201,57 +223,57 @@ class Course(BaseModel):
     page_signature_description = models.TextField(default='Your full name',
         help_text='If pages require signature, this field will describe the signature the student enters')
 
+    objects = CourseManager()
 
     def continue_url(self, student):
         try:
-            instance = CourseViewInstance.objects.get(course=self, student=student)
+            instance = CourseViewInstance.objects.only('last_url').get(course=self, student=student)
         except CourseViewInstance.DoesNotExist:
             return ""
-        pages_viewed = CoursePageViewInstance.objects.filter(course_view_instance=instance)
-        if pages_viewed:
-            return pages_viewed.latest('created').url
-        return ""
+        return instance.last_url
 
     def last_page_view_url(self, student):
         try:
-            instance = CourseViewInstance.objects.get(course=self, student=student)
+            instance = CourseViewInstance.objects.select_related('last_course_page').only(
+                'last_course_page__guid').get(course=self, student=student)
         except CourseViewInstance.DoesNotExist:
             return ''
-        pages_viewed = CoursePageViewInstance.objects.filter(
-            course_view_instance=instance, course_page__isnull=False).order_by('-created')
-        if pages_viewed.count():
-            return reverse('course_page', kwargs={'page_guid':pages_viewed[0].course_page.guid})
+        if instance.last_course_page:
+            return reverse('course_page', kwargs={'page_guid':instance.last_course_page.guid})
 
         return ''
 
-    def url_recent_history(self, student):
-        try:
-            instance = CourseViewInstance.objects.get(course=self, student=student)
-        except CourseViewInstance.DoesNotExist:
-            return []
-        # get pages ordered by created
-        # distinct queries by created are a lot harder than you think
-        # keep the history short because we need python to calc distinct urls
-        # if someone could figure out how to get the db to do the lifting here
-        # please replace this
-        pages_viewed = CoursePageViewInstance.objects.filter(
-            course_view_instance=instance).order_by('-created')
-        # need this count for performance if setting gets high 
-        # or for low page instances with high views
-        unique_url_count = CoursePageViewInstance.objects.filter(
-            course_view_instance=instance).distinct('url').count()
-
-        break_length = min(unique_url_count, settings.LEFT_NAV_HISTORY_MAX)
-        return_list = []
-        used_urls = []
-        for page_viewed in pages_viewed:
-            if len(return_list) >= break_length:
-                break
-            if page_viewed.url not in used_urls:
-                used_urls.append(page_viewed.url)
-                return_list.append(page_viewed.as_dict)
-
-        return return_list
+    def recent_history_cache_key(self, student_id):
+        # titles come from the course's pages and tests, renaming one changes the content version
+        return versioned_cache_key(course_content(self.pk), 'course_recent_history', self.pk, student_id)
+
+    def url_recent_history(self, student_id):
+        return get_or_build(self.recent_history_cache_key(student_id), lambda: [page_viewed.as_dict
+            for page_viewed in self.recent_history_queryset(student_id)], settings.LEFT_NAV_HISTORY_CACHE_SECONDS)
+
+    def recent_history_queryset(self, student_id):
+        # latest view of each url (DISTINCT ON), newest first, with everything as_dict
+        # needs joined or annotated in so the whole history is a single query
+        latest_view_per_url = CoursePageViewInstance.objects.filter(
+            course_view_instance__course=self, course_view_instance__student_id=student_id
+            ).order_by('url', '-created').distinct('url').values('pk')
+        question_number = CourseTestQuestionInstance.objects.filter(
+            course_test_instance=OuterRef('course_test_instance'),
+            course_test_question=OuterRef('course_test_question')).values('order')[:1]
+        return CoursePageViewInstance.objects.filter(pk__in=Subquery(latest_view_per_url)
+            ).select_related('course_view_instance__course', 'course_page', 'course_test',
+            'course_test_question__course_test').annotate(question_number=Subquery(question_number)
+            ).order_by('-created')[:settings.LEFT_NAV_HISTORY_MAX]
+
+    def push_url_recent_history(self, student_id, page_view_instance):
+        # keep a cached history current without going back to the page view table
+        key = self.recent_history_cache_key(student_id)
+        history = cache.get(key)
+        if history is None:
+            return
+        page_dict = page_view_instance.as_dict
+        history = [page_dict] + [d for d in history if d['url'] != page_dict['url']]
+        cache.set(key, history[:settings.LEFT_NAV_HISTORY_MAX], settings.LEFT_NAV_HISTORY_CACHE_SECONDS)
 
     @property
     def live_tests(self):
@@ -265,6 +287,13 @@ class Course(BaseModel):
     def course_pages_ordered(self):
         return self.course_pages.order_by('page_number')
 
+    @property
+    def structure(self):
+        # read only snapshot of pages and tests, see core/structure.py
+        if not hasattr(self, '_structure'):
+            self._structure = get_course_structure(self.pk)
+        return self._structure
+
     @property
     def course_tests_ordered(self):
         return self.course_tests.order_by('order')
@@ -273,8 +302,11 @@ class Course(BaseModel):
     def __str__(self):
         return self.name
 
-class CoursePage(BaseModel):
-    course = models.ForeignKey('Course', null=True, on_delete=models.CASCADE,
+class CoursePage(MarkdownContentModel, BaseModel):
+    markdown_fields = ('page_contents',)
+
+    # indexed by unique_course_page_number
+    course = models.ForeignKey('Course', null=True, on_delete=models.CASCADE, db_index=False,
         related_name='course_pages')
     page_number = models.IntegerField(default=1, help_text='Order of the page')
     page_title = models.CharField(max_length=200, help_text='Title of the page')
@@ -288,34 +320,8 @@ class CoursePage(BaseModel):
 
     @property
     def nav_page_split(self):
-        course_pages = self.course.course_pages.order_by('page_number')
-        total_pages = course_pages.count()
-        if  total_pages == 0:
-            return ''
-
-        guid_ordered_list = [ page.guid for page in course_pages]
-        page_index = guid_ordered_list.index(self.guid)
-        if total_pages <= 10:
-            page_indexing_obj = set(range(1, total_pages + 1))
-        else:
-            page_indexing_obj = (set(range(1, 4))
-                     | set(range(max(1, page_index - 1), min(page_index + 4, total_pages + 1)))
-                     | set(range(total_pages - 2, total_pages + 1)))
-
-        def display_at_index(index, guid_list, target_index):
-            tag_url = reverse('course_page', kwargs={'page_guid':guid_list[index-1]})
-            inner_tag = str(index) if index != target_index else '[ %s ]' % index
-            return '<div class="col text-center"><a href="%s">%s</a></div>' % (tag_url, inner_tag)
-
-        # Display pages in order with ellipses
-        def display():
-            last_page = 0
-            for p in sorted(page_indexing_obj):
-                if p != last_page + 1: yield '<div class="col text-center">...</div>'
-                yield display_at_index(p, guid_ordered_list, page_index+1)
-                last_page = p
-        display_columns = ' '.join(display())
-        return mark_safe('<div class="row page-navigation-bar">%s</div>' % display_columns)
+        # navigation bar from the course structure snapshot, rebuilt when the course changes
+        return course_page_navigation_html(self.course.structure, self.guid)
 
     @property
     def course_url(self):
@@ -323,6 +329,10 @@ class CoursePage(BaseModel):
             return reverse('course_page', kwargs={'page_guid':self.guid})
         return None
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course', 'page_number'], name='unique_course_page_number'),
+        ]
 
     def __str__(self):
         return '%s %s %s' % (self.course.name, self.page_number, self.page_title)
@@ -343,6 +353,13 @@ class CourseViewInstance(BaseModel):
     pages_require_signature = models.BooleanField(default=False)
     page_signature_description = models.TextField(default='', blank=True)
     student_course_signature_value = models.CharField(max_length=200, blank=True, null=True)
+    # resume pointers, kept current as page views are recorded so continue links don't
+    # have to search the page view history
+    last_url = models.TextField(blank=True, default='')
+    last_course_page = models.ForeignKey('CoursePage', null=True, blank=True, on_delete=models.SET_NULL,
+        related_name='+')
+
+    objects = CourseViewInstanceManager()
 
     @property
     def enforce_minimum_time(self):
@@ -353,8 +370,8 @@ class CourseViewInstance(BaseModel):
         return max((self.course.minimum_time_seconds - self.total_seconds_spent),0)
 
     def calculate_time_spent(self):
-        time_spent_query = self.course_page_view_instances.aggregate(Sum('total_seconds_spent'))
-        self.total_seconds_spent = time_spent_query['total_seconds_spent__sum']
+        self.total_seconds_spent = sum(queryset.aggregate(total=Sum('total_seconds_spent'))['total'] or 0
+            for queryset in (self.course_page_view_instances, self.course_page_view_rollups))
         self.save()
         return self.total_seconds_spent
 
@@ -365,9 +382,12 @@ class CourseViewInstance(BaseModel):
         return '%s, %s' % (self.student.full_legal_name, self.course)
 
 class CoursePageViewInstance(BaseModel):
+    # stamped when the view starts rather than when it's inserted, buffered starts are written later
+    created = models.DateTimeField(default=timezone.now, editable=False)
     url = models.TextField(blank=True, default='')
+    # indexed by page_view_cvi_created_idx
     course_view_instance = models.ForeignKey('CourseViewInstance', null=True, on_delete=models.CASCADE,
-        related_name='course_page_view_instances')
+        db_index=False, related_name='course_page_view_instances')
     page_view_start = models.DateTimeField(null=True)
     page_view_stop = models.DateTimeField(null=True)
     total_seconds_spent = models.BigIntegerField(default=0)
@@ -383,23 +403,51 @@ class CoursePageViewInstance(BaseModel):
     student = models.ForeignKey('Student', null=True, on_delete=models.CASCADE,
         related_name='course_page_view_instances')
 
+    objects = CoursePageViewInstanceManager()
+
+    class Meta:
+        indexes = [
+            # resume pointers, time totals and left nav history, newest page view first
+            models.Index(fields=['course_view_instance', '-created'], name='page_view_cvi_created_idx'),
+        ]
+
     @property
     def maximum_idle_time_seconds(self):
         return self.course_view_instance.course.maximum_idle_time_seconds
 
     @property
     def credit_page_view_time(self):
-        return (self.course_page or 
-            (self.course_view_instance.course.practice_counts_for_time and 
-             self.course_test_question and self.course_test_instance 
+        # checks the ids rather than the related objects, batched stops don't load pages or questions
+        return bool(self.course_page_id or
+            (self.course_view_instance.course.practice_counts_for_time and
+             self.course_test_question_id and self.course_test_instance_id
                 and self.course_test_instance.is_practice)
         )
 
+    def mark_stopped(self, stop_time):
+        # marks the view finished and calculates the time credit, returns True if
+        # the view earned credit and needs to be saved
+        self.page_view_stop = stop_time
+        if not self.credit_page_view_time:
+            return False
+        seconds_diff = int((self.page_view_stop - self.page_view_start).total_seconds())
+        previous_seconds_spent = self.total_seconds_spent
+        self.total_seconds_spent = min(seconds_diff, self.maximum_idle_time_seconds)
+        # the difference is added to the course total when the view is saved
+        self.credited_seconds_delta = self.total_seconds_spent - previous_seconds_spent
+        return True
+
+    def pop_credited_seconds_delta(self):
+        delta = getattr(self, 'credited_seconds_delta', 0)
+        self.credited_seconds_delta = 0
+        return delta
+
 
     @property
     def as_dict(self):
-        question_number = ''
-        if self.course_test_question and self.course_test_instance:
+        # url_recent_history annotates question_number, tracking sets it from the question instance
+        question_number = getattr(self, 'question_number', None) or ''
+        if not question_number and self.course_test_question and self.course_test_instance:
             try:
                 # if this fails do nothing is fine
                 question_number = self.course_test_instance.course_test_question_instances.get(
@@ -430,10 +478,103 @@ class CoursePageViewInstance(BaseModel):
 
         return d
 
+class CoursePageViewRollup(BaseModel):
+    '''
+    Page views older than PAGE_VIEW_RETENTION_DAYS, rolled up per course view, url and day by
+    the archive_page_views command so the page view table only holds recent history.
+    '''
+    course_view_instance = models.ForeignKey('CourseViewInstance', on_delete=models.CASCADE,
+        related_name='course_page_view_rollups')
+    url = models.TextField(blank=True, default='')
+    day = models.DateField()
+    student = models.ForeignKey('Student', null=True, on_delete=models.CASCADE,
+        related_name='course_page_view_rollups')
+    course_page = models.ForeignKey('CoursePage', null=True, on_delete=models.SET_NULL,
+        related_name='+')
+    view_count = models.IntegerField(default=0)
+    total_seconds_spent = models.BigIntegerField(default=0)
+    first_view_start = models.DateTimeField(null=True)
+    last_view_stop = models.DateTimeField(null=True)
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course_view_instance', 'url', 'day'],
+                name='unique_page_view_rollup'),
+        ]
+
+    def add(self, values):
+        self.view_count += values['view_count']
+        self.total_seconds_spent += values['total_seconds_spent'] or 0
+        self.first_view_start = min(filter(None, (self.first_view_start, values['first_view_start'])),
+            default=None)
+        self.last_view_stop = max(filter(None, (self.last_view_stop, values['last_view_stop'])),
+            default=None)
+
+    def __str__(self):
+        return '%s %s %s' % (self.course_view_instance, self.day, self.url)
+
+class ActivityDayModel(BaseModel):
+    # learning activity counters shared by the daily reporting rollups, see core/reporting.py
+    seconds_credited = models.BigIntegerField(default=0)
+    pages_viewed = models.IntegerField(default=0)
+    tests_started = models.IntegerField(default=0)
+    tests_finished = models.IntegerField(default=0)
+    tests_passed = models.IntegerField(default=0)
+
+    class Meta:
+        abstract = True
+
+class StudentCourseActivityDay(ActivityDayModel):
+    day = models.DateField()
+    course = models.ForeignKey('Course', on_delete=models.CASCADE, related_name='+')
+    student = models.ForeignKey('Student', on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'course', 'student'], name='unique_student_course_activity_day'),
+        ]
+        indexes = [
+            models.Index(fields=['course', 'day'], name='student_activity_course_idx'),
+            models.Index(fields=['student', 'day'], name='student_activity_student_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s %s' % (self.day, self.course_id, self.student_id)
+
+class CourseActivityDay(ActivityDayModel):
+    day = models.DateField()
+    course = models.ForeignKey('Course', on_delete=models.CASCADE, related_name='+')
+
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['day', 'course'], name='unique_course_activity_day'),
+        ]
+        indexes = [
+            models.Index(fields=['course', 'day'], name='course_activity_course_idx'),
+        ]
+
+    def __str__(self):
+        return '%s %s' % (self.day, self.course_id)
+
 @receiver(post_save, sender=CoursePageViewInstance, dispatch_uid="update_total_course_time")
 def update_total_course_time(sender, instance, **kwargs):
-    if instance.total_seconds_spent:
-        instance.course_view_instance.calculate_time_spent()
+    # only the newly credited seconds are added, the course total is never re-aggregated here
+    delta = instance.pop_credited_seconds_delta()
+    if delta:
+        CourseViewInstance.objects.credit_seconds({instance.course_view_instance_id: delta})
+        queue_activity(page_view_activity({}, instance, seconds_credited=delta))
+        invalidate_student_dashboard(instance.student_id)
+
+def score_values(question_count, correct_answer_count, passing_percentage):
+    score_percent = 0.0
+    if question_count:
+        score_percent = round(correct_answer_count / question_count * 100, 2)
+    return {
+        'question_count': question_count,
+        'correct_answer_count': correct_answer_count,
+        'score_percent': score_percent,
+        'passed': score_percent >= passing_percentage,
+    }
 
 class CourseTestInstance(BaseModel):
     is_practice = models.BooleanField(default=False)
@@ -442,12 +583,39 @@ class CourseTestInstance(BaseModel):
     retake = models.ForeignKey("self", on_delete=models.CASCADE, null=True, blank=True)
     course_test = models.ForeignKey('CourseTest', null=True, on_delete=models.CASCADE,
         related_name='course_test_instances')
-    student = models.ForeignKey('Student', null=True, on_delete=models.CASCADE,
+    # indexed by test_instance_student_idx
+    student = models.ForeignKey('Student', null=True, on_delete=models.CASCADE, db_index=False,
         related_name='course_test_instances')
     test_started_on = models.DateTimeField(null=True)
+    # set by start() on timed tests, expired tests are finished by the finalize_expired_tests sweeper
+    deadline_at = models.DateTimeField(null=True, blank=True)
     test_finished_on = models.DateTimeField(null=True)
     available_questions = models.ManyToManyField('MultipleChoiceTestQuestion', related_name='course_test_instances')
     retake_requested = models.BooleanField(default=False)
+    # written once by score() when the test finishes, the score properties read these
+    question_count = models.IntegerField(null=True, blank=True)
+    correct_answer_count = models.IntegerField(null=True, blank=True)
+    score_percent = models.FloatField(null=True, blank=True)
+    passed = models.BooleanField(null=True, blank=True)
+    scored_on = models.DateTimeField(null=True, blank=True)
+
+    objects = CourseTestInstanceManager()
+
+    SCORE_FIELDS = ('question_count', 'correct_answer_count', 'score_percent', 'passed')
+
+    class Meta:
+        indexes = [
+            models.Index(fields=['student', 'course_test', 'is_practice'], name='test_instance_student_idx'),
+            # tests still in progress, live test detection and practice test lookups
+            models.Index(fields=['student', 'is_practice'], condition=Q(test_finished_on__isnull=True),
+                name='test_instance_active_idx'),
+            # pooled practice tests waiting to be claimed, oldest first
+            models.Index(fields=['course_test', 'created'], condition=Q(student__isnull=True,
+                is_practice=True, test_started_on__isnull=True), name='test_instance_pool_idx'),
+            # timed tests the expired test sweeper still has to finish
+            models.Index(fields=['deadline_at'], condition=Q(test_finished_on__isnull=True,
+                deadline_at__isnull=False), name='test_instance_deadline_idx'),
+        ]
 
     @property
     def retakes_enabled(self):
@@ -461,9 +629,9 @@ class CourseTestInstance(BaseModel):
     def seconds_remaining(self):
         if not self.test_is_timed or self.test_finished_on:
             return 0
-        if not self.test_started_on:
+        if not self.deadline_at:
             return self.maximum_time_seconds
-        seconds_left = self.maximum_time_seconds - (timezone.now() - self.test_started_on).total_seconds()
+        seconds_left = (self.deadline_at - timezone.now()).total_seconds()
         if seconds_left < 0:
             seconds_left = 0
         return seconds_left
@@ -501,32 +669,104 @@ class CourseTestInstance(BaseModel):
     def passing_percentage(self):
         return self.course_test.passing_percentage
 
+    # read only, tests are finished by the last answer or by the expired test sweeper
     @property
     def is_complete(self):
-        if self.has_time_expired:
-            return True
-        if (not self.test_started_on) or (self.course_test.number_of_available_questions > 
-            self.course_test_question_instances.count()):
-            return False
-        complete = self.course_test_question_instances.count() == self.course_test_question_instances.filter(
-            course_test_answer_instance__isnull=False).count()
-        if complete and not self.test_finished_on:
-            self.test_finished_on = timezone.now()
-            self.save()
-        return complete
+        return self.has_time_expired
 
     @property
     def has_time_expired(self):
         if self.test_finished_on:
             return True
-        if not self.course_test or not self.course_test.test_is_timed:
+        return self.deadline_at is not None and self.deadline_at <= timezone.now()
+
+    def start(self):
+        self.test_started_on = timezone.now()
+        if self.test_is_timed:
+            self.deadline_at = self.test_started_on + timezone.timedelta(seconds=self.maximum_time_seconds)
+        self.save()
+        if not self.is_practice:
+            queue_activity(add_activity({}, activity_day(self.test_started_on), self.course_test.course_id,
+                self.student_id, tests_started=1))
+
+    def record_answers(self, choices):
+        '''
+        Record (question instance, answer) choices for this test with one expiry check and a
+        single insert. Questions that already have an answer keep it, so resending a batch is
+        safe, even after the test has finished. Returns {question instance pk: recorded answer},
+        once time is up only the answers recorded before it are in there.
+        '''
+        # clock is up, deny new answers but still hand back the ones already recorded
+        time_expired = self.has_time_expired
+        question_instances = {}
+        new_answers = []
+        answer_chosen_on = timezone.now()
+        for question_instance, answer_chosen in choices:
+            if question_instance.pk in question_instances:
+                continue
+            question_instances[question_instance.pk] = question_instance
+            new_answers.append(CourseTestQuestionAnswerInstance(question_instance=question_instance,
+                answer_chosen=answer_chosen, answer_chosen_on=answer_chosen_on))
+        if not time_expired:
+            with transaction.atomic():
+                CourseTestQuestionAnswerInstance.objects.bulk_create(new_answers, ignore_conflicts=True)
+        recorded_answers = {
+            answer_instance.question_instance_id: answer_instance
+            for answer_instance in CourseTestQuestionAnswerInstance.objects.filter(
+                question_instance__in=question_instances.keys())
+        }
+        for question_instance_pk, answer_instance in recorded_answers.items():
+            question_instances[question_instance_pk].course_test_answer_instance = answer_instance
+        if time_expired:
+            return recorded_answers
+
+        unanswered_count = self.course_test_question_instances.filter(
+            course_test_answer_instance__isnull=True).count()
+        record_routing_answers(self.guid, unanswered_count)
+        record_navigation_answers(self, [question_instance.guid for question_instance in question_instances.values()])
+        # the last answer in finishes the test
+        if unanswered_count == 0:
+            self.finish()
+        return recorded_answers
+
+    def finish(self, finished_on=None):
+        # conditional update so the last answer and the sweeper can't both finish the test
+        finished_on = finished_on or timezone.now()
+        if not CourseTestInstance.objects.filter(pk=self.pk, test_finished_on__isnull=True).update(
+            test_finished_on=finished_on):
             return False
-        if ((self.test_started_on) and (self.test_started_on + timezone.timedelta(
-            seconds=self.maximum_time_seconds) < timezone.now())):
-            self.test_finished_on = timezone.now()
-            self.save()
-            return True
-        return False
+        self.test_finished_on = finished_on
+        self.score()
+        if not self.is_practice:
+            queue_activity(add_activity({}, activity_day(finished_on), self.course_test.course_id, self.student_id,
+                tests_finished=1, tests_passed=int(bool(self.passed))))
+        record_routing_test_finished(self.guid)
+        return True
+
+    def calculate_score(self):
+        # correct and total counts in a single aggregate query
+        totals = self.course_test_question_instances.aggregate(
+            question_count=Count('pk'),
+            correct_answer_count=Count('pk', filter=Q(
+                course_test_question__correct_multiple_choice_answer=F('course_test_answer_instance__answer_chosen'))))
+        return score_values(totals['question_count'], totals['correct_answer_count'], self.passing_percentage)
+
+    def score(self, save=True):
+        for field, value in self.calculate_score().items():
+            setattr(self, field, value)
+        self.scored_on = timezone.now()
+        if save:
+            self.save(update_fields=self.SCORE_FIELDS + ('scored_on', 'updated'))
+
+    @property
+    def current_score(self):
+        # read only. Finished tests read the stored score, tests still in progress and finished
+        # tests nobody has scored yet (rescore_tests --unscored) are counted live
+        if self.scored_on is not None:
+            return {field: getattr(self, field) for field in self.SCORE_FIELDS}
+        if not hasattr(self, '_live_score'):
+            self._live_score = self.calculate_score()
+        return self._live_score
 
     @property
     def maximum_time_seconds(self):
@@ -538,9 +778,7 @@ class CourseTestInstance(BaseModel):
 
     @property
     def number_of_correct_answers(self):
-        return self.course_test_question_instances.filter(
-            course_test_question__correct_multiple_choice_answer=F('course_test_answer_instance__answer_chosen')
-            ).count()
+        return self.current_score['correct_answer_count']
 
     @property
     def minimum_questions_to_pass(self):
@@ -552,11 +790,20 @@ class CourseTestInstance(BaseModel):
 
     @property
     def total_number_of_questions(self):
-        return self.course_test_question_instances.count()
+        return self.current_score['question_count']
 
     @property
     def question_instances(self):
         return self.course_test_question_instances.order_by('order')
+
+    @property
+    def question_breakdown(self):
+        # everything the score page shows for each question in one query
+        question_instances = list(self.question_instances.select_related(
+            'course_test_question__correct_multiple_choice_answer', 'course_test_answer_instance__answer_chosen'))
+        for question_instance in question_instances:
+            question_instance.course_test_instance = self
+        return question_instances
     
     @property
     def order(self):
@@ -564,20 +811,30 @@ class CourseTestInstance(BaseModel):
 
     @property
     def test_score_percent(self):
-        return float('{0:.2f}'.format(
-            self.number_of_correct_answers / self.total_number_of_questions * 100))
+        return self.current_score['score_percent']
 
     @property
     def test_passed(self):
-        return self.test_score_percent >= self.passing_percentage
+        return self.current_score['passed']
+
+@receiver(post_save, sender=CourseTestInstance, dispatch_uid="course_test_instance_dashboard")
+def course_test_instance_dashboard(sender, instance, **kwargs):
+    # starting, finishing and retaking a test all change the dashboard test status
+    invalidate_student_dashboard(instance.student_id)
 
 class CourseTestQuestionAnswerOption(BaseModel):
+    # indexed by answer_option_question_idx
     question_instance = models.ForeignKey('CourseTestQuestionInstance', null=True, on_delete=models.CASCADE,
-        related_name='course_test_answer_option_instances')
+        db_index=False, related_name='course_test_answer_option_instances')
     answer_option = models.ForeignKey('MultipleChoiceAnswer', null=True, on_delete=models.CASCADE,
         related_name='+')
     order = models.IntegerField(default=1)
 
+    class Meta:
+        indexes = [
+            models.Index(fields=['question_instance', 'order'], name='answer_option_question_idx'),
+        ]
+
     @property
     def value(self):
         return self.answer_option.value
@@ -597,13 +854,37 @@ class CourseTestQuestionAnswerInstance(BaseModel):
     def is_correct(self):
         return self.answer_chosen == self.question_instance.correct_multiple_choice_answer
 
+def ordered_answer_options(correct_answer, wrong_answers, answer_length):
+    # no answers in the pool, can't create
+    if answer_length <= 1:
+        return None
+    # correct answer plus a random pick of wrong answers in random order
+    answers = [correct_answer] + random.sample(wrong_answers, answer_length - 1)
+    random.shuffle(answers)
+    # none of the above and all the above answers always go last
+    answer_list = [
+        answer for answer in answers
+        if not(answer.is_all_of_the_above) and not(answer.is_none_of_the_above)
+    ]
+    none_all_list = [
+        answer for answer in answers
+        if answer.is_all_of_the_above or answer.is_none_of_the_above
+    ]
+    return answer_list + none_all_list
+
 class CourseTestQuestionInstance(BaseModel):
+    # indexed by unique_test_question_order
     course_test_instance = models.ForeignKey('CourseTestInstance', null=True, on_delete=models.CASCADE,
-        related_name='course_test_question_instances')
+        db_index=False, related_name='course_test_question_instances')
     course_test_question = models.ForeignKey('MultipleChoiceTestQuestion', null=True, 
         on_delete=models.CASCADE, related_name='+')
     order = models.IntegerField(default=1)
 
+    class Meta:
+        constraints = [
+            models.UniqueConstraint(fields=['course_test_instance', 'order'], name='unique_test_question_order'),
+        ]
+
     @property
     def answer_instance(self):
         try:
@@ -612,16 +893,9 @@ class CourseTestQuestionInstance(BaseModel):
             return None
 
     def choose_answer(self, answer_chosen):
-        # clock is up, deny the answer
-        if self.course_test_instance.has_time_expired:
-            return None
-        answer_instance = CourseTestQuestionAnswerInstance.objects.create(
-            question_instance=self,
-            answer_chosen=answer_chosen,
-            answer_chosen_on=timezone.now()
-        )
-        answer_instance.save()
-        return answer_instance
+        # None when the clock is up, otherwise the answer recorded for this question. A resent
+        # answer gets back the one recorded first
+        return self.course_test_instance.record_answers([(self, answer_chosen)]).get(self.pk)
 
     @property
     def url(self):
@@ -638,7 +912,11 @@ class CourseTestQuestionInstance(BaseModel):
 
     @property
     def answer_options(self):
-        return self.course_test_answer_option_instances.order_by('order')
+        # loaded once per question instance, the answer form and the page share them
+        if not hasattr(self, '_answer_options'):
+            self._answer_options = list(self.course_test_answer_option_instances.select_related(
+                'answer_option').order_by('order'))
+        return self._answer_options
 
     @property
     def question_contents(self):
@@ -662,104 +940,64 @@ class CourseTestQuestionInstance(BaseModel):
 
     def create_answer_options(self):
         question_obj = self.course_test_question
-        answer_length = question_obj.calculated_answer_length
+        wrong_answers = list(question_obj.other_multiple_choice_answers.order_by('-created'))
+        final_list = ordered_answer_options(question_obj.correct_multiple_choice_answer, wrong_answers,
+            question_obj.answer_length_for(len(wrong_answers)))
         # no answers in the pool, can't create
-        if answer_length <= 1:
+        if final_list is None:
             return None
-
-        incorrect_answer_indexes_added = []
-        order_keys_used = []
-        # this structure exists to help random index placement
-        answer_order_key = {i:None for i in range(0,answer_length)}
-        correct_answer_placement_index = randrange(0, answer_length)
-        order_keys_used.append(correct_answer_placement_index)
-        answer_order_key[correct_answer_placement_index] = question_obj.correct_multiple_choice_answer
-        
-        wrong_answers = question_obj.other_multiple_choice_answers.order_by('-created')
-        while len(incorrect_answer_indexes_added) < answer_length -1:
-            # get an unused order key to place an answer
-            random_order_key = randrange(0, answer_length)
-            while random_order_key in order_keys_used:
-                random_order_key = randrange(0, answer_length)
-            order_keys_used.append(random_order_key)
-            # get an unused wrong answer index
-            wrong_answer_index = randrange(0, wrong_answers.count())
-            while wrong_answer_index in incorrect_answer_indexes_added:
-                 wrong_answer_index = randrange(0, wrong_answers.count())
-            incorrect_answer_indexes_added.append(wrong_answer_index)
-            # make structure assignment
-            answer_order_key[random_order_key] = wrong_answers[wrong_answer_index]
-        # now that we've filled the dict create a list comprehension
-        # excluding none of the above and all the above answers
-
-        answer_list = [
-            answer_order_key[key] for key in range(0,answer_length)
-            if (not(answer_order_key[key].is_all_of_the_above) 
-                and not(answer_order_key[key].is_none_of_the_above))
-        ]
-        # now we add a list only including none or all the aboves
-        none_all_list = [
-            answer_order_key[key] for key in range(0,answer_length)
-            if (answer_order_key[key].is_all_of_the_above
-                or answer_order_key[key].is_none_of_the_above)
-        ]
-        # we finally have all answers ordered, create the list
-        final_list = answer_list + none_all_list
-        for order, answer in enumerate(final_list):
-            new_option = CourseTestQuestionAnswerOption.objects.create(
-                question_instance=self,
-                answer_option=answer,
-                order=order
-            )
-            new_option.save()
+        CourseTestQuestionAnswerOption.objects.bulk_create([
+            CourseTestQuestionAnswerOption(question_instance=self, answer_option=answer, order=order)
+            for order, answer in enumerate(final_list)
+        ])
 
         return final_list
 
+    @property
+    def navigation_map(self):
+        return get_navigation_map(self.course_test_instance)
+
+    @property
+    def navigation_position(self):
+        return question_position(self.navigation_map, self.guid)
+
     @property
     def previous_instance_url(self):
-        try:
-            instance = self.get_manager.get(course_test_instance=self.course_test_instance, 
-                order=self.order-1)
-            if self.course_test_instance.is_practice:
-                return reverse('course_practice_test_question', 
-                    kwargs={'question_instance_guid':instance.guid})
-            return reverse('course_test_question', kwargs={'question_instance_guid':instance.guid})
-        except self.DoesNotExist:
+        position = self.navigation_position
+        if not position:
             return ''
+        return question_url(self.navigation_map, self.navigation_map['questions'][position - 1][0])
 
     @property
     def next_instance_url(self):
-        try:
-            instance = self.get_manager.get(course_test_instance=self.course_test_instance, 
-                order=self.order+1)
-            if self.course_test_instance.is_practice:
-                return reverse('course_practice_test_question', 
-                    kwargs={'question_instance_guid':instance.guid})
-            return reverse('course_test_question', kwargs={'question_instance_guid':instance.guid})
-        except self.DoesNotExist:
+        position = self.navigation_position
+        questions = self.navigation_map['questions']
+        if position is None or position + 1 >= len(questions):
             return ''
+        return question_url(self.navigation_map, questions[position + 1][0])
 
     @property
     def next_unanswered_instance_url(self):
-        unanswered_instance = None
-        unanswered_instances_after = self.get_manager.filter(course_test_instance=self.course_test_instance,
-            order__gte=self.order).exclude(guid=self.guid).exclude(course_test_answer_instance__isnull=False
-            ).order_by('order')
-        unanswered_instances_before = self.get_manager.filter(course_test_instance=self.course_test_instance,
-            order__lte=self.order).exclude(guid=self.guid).exclude(course_test_answer_instance__isnull=False
-            ).order_by('order')
-        if unanswered_instances_after.count() > 0:
-            unanswered_instance = unanswered_instances_after[0]
-        elif unanswered_instances_before.count() > 0:
-            unanswered_instance = unanswered_instances_before[0]
-
-        if unanswered_instance:
-            if self.course_test_instance.is_practice:
-                return reverse('course_practice_test_question', 
-                    kwargs={'question_instance_guid':unanswered_instance.guid})
-            return reverse('course_test_question', kwargs={'question_instance_guid':unanswered_instance.guid})
+        position = self.navigation_position or 0
+        questions = self.navigation_map['questions']
+        # first unanswered question after this one, wrapping around to the start
+        for guid, answered in questions[position + 1:] + questions[:position]:
+            if not answered:
+                return question_url(self.navigation_map, guid)
         return ''
 
+    @property
+    def question_palette(self):
+        return [
+            {
+                'number': number,
+                'url': question_url(self.navigation_map, guid),
+                'answered': answered,
+                'current': guid == str(self.guid),
+            }
+            for number, (guid, answered) in enumerate(self.navigation_map['questions'], start=1)
+        ]
+
 class CourseTest(BaseModel):
 
     class RetakePolicy(models.TextChoices):
@@ -808,40 +1046,57 @@ class CourseTest(BaseModel):
         return human_time_duration(self.maximum_time_seconds)
 
     def generate_test_instance_for_student(self, student, is_practice=False):
-        from .models import CourseTestInstance, CourseTestQuestionInstance
-        # no active tests found, generate one
-        number_of_available_questions = self.number_of_available_questions
+        from .models import (CourseTestInstance, CourseTestQuestionInstance,
+            CourseTestQuestionAnswerOption, MultipleChoiceTestQuestion)
+        # question pool and wrong answer pools are each fetched once, everything else is
+        # sampled in memory and written with bulk inserts
+        question_pool = list(self.multiple_choice_test_questions.select_related(
+            'correct_multiple_choice_answer').order_by('-created'))
+        number_of_questions = len(question_pool)
+        # 0 means length of test questions
+        if self.max_number_of_questions:
+            number_of_questions = min(number_of_questions, self.max_number_of_questions)
         # we can only generate if we have questions
-        if number_of_available_questions > 0:
+        if number_of_questions == 0:
+            return None
+
+        chosen_questions = random.sample(question_pool, number_of_questions)
+        wrong_answers = {question.pk: [] for question in chosen_questions}
+        wrong_answer_links = MultipleChoiceTestQuestion.other_multiple_choice_answers.through.objects.filter(
+            multiplechoicetestquestion__in=chosen_questions).select_related('multiplechoiceanswer'
+            ).order_by('-multiplechoiceanswer__created')
+        for link in wrong_answer_links:
+            wrong_answers[link.multiplechoicetestquestion_id].append(link.multiplechoiceanswer)
+
+        with transaction.atomic():
             new_test_instance = CourseTestInstance.objects.create(is_practice=is_practice,
                 course_test=self, student=student)
-            new_test_instance.save()
-            # generate the questions
-            
-            available_questions = self.multiple_choice_test_questions.order_by('-created')
-            indexes_added = []
-            while len(indexes_added) < number_of_available_questions:
-                random_index = randrange(0, number_of_available_questions)
-                while random_index in indexes_added:
-                    random_index = randrange(0, number_of_available_questions)
-                indexes_added.append(random_index)
-                random_question = available_questions[random_index]
-                new_question = CourseTestQuestionInstance.objects.create(
-                    course_test_instance=new_test_instance,
-                    course_test_question=random_question,
-                    order=len(indexes_added))
-                new_question.save()
-                new_question.create_answer_options()
-
-            return new_test_instance
-        return None
+            question_instances = CourseTestQuestionInstance.objects.bulk_create([
+                CourseTestQuestionInstance(course_test_instance=new_test_instance,
+                    course_test_question=question, order=order)
+                for order, question in enumerate(chosen_questions, start=1)
+            ])
+            answer_options = []
+            for question_instance, question in zip(question_instances, chosen_questions):
+                question.course_test = self
+                final_list = ordered_answer_options(question.correct_multiple_choice_answer,
+                    wrong_answers[question.pk], question.answer_length_for(len(wrong_answers[question.pk])))
+                answer_options += [
+                    CourseTestQuestionAnswerOption(question_instance=question_instance,
+                        answer_option=answer, order=order)
+                    for order, answer in enumerate(final_list or [])
+                ]
+            CourseTestQuestionAnswerOption.objects.bulk_create(answer_options)
+
+        return new_test_instance
 
     def get_or_generate_test_instance_for_student(self, student, is_practice=False):
         #look for an existing active test and return if relevant
         # we generate new practice tests after old ones are finished
         if is_practice:
             active_tests = self.course_test_instances.filter(student=student, 
-                test_finished_on__isnull=True, is_practice=is_practice)
+                test_finished_on__isnull=True, is_practice=is_practice).exclude(
+                deadline_at__lte=timezone.now())
         # live test. Cannot have a retake marked, return completed tests as well
         # return of a completed test will mean inability to take a new one
         else:
@@ -850,8 +1105,25 @@ class CourseTest(BaseModel):
         if active_tests.count() > 0:
             return active_tests[0]
 
+        # practice tests come ready made from the pool when the refill worker keeps one
+        if is_practice:
+            pooled_test = CourseTestInstance.objects.claim_practice_test(self, student)
+            if pooled_test:
+                return pooled_test
+
         return self.generate_test_instance_for_student(student, is_practice=is_practice)
 
+    def refill_practice_test_pool(self, depth):
+        if not self.allow_practice_tests:
+            return 0
+        missing = depth - CourseTestInstance.objects.practice_pool(self).count()
+        generated = 0
+        for i in range(missing):
+            if self.generate_test_instance_for_student(None, is_practice=True) is None:
+                break
+            generated += 1
+        return generated
+
     def __str__(self):
         return '%s %s' %(self.course.name, self.order)
 
@@ -865,7 +1137,9 @@ class MultipleChoiceAnswer(BaseModel):
     def __str__(self):
         return self.value
 
-class MultipleChoiceTestQuestion(BaseModel):
+class MultipleChoiceTestQuestion(MarkdownContentModel, BaseModel):
+    markdown_fields = ('question_contents', 'question_post_answer_comments')
+
     course_test = models.ForeignKey('CourseTest', null=True, on_delete=models.CASCADE,
         related_name='multiple_choice_test_questions')
     question_contents = models.TextField(default='', help_text=mark_safe('''
@@ -892,8 +1166,11 @@ class MultipleChoiceTestQuestion(BaseModel):
 
     @property
     def calculated_answer_length(self):
+        return self.answer_length_for(self.other_multiple_choice_answers.count())
+
+    def answer_length_for(self, wrong_answer_count):
         # +1 for correct answer
-        max_available = self.other_multiple_choice_answers.count() + 1
+        max_available = wrong_answer_count + 1
         if self.course_test.is_course_fixed_answer_length:
             if self.course_test.course_fixed_answer_length:
                 return min(max_available, self.course_test.course_fixed_answer_length)
@@ -905,5 +1182,74 @@ class MultipleChoiceTestQuestion(BaseModel):
     def __str__(self):
         return self.question_contents
 
-
-
+# cached entries built from course content carry a content version in their key, see core/cache.py
+
+@receiver(post_delete, sender=Course, dispatch_uid="course_delete_cache_version")
+@receiver(post_save, sender=Course, dispatch_uid="course_cache_version")
+def course_changed(sender, instance, **kwargs):
+    bump_cache_version(course_content(instance.pk), COURSE_CATALOG)
+
+# pages, tests and questions can be moved to another course or test, so the one they're
+# leaving is read before the save and refreshed along with the new one
+@receiver(pre_save, sender=CoursePage, dispatch_uid="course_page_previous_parent")
+@receiver(pre_save, sender=CourseTest, dispatch_uid="course_test_previous_parent")
+@receiver(pre_save, sender=MultipleChoiceTestQuestion, dispatch_uid="test_question_previous_parent")
+def remember_previous_parent(sender, instance, **kwargs):
+    parent_field = 'course_test_id' if sender is MultipleChoiceTestQuestion else 'course_id'
+    instance._previous_parent_id = None
+    if instance.pk:
+        instance._previous_parent_id = sender.objects.filter(pk=instance.pk).values_list(parent_field,
+            flat=True).first()
+
+def parent_ids(instance, parent_field):
+    return {parent_id for parent_id in (getattr(instance, parent_field),
+        getattr(instance, '_previous_parent_id', None)) if parent_id}
+
+@receiver(post_delete, sender=CoursePage, dispatch_uid="course_page_delete_cache_version")
+@receiver(post_save, sender=CoursePage, dispatch_uid="course_page_cache_version")
+def course_page_changed(sender, instance, **kwargs):
+    bump_cache_version(*[course_content(course_id) for course_id in parent_ids(instance, 'course_id')],
+        COURSE_CATALOG)
+
+@receiver(post_delete, sender=CourseTest, dispatch_uid="course_test_delete_cache_version")
+@receiver(post_save, sender=CourseTest, dispatch_uid="course_test_cache_version")
+def course_test_changed(sender, instance, **kwargs):
+    bump_cache_version(*[course_content(course_id) for course_id in parent_ids(instance, 'course_id')],
+        course_test_content(instance.pk), COURSE_CATALOG)
+
+@receiver(post_delete, sender=MultipleChoiceTestQuestion, dispatch_uid="test_question_delete_cache_version")
+@receiver(post_save, sender=MultipleChoiceTestQuestion, dispatch_uid="test_question_cache_version")
+def test_question_changed(sender, instance, **kwargs):
+    # question counts are part of the course structure
+    course_test_ids = parent_ids(instance, 'course_test_id')
+    course_ids = CourseTest.objects.filter(pk__in=course_test_ids, course__isnull=False).values_list(
+        'course_id', flat=True).distinct()
+    bump_cache_version(*[course_test_content(course_test_id) for course_test_id in course_test_ids],
+        *[course_content(course_id) for course_id in course_ids])
+
+# pre_delete for answers, by post_delete the questions that used them can no longer be found
+@receiver(pre_delete, sender=MultipleChoiceAnswer, dispatch_uid="answer_delete_cache_version")
+@receiver(post_save, sender=MultipleChoiceAnswer, dispatch_uid="answer_cache_version")
+def answer_changed(sender, instance, **kwargs):
+    course_test_ids = MultipleChoiceTestQuestion.objects.filter(Q(correct_multiple_choice_answer=instance)
+        | Q(other_multiple_choice_answers=instance)).order_by().values_list('course_test_id', flat=True).distinct()
+    bump_cache_version(*[course_test_content(course_test_id) for course_test_id in course_test_ids])
+
+@receiver(post_save, sender=CoursePage, dispatch_uid="course_page_prerender_markdown")
+@receiver(post_save, sender=MultipleChoiceTestQuestion, dispatch_uid="test_question_prerender_markdown")
+def prerender_markdown(sender, instance, **kwargs):
+    instance.prerender_markdown()
+
+@receiver(post_save, sender=CourseTest, dispatch_uid="course_test_discard_practice_pool")
+@receiver(post_delete, sender=MultipleChoiceTestQuestion, dispatch_uid="test_question_delete_discard_practice_pool")
+@receiver(post_save, sender=MultipleChoiceTestQuestion, dispatch_uid="test_question_discard_practice_pool")
+def discard_practice_pool(sender, instance, **kwargs):
+    course_test_ids = {instance.pk} if sender is CourseTest else parent_ids(instance, 'course_test_id')
+    for course_test_id in course_test_ids:
+        CourseTestInstance.objects.discard_practice_pool(course_test_id)
+
+@receiver(m2m_changed, sender=MultipleChoiceTestQuestion.other_multiple_choice_answers.through,
+    dispatch_uid="test_question_answers_discard_practice_pool")
+def discard_practice_pool_on_answer_change(sender, instance, action, **kwargs):
+    if action in ('post_add', 'post_remove', 'post_clear') and isinstance(instance, MultipleChoiceTestQuestion):
+        CourseTestInstance.objects.discard_practice_pool(instance.course_test_id)
@@ -0,0 +1,103 @@
+from django.conf import settings
+from django.urls import reverse
+from django.utils.safestring import mark_safe
+
+from .cache import cache, cache_key, get_or_build
+
+# Ordered navigation map for a test instance, loaded in one query and cached:
+#   is_practice  which question url to build
+#   questions    [(question instance guid, answered), ...] in question order
+# prev / next / next unanswered and the question palette are all worked out from it in memory.
+
+
+def navigation_map_key(test_guid):
+    return cache_key('test_navigation', test_guid)
+
+
+def build_navigation_map(test_instance):
+    return {
+        'is_practice': test_instance.is_practice,
+        'questions': [
+            (str(guid), answer_instance is not None)
+            for guid, answer_instance in test_instance.course_test_question_instances.order_by(
+                'order').values_list('guid', 'course_test_answer_instance')
+        ],
+    }
+
+
+def get_navigation_map(test_instance):
+    # kept on the instance too, a question page reads it several times
+    navigation_map = getattr(test_instance, '_navigation_map', None)
+    if navigation_map is None:
+        navigation_map = get_or_build(navigation_map_key(test_instance.guid),
+            lambda: build_navigation_map(test_instance), settings.TEST_NAVIGATION_CACHE_SECONDS)
+        test_instance._navigation_map = navigation_map
+    return navigation_map
+
+
+def mark_answered(navigation_map, question_guids):
+    answered = {str(guid) for guid in question_guids}
+    navigation_map['questions'] = [
+        (guid, is_answered or guid in answered) for guid, is_answered in navigation_map['questions']
+    ]
+
+
+def record_navigation_answers(test_instance, question_guids):
+    if getattr(test_instance, '_navigation_map', None) is not None:
+        mark_answered(test_instance._navigation_map, question_guids)
+    # only cached maps are updated, a missing one is rebuilt when needed
+    key = navigation_map_key(test_instance.guid)
+    navigation_map = cache.get(key)
+    if navigation_map is not None:
+        mark_answered(navigation_map, question_guids)
+        cache.set(key, navigation_map, settings.TEST_NAVIGATION_CACHE_SECONDS)
+
+
+def question_url(navigation_map, guid):
+    if navigation_map['is_practice']:
+        return reverse('course_practice_test_question', kwargs={'question_instance_guid':guid})
+    return reverse('course_test_question', kwargs={'question_instance_guid':guid})
+
+
+def question_position(navigation_map, guid):
+    guid = str(guid)
+    for position, (question_guid, answered) in enumerate(navigation_map['questions']):
+        if question_guid == guid:
+            return position
+    return None
+
+
+def render_page_navigation(guids, page_index):
+    total_pages = len(guids)
+    if total_pages <= 10:
+        page_indexing_obj = set(range(1, total_pages + 1))
+    else:
+        page_indexing_obj = (set(range(1, 4))
+                 | set(range(max(1, page_index - 1), min(page_index + 4, total_pages + 1)))
+                 | set(range(total_pages - 2, total_pages + 1)))
+
+    def display_at_index(index, target_index):
+        tag_url = reverse('course_page', kwargs={'page_guid':guids[index-1]})
+        inner_tag = str(index) if index != target_index else '[ %s ]' % index
+        return '<div class="col text-center"><a href="%s">%s</a></div>' % (tag_url, inner_tag)
+
+    # Display pages in order with ellipses
+    def display():
+        last_page = 0
+        for p in sorted(page_indexing_obj):
+            if p != last_page + 1: yield '<div class="col text-center">...</div>'
+            yield display_at_index(p, page_index+1)
+            last_page = p
+    display_columns = ' '.join(display())
+    return '<div class="row page-navigation-bar">%s</div>' % display_columns
+
+
+def course_page_navigation_html(structure, page_guid):
+    # rendered once per course structure version and page
+    position = structure.page_position(page_guid)
+    if position is None:
+        return ''
+    html = get_or_build(cache_key('course_page_nav', structure.pk, structure.version, position),
+        lambda: render_page_navigation([page.guid for page in structure.pages], position),
+        settings.COURSE_STRUCTURE_CACHE_SECONDS)
+    return mark_safe(html)
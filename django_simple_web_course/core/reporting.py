@@ -0,0 +1,187 @@
+import atexit
+import logging
+import os
+import threading
+import time
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import models, transaction
+from django.db.models import Case, Count, F, Q, Sum, Value, When
+from django.db.models.functions import TruncDate
+from django.utils import timezone
+
+# Daily learning activity rollups, so reports never have to scan the page view and test tables:
+#   StudentCourseActivityDay   one row per (day, course, student)
+#   CourseActivityDay          one row per (day, course)
+# both counting seconds credited, pages viewed and live tests started, finished and passed.
+# Tracking and scoring add to them as things happen (batched, see ActivityBuffer),
+# backfill_activity_rollups rebuilds whole days from the raw tables. Activity is passed around
+# as {(day, course pk, student pk): {field: amount}}
+
+logger = logging.getLogger(__name__)
+
+
+def activity_day(moment):
+    return timezone.localdate(moment)
+
+
+def add_activity(activity, day, course_id, student_id, **amounts):
+    counts = activity.setdefault((day, course_id, student_id), {})
+    for field, amount in amounts.items():
+        counts[field] = counts.get(field, 0) + (amount or 0)
+    return activity
+
+
+def merge_activity(activity, other):
+    for (day, course_id, student_id), amounts in other.items():
+        add_activity(activity, day, course_id, student_id, **amounts)
+    return activity
+
+
+def page_view_activity(activity, page_view_instance, **amounts):
+    # page views count on the day they were created, the same day they're archived under
+    course_view_instance = page_view_instance.course_view_instance
+    return add_activity(activity, activity_day(page_view_instance.created), course_view_instance.course_id,
+        course_view_instance.student_id, **amounts)
+
+
+def course_activity(activity):
+    # sum student activity up to (day, course)
+    totals = {}
+    for (day, course_id, student_id), amounts in activity.items():
+        counts = totals.setdefault((day, course_id), {})
+        for field, amount in amounts.items():
+            counts[field] = counts.get(field, 0) + amount
+    return totals
+
+
+def increment_rows(model, key_fields, rows):
+    # make sure every row exists, then add to all of them in one UPDATE
+    keys = sorted(rows)
+    model.objects.bulk_create([model(**dict(zip(key_fields, key))) for key in keys], ignore_conflicts=True)
+    matches = [Q(**dict(zip(key_fields, key))) for key in keys]
+    if len(keys) == 1:
+        return model.objects.filter(matches[0]).update(**{field: F(field) + amount
+            for field, amount in rows[keys[0]].items()})
+    fields = {field for amounts in rows.values() for field in amounts}
+    return model.objects.filter(reduce(or_, matches)).update(**{field: F(field) + Case(
+        *[When(match, then=Value(rows[key].get(field, 0))) for match, key in zip(matches, keys)],
+        default=Value(0), output_field=models.BigIntegerField()) for field in fields})
+
+
+def record_activity(activity):
+    from .models import CourseActivityDay, StudentCourseActivityDay
+    activity = {key: {field: amount for field, amount in amounts.items() if amount}
+        for key, amounts in activity.items() if key[1] and key[2]}
+    activity = {key: amounts for key, amounts in activity.items() if amounts}
+    if not activity:
+        return
+    with transaction.atomic():
+        increment_rows(StudentCourseActivityDay, ('day', 'course_id', 'student_id'), activity)
+        increment_rows(CourseActivityDay, ('day', 'course_id'), course_activity(activity))
+
+
+def build_activity(first_day, last_day):
+    # activity for every day from first_day to last_day, counted from the raw tables
+    from .models import CoursePageViewInstance, CoursePageViewRollup, CourseTestInstance
+    activity = {}
+    days = (first_day, last_day)
+
+    page_views = CoursePageViewInstance.objects.filter(created__date__range=days,
+        course_view_instance__isnull=False).annotate(day=TruncDate('created')).order_by().values('day',
+        'course_view_instance__course', 'course_view_instance__student').annotate(
+        seconds=Sum('total_seconds_spent'), views=Count('pk'))
+    archived_page_views = CoursePageViewRollup.objects.filter(day__range=days).order_by().values('day',
+        'course_view_instance__course', 'course_view_instance__student').annotate(
+        seconds=Sum('total_seconds_spent'), views=Sum('view_count'))
+    for rows in (page_views, archived_page_views):
+        for row in rows:
+            add_activity(activity, row['day'], row['course_view_instance__course'],
+                row['course_view_instance__student'], seconds_credited=row['seconds'],
+                pages_viewed=row['views'])
+
+    live_tests = CourseTestInstance.objects.filter(is_practice=False, student__isnull=False).order_by()
+    for row in live_tests.filter(test_started_on__date__range=days).annotate(
+        day=TruncDate('test_started_on')).values('day', 'course_test__course', 'student').annotate(
+        started=Count('pk')):
+        add_activity(activity, row['day'], row['course_test__course'], row['student'],
+            tests_started=row['started'])
+    for row in live_tests.filter(test_finished_on__date__range=days).annotate(
+        day=TruncDate('test_finished_on')).values('day', 'course_test__course', 'student').annotate(
+        finished=Count('pk'), passed=Count('pk', filter=Q(passed=True))):
+        add_activity(activity, row['day'], row['course_test__course'], row['student'],
+            tests_finished=row['finished'], tests_passed=row['passed'])
+    return activity
+
+
+def rebuild_activity(first_day, last_day):
+    # replace the rollups for a range of days, returns how many student rows were written
+    from .models import CourseActivityDay, StudentCourseActivityDay
+    activity = {key: amounts for key, amounts in build_activity(first_day, last_day).items()
+        if key[1] and key[2]}
+    with transaction.atomic():
+        StudentCourseActivityDay.objects.filter(day__range=(first_day, last_day)).delete()
+        CourseActivityDay.objects.filter(day__range=(first_day, last_day)).delete()
+        StudentCourseActivityDay.objects.bulk_create([StudentCourseActivityDay(day=day, course_id=course_id,
+            student_id=student_id, **amounts) for (day, course_id, student_id), amounts in activity.items()],
+            batch_size=1000)
+        CourseActivityDay.objects.bulk_create([CourseActivityDay(day=day, course_id=course_id, **amounts)
+            for (day, course_id), amounts in course_activity(activity).items()], batch_size=1000)
+    return len(activity)
+
+
+class ActivityBuffer:
+    '''
+    Activity from the request path, added up in process and written with record_activity every
+    ACTIVITY_ROLLUP_FLUSH_SECONDS, so the (day, course) row every student in a course shares is
+    updated once per worker per interval rather than on every page view. Like the cache stats
+    it's flushed by whichever request comes in after the interval, and at exit. Counts a killed
+    worker hadn't written yet are lost, backfill_activity_rollups rebuilds the days they were on.
+    '''
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.activity = {}
+        self.flushed_at = time.monotonic()
+        self._pid = os.getpid()
+
+    def add(self, activity):
+        with self._lock:
+            # forked workers don't write the parent's counts again
+            if self._pid != os.getpid():
+                self._reset()
+            merge_activity(self.activity, activity)
+            if time.monotonic() - self.flushed_at < settings.ACTIVITY_ROLLUP_FLUSH_SECONDS:
+                return
+        self.flush()
+
+    def flush(self):
+        with self._lock:
+            if self._pid != os.getpid():
+                self._reset()
+            activity, self.activity = self.activity, {}
+            self.flushed_at = time.monotonic()
+        if not activity:
+            return
+        try:
+            record_activity(activity)
+        except Exception:
+            logger.exception('failed to write activity for %s students, keeping it for the next flush',
+                len(activity))
+            with self._lock:
+                merge_activity(self.activity, activity)
+
+
+activity_buffer = ActivityBuffer()
+atexit.register(activity_buffer.flush)
+
+
+def queue_activity(activity):
+    # buffered once the surrounding transaction commits, so rolled back work isn't counted
+    if activity:
+        transaction.on_commit(lambda: activity_buffer.add(activity))
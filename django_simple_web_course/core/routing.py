@@ -0,0 +1,89 @@
+from django.conf import settings
+from django.urls import reverse
+from django.utils import timezone
+
+from .cache import cache, cache_key
+
+# Compact record LiveTestRoutingMiddleware checks on every request while a student is in a
+# live test. Building it costs a couple of queries, reading it costs none:
+#   home_url        where students are sent back to
+#   deadline        epoch seconds the timed test expires at, None if untimed or not started
+#   complete        test finished or every question answered
+#   question_count  / answered_count  kept current as answers come in
+#   allowed_paths   every path the student may visit until the test is done
+
+
+def routing_record_key(test_guid):
+    return cache_key('live_test_route', test_guid)
+
+
+def build_routing_record(test_instance):
+    question_rows = list(test_instance.course_test_question_instances.values_list('guid',
+        'course_test_answer_instance'))
+    answered_count = len([row for row in question_rows if row[1] is not None])
+    deadline = None
+    if test_instance.deadline_at:
+        deadline = test_instance.deadline_at.timestamp()
+
+    allowed_paths = {reverse('login'), reverse('logout'), test_instance.home_url}
+    # the one page test UI and the api it talks to
+    allowed_paths.update(
+        reverse(name, kwargs={'test_instance_guid':test_instance.guid})
+        for name in ('course_test_client', 'test_instance_payload_api', 'test_instance_answer_api',
+            'test_instance_answers_api', 'test_instance_dwell_api')
+    )
+    allowed_paths.update(
+        reverse('course_test_question', kwargs={'question_instance_guid':guid})
+        for guid, answer_instance in question_rows
+    )
+    return {
+        'home_url': test_instance.home_url,
+        'deadline': deadline,
+        'complete': test_instance.test_finished_on is not None or (
+            len(question_rows) > 0 and answered_count == len(question_rows)),
+        'question_count': len(question_rows),
+        'answered_count': answered_count,
+        'allowed_paths': frozenset(allowed_paths),
+    }
+
+
+def get_routing_record(test_guid):
+    from .models import CourseTestInstance
+    key = routing_record_key(test_guid)
+    record = cache.get(key)
+    if record is None:
+        try:
+            test_instance = CourseTestInstance.objects.select_related('course_test').get(guid=test_guid)
+        except CourseTestInstance.DoesNotExist:
+            return None
+        record = build_routing_record(test_instance)
+        cache.set(key, record, settings.LIVE_TEST_ROUTING_CACHE_SECONDS)
+    return record
+
+
+def routing_record_is_finished(record, now=None):
+    if record['complete']:
+        return True
+    now = now or timezone.now()
+    return record['deadline'] is not None and record['deadline'] <= now.timestamp()
+
+
+def record_routing_answers(test_guid, unanswered_count):
+    # only records already in the cache are updated, a missing one is rebuilt when needed.
+    # Set from the unanswered count rather than incremented so resent answers can't overcount
+    key = routing_record_key(test_guid)
+    record = cache.get(key)
+    if record is None:
+        return
+    record['answered_count'] = max(record['question_count'] - unanswered_count, 0)
+    record['complete'] = record['complete'] or unanswered_count == 0
+    cache.set(key, record, settings.LIVE_TEST_ROUTING_CACHE_SECONDS)
+
+
+def record_routing_test_finished(test_guid):
+    key = routing_record_key(test_guid)
+    record = cache.get(key)
+    if record is None:
+        return
+    record['complete'] = True
+    cache.set(key, record, settings.LIVE_TEST_ROUTING_CACHE_SECONDS)
@@ -0,0 +1,78 @@
+from collections import namedtuple
+
+from django.conf import settings
+from django.db.models import Count
+
+from .cache import cache_key, cache_version, course_content, get_or_build
+
+# Read only snapshot of a course's structure, built in three queries:
+#   pages      CoursePageEntry tuples in page number order
+#   tests      CourseTestEntry tuples in test order, with how many questions each has
+#   positions  page guid -> position in pages, so a page render doesn't scan 500+ pages
+# Snapshots are cached under the course content version (see core/cache.py) and also kept in
+# process, so a request only costs the version lookup. Saving the course or any of its pages,
+# tests or questions changes the version.
+
+CoursePageEntry = namedtuple('CoursePageEntry', ['pk', 'guid', 'page_number', 'page_title'])
+CourseTestEntry = namedtuple('CourseTestEntry', ['pk', 'guid', 'order', 'allow_practice_tests',
+    'only_practice_test', 'test_is_timed', 'question_count', 'questions_per_test'])
+
+
+class CourseStructure(namedtuple('CourseStructure', ['version', 'pk', 'guid', 'name', 'pages', 'tests',
+        'positions'])):
+    __slots__ = ()
+
+    @property
+    def first_page(self):
+        return self.pages[0] if self.pages else None
+
+    @property
+    def last_page_number(self):
+        return self.pages[-1].page_number if self.pages else 0
+
+    @property
+    def practice_tests(self):
+        return [test for test in self.tests if test.allow_practice_tests]
+
+    @property
+    def live_tests(self):
+        return [test for test in self.tests if not test.only_practice_test]
+
+    def page_position(self, page_guid):
+        return self.positions.get(str(page_guid))
+
+
+# course pk -> the newest snapshot this process has seen
+_snapshots = {}
+
+# part of the cache key, changed whenever CourseStructure's fields change so snapshots pickled
+# with the old fields are never read back
+STRUCTURE_FORMAT = 2
+
+
+def build_course_structure(course_pk, version):
+    from .models import Course, CoursePage, CourseTest
+    course = Course.objects.only('guid', 'name').get(pk=course_pk)
+    pages = tuple(CoursePageEntry(page.pk, str(page.guid), page.page_number, page.page_title)
+        for page in CoursePage.objects.filter(course_id=course_pk).only('guid', 'page_number',
+        'page_title').order_by('page_number'))
+    tests = []
+    for test in CourseTest.objects.filter(course_id=course_pk).annotate(
+        question_count=Count('multiple_choice_test_questions')).order_by('order'):
+        questions_per_test = test.question_count
+        if test.max_number_of_questions:
+            questions_per_test = min(questions_per_test, test.max_number_of_questions)
+        tests.append(CourseTestEntry(test.pk, str(test.guid), test.order, test.allow_practice_tests,
+            test.only_practice_test, test.test_is_timed, test.question_count, questions_per_test))
+    positions = {page.guid: position for position, page in enumerate(pages)}
+    return CourseStructure(version, course.pk, str(course.guid), course.name, pages, tuple(tests), positions)
+
+
+def get_course_structure(course_pk):
+    version = cache_version(course_content(course_pk))
+    structure = _snapshots.get(course_pk)
+    if structure is None or structure.version != version:
+        structure = get_or_build(cache_key('course_structure', STRUCTURE_FORMAT, course_pk, version),
+            lambda: build_course_structure(course_pk, version), settings.COURSE_STRUCTURE_CACHE_SECONDS)
+        _snapshots[course_pk] = structure
+    return structure
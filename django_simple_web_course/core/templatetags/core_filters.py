@@ -1,5 +1,5 @@
 from django import template
-import markdown
+from core.utils import render_markdown_html
 from django.utils.safestring import mark_safe
 
 register = template.Library()
@@ -10,15 +10,15 @@ def modulus(value, arg):
 
 @register.filter
 def render_markdown(value):
-    return mark_safe(markdown.markdown(value))
+    return mark_safe(render_markdown_html(value))
 
 @register.filter
 def course_continue_url(course, student):
     return mark_safe(course.continue_url(student))
 
 @register.filter
-def course_recent_url_history(course, student):
-    return course.url_recent_history(student)
+def course_recent_url_history(course, student_id):
+    return course.url_recent_history(student_id)
 
 
 @register.filter
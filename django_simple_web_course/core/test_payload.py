@@ -0,0 +1,125 @@
+from django.conf import settings
+from django.urls import reverse
+
+from .cache import course_test_content, get_or_build, versioned_cache_key
+from .utils import render_markdown_html
+
+# Everything the client side test UI needs in one response. The question content of a test
+# instance never changes once generated, so that half is cached:
+#   questions   [{guid, number, question_html, options, post_answer_comments_html,
+#                 correct_answer_id, correct_answer, option_guids}, ...] in question order
+# Answered state, correctness and time remaining are added per request. The correct answer and
+# the post answer comments are only sent for questions that have been answered.
+
+
+def test_payload_key(test_instance):
+    # question content comes from the course test's questions and answers, so editing them
+    # changes the course test content version and with it the key
+    return versioned_cache_key(course_test_content(test_instance.course_test_id), 'test_payload',
+        test_instance.guid)
+
+
+def build_test_questions(test_instance):
+    from .models import CourseTestQuestionAnswerOption
+    question_instances = list(test_instance.question_instances.select_related(
+        'course_test_question__correct_multiple_choice_answer'))
+    options = {}
+    for option in CourseTestQuestionAnswerOption.objects.filter(
+        question_instance__course_test_instance=test_instance).select_related('answer_option').order_by(
+        'question_instance', 'order'):
+        options.setdefault(option.question_instance_id, []).append(option)
+
+    questions = []
+    for number, question_instance in enumerate(question_instances, start=1):
+        question = question_instance.course_test_question
+        question_options = options.get(question_instance.pk, [])
+        questions.append({
+            'guid': str(question_instance.guid),
+            'number': number,
+            'question_html': render_markdown_html(question.question_contents),
+            'options': [{'guid': str(option.guid), 'value': option.value} for option in question_options],
+            'post_answer_comments_html': render_markdown_html(question.question_post_answer_comments),
+            'correct_answer_id': question.correct_multiple_choice_answer_id,
+            'correct_answer': question.correct_multiple_choice_answer.value,
+            # answer id -> option guid, to report which option an answer came from
+            'option_guids': {option.answer_option_id: str(option.guid) for option in question_options},
+        })
+    return questions
+
+
+def get_test_questions(test_instance):
+    return get_or_build(test_payload_key(test_instance), lambda: build_test_questions(test_instance),
+        settings.TEST_PAYLOAD_CACHE_SECONDS)
+
+
+def question_state(question, answer_chosen_id):
+    state = {
+        'answered': answer_chosen_id is not None,
+        'chosen_option': None,
+        'is_correct': None,
+        'correct_answer': None,
+        'post_answer_comments_html': None,
+    }
+    if answer_chosen_id is not None:
+        state.update({
+            'chosen_option': question['option_guids'].get(answer_chosen_id),
+            'is_correct': answer_chosen_id == question['correct_answer_id'],
+            'correct_answer': question['correct_answer'],
+            'post_answer_comments_html': question['post_answer_comments_html'],
+        })
+    return state
+
+
+def test_instance_urls(test_instance):
+    return {
+        'home_url': test_instance.home_url,
+        'final_score_url': test_instance.final_score_url,
+        'answer_url': reverse('test_instance_answer_api', kwargs={'test_instance_guid':test_instance.guid}),
+        'answers_url': reverse('test_instance_answers_api', kwargs={'test_instance_guid':test_instance.guid}),
+        'dwell_url': reverse('test_instance_dwell_api', kwargs={'test_instance_guid':test_instance.guid}),
+    }
+
+
+def build_test_payload(test_instance):
+    from .models import CourseTestQuestionAnswerInstance
+    answers = dict(CourseTestQuestionAnswerInstance.objects.filter(
+        question_instance__course_test_instance=test_instance).values_list('question_instance__guid',
+        'answer_chosen_id'))
+    answers = {str(guid): answer_chosen_id for guid, answer_chosen_id in answers.items()}
+
+    payload = {
+        'guid': str(test_instance.guid),
+        'is_practice': test_instance.is_practice,
+        'is_complete': test_instance.is_complete,
+        'test_is_timed': test_instance.test_is_timed,
+        'seconds_remaining': int(test_instance.seconds_remaining),
+        'questions': [],
+    }
+    payload.update(test_instance_urls(test_instance))
+    for question in get_test_questions(test_instance):
+        question_payload = {
+            'guid': question['guid'],
+            'number': question['number'],
+            'question_html': question['question_html'],
+            'options': question['options'],
+        }
+        question_payload.update(question_state(question, answers.get(question['guid'])))
+        payload['questions'].append(question_payload)
+    return payload
+
+
+def answered_question_states(test_instance, answers):
+    # answers is {question instance guid: answer chosen id}
+    answers = {str(guid): answer_chosen_id for guid, answer_chosen_id in answers.items()}
+    states = []
+    for question in get_test_questions(test_instance):
+        if question['guid'] in answers:
+            state = question_state(question, answers[question['guid']])
+            state['guid'] = question['guid']
+            states.append(state)
+    return states
+
+
+def answered_question_state(test_instance, question_guid, answer_chosen_id):
+    states = answered_question_states(test_instance, {question_guid: answer_chosen_id})
+    return states[0] if states else None
@@ -1,3 +1,1118 @@
-from django.test import TestCase
+import json
+import random
+import uuid
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
 
-# Create your tests here.
+from django.conf import settings
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import IntegrityError, connection
+from django.http import HttpResponse
+from django.test import Client, RequestFactory, TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from django.utils.functional import SimpleLazyObject
+
+from .cache import (CacheStats, bump_cache_version, cache_key, cache_version, course_content,
+    course_test_content, get_or_build, versioned_cache_key)
+from .cursors import TrackingCursor
+from .dashboard import (TEST_STATUS_FAILED, TEST_STATUS_IN_PROGRESS, TEST_STATUS_NOT_STARTED,
+    student_dashboard_cards)
+from .decorators import page_tracking_enabled
+from .forms import TestQuestionInstanceForm
+from .management.commands.explain_hot_queries import Command as ExplainHotQueriesCommand
+from .models import (Course, CourseActivityDay, CoursePage, CoursePageViewInstance, CourseTest,
+    CourseTestInstance, CourseTestQuestionInstance, CourseViewInstance, MultipleChoiceAnswer,
+    MultipleChoiceTestQuestion, Student, StudentCourseActivityDay, StudentIdentificationDocument)
+from .reporting import ActivityBuffer, activity_buffer, activity_day, rebuild_activity
+from .routing import get_routing_record
+from .structure import get_course_structure
+from .tracking import (PAGE_VIEW_START, PAGE_VIEW_STOP, PageViewEventBuffer, record_page_view_start,
+    record_page_view_stop, write_page_view_events)
+from .utils import human_time_duration, markdown_cache_key, markdown_renderer, render_markdown_html
+from users.models import User
+
+
+class CourseTestCase(TestCase):
+    # a verified student and a published course with pages and a six question test
+
+    def setUp(self):
+        cache.clear()
+        self.user = User.objects.create_user(email='student@example.com', password='password')
+        self.student = Student.objects.get_or_create_from_user(user=self.user)
+        self.student.verified_on = timezone.now()
+        self.student.save()
+        self.course = Course.objects.create(name='Course', published=True, enforce_minimum_time=True,
+            practice_counts_for_time=True)
+        self.pages = [CoursePage.objects.create(course=self.course, page_number=number,
+            page_title='Page %s' % number) for number in range(1, 4)]
+        self.course_test = CourseTest.objects.create(course=self.course, order=1)
+        answers = [MultipleChoiceAnswer.objects.create(value='Answer %s' % number) for number in range(8)]
+        for number in range(6):
+            question = MultipleChoiceTestQuestion.objects.create(course_test=self.course_test,
+                question_contents='Question %s' % number, correct_multiple_choice_answer=answers[number])
+            question.other_multiple_choice_answers.set([answer for answer in answers
+                if answer != answers[number]][:5])
+        self.course_view_instance = CourseViewInstance.objects.create(student=self.student,
+            course=self.course)
+        self.client = Client()
+        self.client.force_login(self.user)
+
+    def page_view(self, started_seconds_ago=60):
+        return CoursePageViewInstance(url=self.pages[0].course_url,
+            course_view_instance=self.course_view_instance, course_page=self.pages[0], student=self.student,
+            page_view_start=timezone.now() - timedelta(seconds=started_seconds_ago))
+
+    def refresh_course_seconds(self):
+        self.course_view_instance.refresh_from_db()
+        return self.course_view_instance.total_seconds_spent
+
+
+class PageViewTrackingTests(CourseTestCase):
+
+    def test_retried_batch_is_written_once(self):
+        page_view_instance = self.page_view()
+        events = [(PAGE_VIEW_START, page_view_instance), (PAGE_VIEW_STOP, (page_view_instance.guid,
+            timezone.now()))]
+        write_page_view_events(events)
+        write_page_view_events(events)
+        self.assertEqual(CoursePageViewInstance.objects.filter(guid=page_view_instance.guid).count(), 1)
+        self.assertEqual(self.refresh_course_seconds(), 60)
+
+    def test_stop_flushed_before_its_start_is_retried(self):
+        # the start was queued by another worker, this one flushes the stop first
+        page_view_instance = self.page_view()
+        buffer = PageViewEventBuffer(max_size=10, batch_size=10, flush_interval_ms=10)
+        buffer.flush(extra_events=[(PAGE_VIEW_STOP, (str(page_view_instance.guid), timezone.now()))])
+        self.assertEqual(len(buffer._unmatched_stops), 1)
+
+        write_page_view_events([(PAGE_VIEW_START, page_view_instance)])
+        buffer.flush()
+        self.assertEqual(buffer._unmatched_stops, [])
+        # ignore_conflicts inserts don't set the pk
+        page_view_instance = CoursePageViewInstance.objects.get(guid=page_view_instance.guid)
+        self.assertIsNotNone(page_view_instance.page_view_stop)
+        self.assertEqual(self.refresh_course_seconds(), 60)
+
+    @override_settings(PAGE_VIEW_TRACKING_UNMATCHED_STOP_SECONDS=60)
+    def test_unmatched_stops_are_dropped_eventually(self):
+        buffer = PageViewEventBuffer(max_size=10, batch_size=10, flush_interval_ms=10)
+        with self.assertLogs('core.tracking', 'WARNING'):
+            buffer.flush(extra_events=[(PAGE_VIEW_STOP, ('00000000-0000-0000-0000-000000000000',
+                timezone.now() - timedelta(minutes=5)))])
+        self.assertEqual(buffer._unmatched_stops, [])
+
+    def test_flush_queries_dont_grow_with_the_batch(self):
+        def flush_stops(count):
+            page_view_instances = [self.page_view() for i in range(count)]
+            write_page_view_events([(PAGE_VIEW_START, instance) for instance in page_view_instances])
+            with CaptureQueriesContext(connection) as queries:
+                write_page_view_events([(PAGE_VIEW_STOP, (instance.guid, timezone.now()))
+                    for instance in page_view_instances])
+            return len(queries)
+        self.assertEqual(flush_stops(50), flush_stops(2))
+
+    def test_sync_stop_only_writes_the_stop_columns(self):
+        page_view_instance = record_page_view_start(self.page_view())
+        with CaptureQueriesContext(connection) as queries:
+            record_page_view_stop(page_view_instance.guid, timezone.now())
+        update = [query['sql'] for query in queries
+            if query['sql'].startswith('UPDATE "core_coursepageviewinstance"')]
+        self.assertEqual(len(update), 1)
+        self.assertNotIn('"url"', update[0])
+        self.assertEqual(self.refresh_course_seconds(), 60)
+
+    def test_created_is_the_request_time(self):
+        page_view_instance = self.page_view()
+        queued_at = page_view_instance.created
+        write_page_view_events([(PAGE_VIEW_START, page_view_instance)])
+        self.assertEqual(CoursePageViewInstance.objects.get(guid=page_view_instance.guid).created, queued_at)
+
+
+class TimeCreditTests(CourseTestCase):
+
+    def test_credit_seconds_adds_deltas(self):
+        other = CourseViewInstance.objects.create(student=self.student,
+            course=Course.objects.create(name='Other'))
+        CourseViewInstance.objects.credit_seconds({self.course_view_instance.pk: 30})
+        CourseViewInstance.objects.credit_seconds({self.course_view_instance.pk: 15, other.pk: 20, None: 5})
+        self.assertEqual(self.refresh_course_seconds(), 45)
+        other.refresh_from_db()
+        self.assertEqual(other.total_seconds_spent, 20)
+
+    def test_restopping_a_view_credits_the_difference(self):
+        page_view_instance = record_page_view_start(self.page_view(started_seconds_ago=100))
+        page_view_instance.mark_stopped(page_view_instance.page_view_start + timedelta(seconds=40))
+        page_view_instance.save()
+        page_view_instance.mark_stopped(page_view_instance.page_view_start + timedelta(seconds=70))
+        page_view_instance.save()
+        self.assertEqual(self.refresh_course_seconds(), 70)
+
+    def test_credit_is_capped_at_the_idle_time(self):
+        page_view_instance = record_page_view_start(self.page_view(
+            started_seconds_ago=self.course.maximum_idle_time_seconds * 2))
+        page_view_instance.mark_stopped(timezone.now())
+        page_view_instance.save()
+        self.assertEqual(self.refresh_course_seconds(), self.course.maximum_idle_time_seconds)
+
+    def test_reconcile_repairs_drifted_totals(self):
+        page_view_instance = record_page_view_start(self.page_view())
+        page_view_instance.mark_stopped(timezone.now())
+        page_view_instance.save()
+        CourseViewInstance.objects.filter(pk=self.course_view_instance.pk).update(total_seconds_spent=5)
+        self.assertEqual(CourseViewInstance.objects.drifted().count(), 1)
+        call_command('reconcile_course_time', stdout=StringIO())
+        self.assertEqual(self.refresh_course_seconds(), 60)
+        self.assertEqual(CourseViewInstance.objects.drifted().count(), 0)
+
+
+class TrackingContextTests(CourseTestCase):
+
+    def test_tracked_page_view_resolves_the_page(self):
+        response = self.client.get(reverse('course_page', kwargs={'page_guid':self.pages[1].guid}))
+        self.assertEqual(response.status_code, 200)
+        page_view_instance = CoursePageViewInstance.objects.get()
+        self.assertEqual(page_view_instance.course_page_id, self.pages[1].pk)
+        self.assertEqual(page_view_instance.course_view_instance_id, self.course_view_instance.pk)
+        self.assertEqual(page_view_instance.student_id, self.student.pk)
+
+    def test_tracked_question_view_resolves_the_test_instance(self):
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=True)
+        test_instance.start()
+        question_instance = test_instance.question_instances.first()
+        response = self.client.get(reverse('course_practice_test_question',
+            kwargs={'question_instance_guid':question_instance.guid}))
+        self.assertEqual(response.status_code, 200)
+        page_view_instance = CoursePageViewInstance.objects.get()
+        self.assertEqual(page_view_instance.course_test_instance_id, test_instance.pk)
+        self.assertEqual(page_view_instance.course_test_question_id, question_instance.course_test_question_id)
+
+    def test_unknown_guids_are_not_found(self):
+        for name, kwarg in (('course_page', 'page_guid'), ('course_home', 'course_guid'),
+            ('course_practice_test_question', 'question_instance_guid')):
+            self.assertEqual(self.client.get(reverse(name, kwargs={kwarg:uuid.uuid4()})).status_code, 404)
+        self.assertEqual(self.client.get(reverse('course_page', kwargs={'page_guid':'junk'})).status_code, 404)
+
+
+class StudentPrincipalTests(CourseTestCase):
+
+    def tracked_request(self, **kwargs):
+        request = RequestFactory().get(reverse('course_page', kwargs=kwargs))
+        request.student_principal = Student.objects.get_principal(str(self.student.guid))
+        request.student = SimpleLazyObject(lambda: self.fail('tracking loaded the student'))
+        request.tracking_cursor = {}
+        page_tracking_enabled(lambda request, **kwargs: HttpResponse())(request, **kwargs)
+        return request
+
+    def test_tracking_uses_the_cached_principal(self):
+        request = self.tracked_request(page_guid=self.pages[0].guid)
+        self.assertEqual(request.course_view_instance.pk, self.course_view_instance.pk)
+        self.assertEqual(CoursePageViewInstance.objects.get().student_id, self.student.pk)
+
+    def test_verification_changes_drop_the_principal(self):
+        self.assertTrue(Student.objects.get_principal(str(self.student.guid))['verified'])
+        self.student.verified_on = None
+        self.student.save()
+        StudentIdentificationDocument.objects.create(student=self.student, verification_required=True)
+        self.assertFalse(Student.objects.get_principal(str(self.student.guid))['verified'])
+
+
+class LiveTestRoutingTests(CourseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=False)
+        self.test_instance.start()
+        self.page_url = reverse('course_page', kwargs={'page_guid':self.pages[0].guid})
+
+    def test_students_in_a_live_test_are_sent_back_to_it(self):
+        self.assertRedirects(self.client.get(self.page_url), self.test_instance.home_url,
+            fetch_redirect_response=False)
+        question_instance = self.test_instance.question_instances.first()
+        response = self.client.get(reverse('course_test_question',
+            kwargs={'question_instance_guid':question_instance.guid}))
+        self.assertEqual(response.status_code, 200)
+
+    def test_routing_reads_the_cached_record(self):
+        self.client.get(self.page_url)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(self.client.get(self.page_url).status_code, 302)
+        self.assertFalse([query for query in queries if '"core_coursetestinstance"' in query['sql']])
+
+    def test_finishing_the_test_releases_the_student(self):
+        self.client.get(self.page_url)
+        self.test_instance.finish()
+        self.assertEqual(self.client.get(self.page_url).status_code, 200)
+
+    def test_expired_tests_release_the_student(self):
+        CourseTestInstance.objects.filter(pk=self.test_instance.pk).update(
+            deadline_at=timezone.now() - timedelta(seconds=1))
+        self.assertEqual(self.client.get(self.page_url).status_code, 200)
+
+
+class RecentHistoryTests(CourseTestCase):
+
+    def visit(self, *pages):
+        for page in pages:
+            self.client.get(page.course_url)
+
+    def test_latest_view_of_each_url_newest_first(self):
+        self.visit(self.pages[0], self.pages[1], self.pages[0])
+        self.assertEqual([history['title'] for history in self.course.url_recent_history(self.student.pk)],
+            ['Page 1', 'Page 2'])
+
+    @override_settings(LEFT_NAV_HISTORY_MAX=2)
+    def test_history_is_limited(self):
+        self.visit(*self.pages)
+        self.assertEqual([history['title'] for history in self.course.url_recent_history(self.student.pk)],
+            ['Page 3', 'Page 2'])
+
+    def test_tracking_pushes_onto_the_cached_history(self):
+        self.visit(self.pages[0])
+        self.course.url_recent_history(self.student.pk)
+        self.visit(self.pages[1])
+        with self.assertNumQueries(0):
+            history = self.course.url_recent_history(self.student.pk)
+        self.assertEqual([entry['title'] for entry in history], ['Page 2', 'Page 1'])
+
+
+class ResumePointerTests(CourseTestCase):
+
+    def test_page_views_move_the_pointers(self):
+        self.assertEqual(self.course.continue_url(self.student), '')
+        self.client.get(self.pages[2].course_url)
+        self.client.get(self.pages[1].course_url)
+        self.assertEqual(self.course.continue_url(self.student), self.pages[1].course_url)
+        self.assertEqual(self.course.last_page_view_url(self.student), self.pages[1].course_url)
+
+    def test_test_views_only_move_the_continue_url(self):
+        self.client.get(self.pages[1].course_url)
+        practice_home_url = reverse('course_practice_test_home', kwargs={'test_guid':self.course_test.guid})
+        self.client.get(practice_home_url)
+        self.assertEqual(self.course.continue_url(self.student), practice_home_url)
+        self.assertEqual(self.course.last_page_view_url(self.student), self.pages[1].course_url)
+
+    def test_a_batch_keeps_the_newest_view_of_each_course(self):
+        other_course = Course.objects.create(name='Other', published=True)
+        other_page = CoursePage.objects.create(course=other_course, page_number=1, page_title='Other')
+        other_course_view_instance = CourseViewInstance.objects.create(student=self.student,
+            course=other_course)
+        page_view_instances = [CoursePageViewInstance(url=page.course_url, course_page=page,
+            course_view_instance=course_view_instance, student=self.student)
+            for page, course_view_instance in ((self.pages[0], self.course_view_instance),
+                (other_page, other_course_view_instance), (self.pages[2], self.course_view_instance))]
+        write_page_view_events([(PAGE_VIEW_START, instance) for instance in page_view_instances])
+        self.assertEqual(Course.objects.resume_urls_for_student(self.student), {
+            self.course.pk: self.pages[2].course_url, other_course.pk: other_page.course_url})
+        self.assertEqual(other_course.last_page_view_url(self.student), other_page.course_url)
+
+
+class DashboardTests(CourseTestCase):
+
+    def cards(self):
+        return {card['name']: card for card in student_dashboard_cards(self.student.pk)}
+
+    def test_cards_cost_a_fixed_number_of_queries(self):
+        def count_queries():
+            cache.clear()
+            with CaptureQueriesContext(connection) as queries:
+                student_dashboard_cards(self.student.pk)
+            return len(queries)
+        queries = count_queries()
+        for number in range(3):
+            course = Course.objects.create(name='Course %s' % number, published=True)
+            CourseViewInstance.objects.create(student=self.student, course=course)
+            CourseTest.objects.create(course=course, order=1)
+        self.assertEqual(count_queries(), queries)
+
+    def test_tracking_refreshes_the_cards(self):
+        self.assertEqual(self.cards()['Course']['resume_url'], '')
+        self.client.get(self.pages[1].course_url)
+        self.assertEqual(self.cards()['Course']['resume_url'], self.pages[1].course_url)
+        page_view_instance = CoursePageViewInstance.objects.get()
+        CoursePageViewInstance.objects.filter(pk=page_view_instance.pk).update(
+            page_view_start=timezone.now() - timedelta(minutes=10))
+        self.client.get(self.pages[2].course_url)
+        self.assertEqual(self.cards()['Course']['time_remaining'], human_time_duration(
+            self.course.minimum_time_seconds - 10 * 60))
+
+    def test_test_status_follows_the_live_test(self):
+        self.assertEqual(self.cards()['Course']['test_status'], TEST_STATUS_NOT_STARTED)
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=False)
+        test_instance.start()
+        self.assertEqual(self.cards()['Course']['test_status'], TEST_STATUS_IN_PROGRESS)
+        test_instance.finish()
+        self.assertEqual(self.cards()['Course']['test_status'], TEST_STATUS_FAILED)
+
+
+class MarkdownCacheTests(CourseTestCase):
+
+    def test_saving_prerenders_the_contents(self):
+        self.pages[0].page_contents = '# Heading'
+        self.pages[0].save()
+        self.assertEqual(cache.get(markdown_cache_key('# Heading')), '<h1>Heading</h1>')
+
+    def test_rendering_is_cached_by_content(self):
+        with mock.patch('core.utils.markdown_renderer', wraps=markdown_renderer) as renderer:
+            self.assertEqual(render_markdown_html('*one*'), '<p><em>one</em></p>')
+            self.assertEqual(render_markdown_html('*one*'), '<p><em>one</em></p>')
+            self.assertEqual(render_markdown_html('*two*'), '<p><em>two</em></p>')
+        self.assertEqual(renderer.call_count, 2)
+
+    def test_renderer_state_doesnt_leak_between_texts(self):
+        render_markdown_html('[link][1]\n\n[1]: http://example.com')
+        self.assertEqual(render_markdown_html('[link][1]'), '<p>[link][1]</p>')
+
+
+class TestGenerationTests(CourseTestCase):
+
+    def generate(self):
+        return self.course_test.generate_test_instance_for_student(self.student, is_practice=True)
+
+    def add_questions(self, count):
+        answers = list(MultipleChoiceAnswer.objects.all())
+        for number in range(count):
+            question = MultipleChoiceTestQuestion.objects.create(course_test=self.course_test,
+                question_contents='Extra %s' % number, correct_multiple_choice_answer=answers[0])
+            question.other_multiple_choice_answers.set(answers[1:6])
+
+    def test_every_question_once_with_its_correct_answer(self):
+        test_instance = self.generate()
+        question_instances = list(test_instance.question_instances.select_related(
+            'course_test_question'))
+        self.assertEqual([question_instance.order for question_instance in question_instances],
+            list(range(1, 7)))
+        self.assertEqual({question_instance.course_test_question_id
+            for question_instance in question_instances},
+            set(self.course_test.multiple_choice_test_questions.values_list('pk', flat=True)))
+        for question_instance in question_instances:
+            options = [option.answer_option_id
+                for option in question_instance.course_test_answer_option_instances.all()]
+            self.assertEqual(len(options), settings.DEFAULT_MULTIPLE_CHOICE_LENGTH)
+            self.assertEqual(len(set(options)), len(options))
+            self.assertIn(question_instance.course_test_question.correct_multiple_choice_answer_id, options)
+
+    def test_queries_dont_grow_with_the_question_count(self):
+        def count_queries():
+            with CaptureQueriesContext(connection) as queries:
+                self.generate()
+            return len(queries)
+        queries = count_queries()
+        self.add_questions(20)
+        self.assertEqual(count_queries(), queries)
+
+    def test_questions_are_sampled_from_the_whole_pool(self):
+        self.course_test.max_number_of_questions = 2
+        self.course_test.save()
+        random.seed(0)
+        chosen = set()
+        for i in range(10):
+            chosen.update(self.generate().question_instances.values_list('course_test_question_id',
+                flat=True))
+        self.assertEqual(len(chosen), 6)
+
+    def test_all_of_the_above_goes_last(self):
+        question = self.course_test.multiple_choice_test_questions.first()
+        MultipleChoiceAnswer.objects.filter(pk__in=question.other_multiple_choice_answers.all()).update(
+            is_all_of_the_above=True)
+        question.multiple_choice_answer_length = 0
+        question.save()
+        question_instance = self.generate().question_instances.get(course_test_question=question)
+        options = question_instance.course_test_answer_option_instances.order_by('order').select_related(
+            'answer_option')
+        self.assertEqual(options[0].answer_option_id, question.correct_multiple_choice_answer_id)
+
+
+class PracticePoolTests(CourseTestCase):
+
+    def pool(self):
+        return CourseTestInstance.objects.practice_pool(self.course_test)
+
+    # the worker closes stale connections between passes, which would close the test's transaction
+    @mock.patch('core.management.commands.refill_practice_test_pools.close_old_connections')
+    def test_refill_tops_the_pool_up_to_its_depth(self, close_old_connections):
+        call_command('refill_practice_test_pools', depth=3, stdout=StringIO())
+        self.assertEqual(self.pool().count(), 3)
+        call_command('refill_practice_test_pools', depth=3, stdout=StringIO())
+        self.assertEqual(self.pool().count(), 3)
+
+    def test_students_are_handed_the_oldest_pooled_test(self):
+        self.course_test.refill_practice_test_pool(2)
+        oldest = self.pool().order_by('created').first()
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=True)
+        self.assertEqual(test_instance.pk, oldest.pk)
+        self.assertEqual(test_instance.student_id, self.student.pk)
+        self.assertEqual(self.pool().count(), 1)
+        # an unfinished practice test is handed back rather than another pooled one
+        self.assertEqual(self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=True).pk, oldest.pk)
+
+    def test_an_empty_pool_generates_on_demand(self):
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=True)
+        self.assertEqual(test_instance.question_instances.count(), 6)
+
+    def test_editing_questions_discards_the_pool(self):
+        self.course_test.refill_practice_test_pool(2)
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=True)
+        question = self.course_test.multiple_choice_test_questions.first()
+        question.question_contents = 'Edited'
+        question.save()
+        self.assertEqual(self.pool().count(), 0)
+        self.assertTrue(CourseTestInstance.objects.filter(pk=test_instance.pk).exists())
+
+    def test_no_pool_without_practice_tests(self):
+        self.course_test.allow_practice_tests = False
+        self.course_test.save()
+        self.assertEqual(self.course_test.refill_practice_test_pool(2), 0)
+
+
+class TestScoringTests(CourseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=False)
+        self.test_instance.start()
+
+    def answer(self, correct_count):
+        # the first correct_count questions are answered correctly and the rest wrong
+        wrong_answer = MultipleChoiceAnswer.objects.create(value='Wrong')
+        question_instances = self.test_instance.question_instances.select_related(
+            'course_test_question__correct_multiple_choice_answer')
+        self.test_instance.record_answers([(question_instance,
+            question_instance.course_test_question.correct_multiple_choice_answer
+                if position < correct_count else wrong_answer)
+            for position, question_instance in enumerate(question_instances)])
+
+    def test_the_score_is_stored_when_the_test_finishes(self):
+        self.answer(correct_count=4)
+        test_instance = CourseTestInstance.objects.get(pk=self.test_instance.pk)
+        self.assertIsNotNone(test_instance.scored_on)
+        self.assertEqual((test_instance.correct_answer_count, test_instance.question_count), (4, 6))
+        self.assertEqual(test_instance.score_percent, 66.67)
+        self.assertTrue(test_instance.passed)
+        with self.assertNumQueries(0):
+            self.assertTrue(test_instance.test_passed)
+
+    def test_unscored_tests_are_read_without_writing(self):
+        self.answer(correct_count=2)
+        CourseTestInstance.objects.filter(pk=self.test_instance.pk).update(scored_on=None)
+        test_instance = CourseTestInstance.objects.get(pk=self.test_instance.pk)
+        with CaptureQueriesContext(connection) as queries:
+            self.assertEqual(test_instance.number_of_correct_answers, 2)
+            self.assertFalse(test_instance.test_passed)
+        self.assertTrue(all(query['sql'].startswith('SELECT') for query in queries))
+        self.assertIsNone(CourseTestInstance.objects.get(pk=self.test_instance.pk).scored_on)
+
+    def test_rescore_follows_answer_key_changes(self):
+        self.answer(correct_count=6)
+        MultipleChoiceTestQuestion.objects.filter(course_test=self.course_test).update(
+            correct_multiple_choice_answer=MultipleChoiceAnswer.objects.create(value='New key'))
+        call_command('rescore_tests', stdout=StringIO())
+        test_instance = CourseTestInstance.objects.get(pk=self.test_instance.pk)
+        self.assertEqual((test_instance.correct_answer_count, test_instance.score_percent), (0, 0.0))
+        self.assertFalse(test_instance.passed)
+
+    def test_rescore_unscored_only_scores_unscored_tests(self):
+        self.answer(correct_count=6)
+        scored_on = timezone.now() - timedelta(days=1)
+        CourseTestInstance.objects.filter(pk=self.test_instance.pk).update(scored_on=scored_on,
+            correct_answer_count=0)
+        call_command('rescore_tests', unscored=True, stdout=StringIO())
+        self.assertEqual(CourseTestInstance.objects.get(pk=self.test_instance.pk).correct_answer_count, 0)
+        CourseTestInstance.objects.filter(pk=self.test_instance.pk).update(scored_on=None)
+        call_command('rescore_tests', unscored=True, stdout=StringIO())
+        self.assertEqual(CourseTestInstance.objects.get(pk=self.test_instance.pk).correct_answer_count, 6)
+
+
+class FinalizeExpiredTests(CourseTestCase):
+
+    def test_expired_tests_are_finished_and_scored_once(self):
+        self.course_test.test_is_timed = True
+        self.course_test.save()
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=False)
+        test_instance.start()
+        deadline = timezone.now() - timedelta(seconds=1)
+        CourseTestInstance.objects.filter(pk=test_instance.pk).update(deadline_at=deadline)
+
+        self.assertEqual([pk for pk, guid, student_id in CourseTestInstance.objects.finalize_expired()],
+            [test_instance.pk])
+        self.assertEqual(CourseTestInstance.objects.finalize_expired(), [])
+        test_instance.refresh_from_db()
+        self.assertEqual(test_instance.test_finished_on, deadline)
+        self.assertIsNotNone(test_instance.scored_on)
+        self.assertFalse(test_instance.passed)
+
+    def test_unexpired_tests_are_left_alone(self):
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=False)
+        test_instance.start()
+        self.assertEqual(CourseTestInstance.objects.finalize_expired(), [])
+
+    def test_starting_a_timed_test_stores_its_deadline(self):
+        self.course_test.test_is_timed = True
+        self.course_test.save()
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=False)
+        test_instance.start()
+        self.assertEqual(test_instance.deadline_at - test_instance.test_started_on,
+            timedelta(seconds=self.course_test.maximum_time_seconds))
+
+    def test_reading_an_expired_test_doesnt_finish_it(self):
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=False)
+        test_instance.start()
+        CourseTestInstance.objects.filter(pk=test_instance.pk).update(
+            deadline_at=timezone.now() - timedelta(seconds=1))
+        test_instance.refresh_from_db()
+        with CaptureQueriesContext(connection) as queries:
+            self.assertTrue(test_instance.is_complete)
+        self.assertEqual(len(queries), 0)
+        self.assertIsNone(CourseTestInstance.objects.get(pk=test_instance.pk).test_finished_on)
+
+    @mock.patch('core.management.commands.finalize_expired_tests.close_old_connections')
+    def test_the_sweeper_marks_cached_routing_records_complete(self, close_old_connections):
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=False)
+        test_instance.start()
+        self.assertFalse(get_routing_record(test_instance.guid)['complete'])
+        CourseTestInstance.objects.filter(pk=test_instance.pk).update(
+            deadline_at=timezone.now() - timedelta(seconds=1))
+        call_command('finalize_expired_tests', stdout=StringIO())
+        self.assertTrue(get_routing_record(test_instance.guid)['complete'])
+
+
+class QuestionNavigationTests(CourseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=True)
+        self.test_instance.start()
+        self.question_instances = list(self.test_instance.question_instances)
+
+    def question(self, position):
+        # a fresh instance, as a question page would load it
+        return CourseTestQuestionInstance.objects.select_related('course_test_instance').get(
+            pk=self.question_instances[position].pk)
+
+    def url(self, position):
+        return reverse('course_practice_test_question',
+            kwargs={'question_instance_guid':self.question_instances[position].guid})
+
+    def test_links_follow_the_question_order(self):
+        first, middle, last = self.question(0), self.question(2), self.question(5)
+        self.assertEqual((first.previous_instance_url, first.next_instance_url), ('', self.url(1)))
+        self.assertEqual((middle.previous_instance_url, middle.next_instance_url), (self.url(1), self.url(3)))
+        self.assertEqual((last.previous_instance_url, last.next_instance_url), (self.url(4), ''))
+
+    def test_next_unanswered_wraps_around(self):
+        answer = MultipleChoiceAnswer.objects.first()
+        self.test_instance.record_answers([(self.question_instances[position], answer)
+            for position in (0, 2, 3, 4)])
+        self.assertEqual(self.question(4).next_unanswered_instance_url, self.url(5))
+        self.assertEqual(self.question(5).next_unanswered_instance_url, self.url(1))
+        self.assertEqual([entry['answered'] for entry in self.question(0).question_palette],
+            [True, False, True, True, True, False])
+
+    def test_a_question_page_reads_the_map_once(self):
+        self.question(0).question_palette
+        question_instance = self.question(3)
+        with self.assertNumQueries(0):
+            question_instance.previous_instance_url
+            question_instance.next_instance_url
+            question_instance.next_unanswered_instance_url
+            palette = question_instance.question_palette
+        self.assertEqual([entry['current'] for entry in palette], [False, False, False, True, False, False])
+
+
+class PageNavigationTests(CourseTestCase):
+
+    def navigation(self, page):
+        return CoursePage.objects.select_related('course').get(pk=page.pk).nav_page_split
+
+    def test_long_courses_are_elided_around_the_current_page(self):
+        pages = self.pages + [CoursePage.objects.create(course=self.course, page_number=number,
+            page_title='Page %s' % number) for number in range(4, 13)]
+        html = self.navigation(pages[5])
+        self.assertIn('<a href="%s">[ 6 ]</a>' % pages[5].course_url, html)
+        self.assertEqual(html.count('...'), 1)
+        self.assertEqual([number for number in range(1, 13) if pages[number - 1].course_url in html],
+            [1, 2, 3, 4, 5, 6, 7, 8, 10, 11, 12])
+
+    def test_navigation_is_rendered_once_per_version(self):
+        self.navigation(self.pages[0])
+        page = CoursePage.objects.select_related('course').get(pk=self.pages[0].pk)
+        with self.assertNumQueries(0):
+            page.nav_page_split
+
+    def test_new_pages_show_up_in_the_navigation(self):
+        self.navigation(self.pages[0])
+        page = CoursePage.objects.create(course=self.course, page_number=4, page_title='Page 4')
+        self.assertIn(page.course_url, self.navigation(self.pages[0]))
+
+    def test_moving_a_page_refreshes_both_courses(self):
+        other = Course.objects.create(name='Other', published=True)
+        self.assertEqual(len(get_course_structure(self.course.pk).pages), 3)
+        self.assertEqual(len(get_course_structure(other.pk).pages), 0)
+        page = CoursePage.objects.get(pk=self.pages[0].pk)
+        page.course = other
+        page.save()
+        self.assertEqual(len(get_course_structure(self.course.pk).pages), 2)
+        self.assertEqual(len(get_course_structure(other.pk).pages), 1)
+
+    def test_moving_a_question_refreshes_both_courses(self):
+        other_test = CourseTest.objects.create(course=Course.objects.create(name='Other', published=True))
+        self.assertEqual(get_course_structure(self.course.pk).tests[0].question_count, 6)
+        self.assertEqual(get_course_structure(other_test.course_id).tests[0].question_count, 0)
+        question = self.course_test.multiple_choice_test_questions.first()
+        question.course_test = other_test
+        question.save()
+        self.assertEqual(get_course_structure(self.course.pk).tests[0].question_count, 5)
+        self.assertEqual(get_course_structure(other_test.course_id).tests[0].question_count, 1)
+
+
+class AnswerFormTests(CourseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=True)
+        self.question_instances = list(test_instance.question_instances)
+
+    def form(self, answer):
+        return TestQuestionInstanceForm({'answer':answer}, question_instance=self.question_instances[0])
+
+    def test_the_questions_own_options_are_accepted_without_queries(self):
+        option = self.question_instances[0].answer_options[1]
+        form = self.form(str(option.guid))
+        with self.assertNumQueries(0):
+            self.assertTrue(form.is_valid())
+        self.assertEqual(form.cleaned_data['answer'], option.answer_option)
+
+    def test_other_questions_options_are_rejected(self):
+        self.assertFalse(self.form(str(self.question_instances[1].answer_options[0].guid)).is_valid())
+        self.assertFalse(self.form('junk').is_valid())
+
+    def test_posting_an_answer_records_it_once(self):
+        question_instance = self.question_instances[0]
+        option = question_instance.answer_options[0]
+        url = reverse('course_practice_test_question', kwargs={'question_instance_guid':question_instance.guid})
+        self.client.post(url, {'answer':str(option.guid)})
+        self.client.post(url, {'answer':str(question_instance.answer_options[1].guid)})
+        question_instance = CourseTestQuestionInstance.objects.get(pk=question_instance.pk)
+        self.assertEqual(question_instance.course_test_answer_instance.answer_chosen_id, option.answer_option_id)
+
+
+class TestPayloadApiTests(CourseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=True)
+        self.question_instances = list(self.test_instance.question_instances)
+        self.payload_url = reverse('test_instance_payload_api',
+            kwargs={'test_instance_guid':self.test_instance.guid})
+        self.answer_url = reverse('test_instance_answer_api',
+            kwargs={'test_instance_guid':self.test_instance.guid})
+
+    def answer(self, question_instance, option):
+        return self.client.post(self.answer_url, {'question_instance_guid':str(question_instance.guid),
+            'option_guid':str(option.guid)})
+
+    def test_answers_are_only_revealed_once_answered(self):
+        payload = self.client.get(self.payload_url).json()
+        self.assertEqual(len(payload['questions']), 6)
+        self.assertTrue(all(question['correct_answer'] is None for question in payload['questions']))
+        self.assertEqual([option['guid'] for option in payload['questions'][0]['options']],
+            [str(option.guid) for option in self.question_instances[0].answer_options])
+
+        option = self.question_instances[0].answer_options[0]
+        state = self.answer(self.question_instances[0], option).json()
+        self.assertEqual(state['chosen_option'], str(option.guid))
+        payload = self.client.get(self.payload_url).json()
+        self.assertEqual([question['correct_answer'] is not None for question in payload['questions']],
+            [True, False, False, False, False, False])
+
+    def test_options_of_another_question_are_refused(self):
+        response = self.answer(self.question_instances[0], self.question_instances[1].answer_options[0])
+        self.assertEqual(response.status_code, 400)
+
+    def test_a_resent_answer_keeps_the_first_choice(self):
+        first = self.answer(self.question_instances[0], self.question_instances[0].answer_options[0]).json()
+        resent = self.answer(self.question_instances[0], self.question_instances[0].answer_options[1]).json()
+        self.assertEqual(resent['chosen_option'], first['chosen_option'])
+
+    def test_other_students_tests_are_not_found(self):
+        other_user = User.objects.create_user(email='other@example.com', password='password')
+        other_student = Student.objects.get_or_create_from_user(user=other_user)
+        other_student.verified_on = timezone.now()
+        other_student.save()
+        client = Client()
+        client.force_login(other_user)
+        self.assertEqual(client.get(self.payload_url).status_code, 404)
+
+
+class QuestionDwellTests(CourseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=True)
+        self.test_instance.start()
+        self.question_instance = self.test_instance.question_instances.first()
+        self.dwell_url = reverse('test_instance_dwell_api',
+            kwargs={'test_instance_guid':self.test_instance.guid})
+
+    def beacon(self, event, **data):
+        data.setdefault('question_instance_guid', self.question_instance.guid)
+        return self.client.post(self.dwell_url, dict(data, event=event))
+
+    def test_client_seconds_are_ignored(self):
+        self.assertEqual(self.beacon('', seconds=10 ** 12).status_code, 400)
+        self.assertEqual(self.refresh_course_seconds(), 0)
+
+    def test_dwell_is_clamped_and_credited_once(self):
+        self.assertEqual(self.beacon('shown').status_code, 204)
+        CoursePageViewInstance.objects.filter(course_test_instance=self.test_instance).update(
+            page_view_start=timezone.now() - timedelta(days=1))
+        for i in range(3):
+            self.assertEqual(self.beacon('hidden').status_code, 204)
+        self.assertEqual(self.refresh_course_seconds(), self.course.maximum_idle_time_seconds)
+
+    def test_showing_a_question_closes_the_previous_one(self):
+        self.beacon('shown')
+        self.beacon('shown', question_instance_guid=self.test_instance.question_instances[1].guid)
+        stops = CoursePageViewInstance.objects.filter(course_test_instance=self.test_instance).order_by(
+            'created').values_list('page_view_stop', flat=True)
+        self.assertEqual([stop is None for stop in stops], [False, True])
+
+
+class TestAnswerApiTests(CourseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=True)
+        self.test_instance.start()
+        self.answers_url = reverse('test_instance_answers_api',
+            kwargs={'test_instance_guid':self.test_instance.guid})
+
+    def post_answers(self, answers):
+        return self.client.post(self.answers_url, json.dumps({'answers':answers}),
+            content_type='application/json')
+
+    def answers(self, question_instances, option_index=0):
+        return [{'question_instance_guid':str(question_instance.guid),
+            'option_guid':str(question_instance.answer_options[option_index].guid)}
+            for question_instance in question_instances]
+
+    def test_resent_answers_keep_the_first_choice(self):
+        question_instances = list(self.test_instance.question_instances)[:2]
+        first = self.post_answers(self.answers(question_instances)).json()
+        resent = self.post_answers(self.answers(question_instances, option_index=1)).json()
+        self.assertEqual([answer['chosen_option'] for answer in resent['answers']],
+            [answer['chosen_option'] for answer in first['answers']])
+
+    def test_resending_the_finishing_batch(self):
+        answers = self.answers(self.test_instance.question_instances)
+        self.assertTrue(self.post_answers(answers).json()['is_complete'])
+        response = self.post_answers(answers)
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(len(response.json()['answers']), len(answers))
+
+    def test_new_answers_after_the_deadline_are_refused(self):
+        question_instances = list(self.test_instance.question_instances)
+        self.post_answers(self.answers(question_instances[:1]))
+        CourseTestInstance.objects.filter(pk=self.test_instance.pk).update(
+            deadline_at=timezone.now() - timedelta(seconds=1))
+        response = self.post_answers(self.answers(question_instances[:2]))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual([answer['guid'] for answer in response.json()['answers']],
+            [str(question_instances[0].guid)])
+        self.assertEqual(response.json()['rejected'], [str(question_instances[1].guid)])
+        self.assertEqual(self.post_answers(self.answers(question_instances[2:3])).status_code, 403)
+
+    def test_malformed_answers(self):
+        question_instance = self.test_instance.question_instances.first()
+        for answers in ('junk', [{'question_instance_guid':str(question_instance.guid), 'option_guid':5}]):
+            self.assertEqual(self.post_answers(answers).status_code, 400)
+
+    def test_queries_dont_grow_with_the_batch(self):
+        def count_queries(question_instances):
+            with CaptureQueriesContext(connection) as queries:
+                self.assertEqual(self.post_answers(self.answers(question_instances)).status_code, 200)
+            return len(queries)
+        question_instances = list(self.test_instance.question_instances)
+        # the first batch also caches the test's questions
+        count_queries(question_instances[:1])
+        self.assertEqual(count_queries(question_instances[1:3]), count_queries(question_instances[3:5]))
+
+
+class HotQueryIndexTests(CourseTestCase):
+
+    def test_every_expected_index_exists(self):
+        test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+            is_practice=True)
+        hot_queries = ExplainHotQueriesCommand().hot_queries(self.student, self.course, self.course_test,
+            test_instance.question_instances.first())
+        with connection.cursor() as cursor:
+            for name, queryset, index in hot_queries:
+                table = queryset.model._meta.db_table
+                self.assertIn(index, connection.introspection.get_constraints(cursor, table), name)
+
+    def test_shadowed_foreign_key_indexes_are_dropped(self):
+        with connection.cursor() as cursor:
+            constraints = connection.introspection.get_constraints(cursor, CoursePage._meta.db_table)
+        self.assertEqual([name for name, constraint in constraints.items()
+            if constraint['columns'] == ['course_id'] and constraint['index']], [])
+
+    def test_page_numbers_are_unique_per_course(self):
+        with self.assertRaises(IntegrityError):
+            CoursePage.objects.create(course=self.course, page_number=1)
+
+class PersistentConnectionTests(TransactionTestCase):
+
+    def test_persistent_connections_are_reused_across_requests(self):
+        conn_max_age = connection.settings_dict['CONN_MAX_AGE']
+        stdout = StringIO()
+        call_command('benchmark_db_connections', requests=5, conn_max_age=60, stdout=stdout)
+        per_request, persistent = stdout.getvalue().splitlines()[:2]
+        self.assertRegex(per_request, r'connects +5 ')
+        self.assertRegex(persistent, r'connects +1 ')
+        # the configured age is put back afterwards
+        self.assertEqual(connection.settings_dict['CONN_MAX_AGE'], conn_max_age)
+
+
+# the command closes stale connections between passes, which would close the test's transaction
+@mock.patch('core.management.commands.archive_page_views.close_old_connections', mock.Mock())
+class PageViewArchiveTests(CourseTestCase):
+
+    def old_page_view(self, days_ago, page=0, seconds=60):
+        page_view_instance = self.page_view(started_seconds_ago=seconds)
+        page_view_instance.course_page = self.pages[page]
+        page_view_instance.url = self.pages[page].course_url
+        page_view_instance = record_page_view_start(page_view_instance)
+        record_page_view_stop(page_view_instance.guid, timezone.now())
+        CoursePageViewInstance.objects.filter(pk=page_view_instance.pk).update(
+            created=timezone.now() - timedelta(days=days_ago))
+        return page_view_instance
+
+    def archive(self, **options):
+        call_command('archive_page_views', stdout=StringIO(), **options)
+
+    def test_old_page_views_are_rolled_up_per_url_and_day(self):
+        for page in (0, 0, 1):
+            self.old_page_view(days_ago=100, page=page)
+        recent = self.old_page_view(days_ago=1)
+        self.archive(days=90)
+        self.assertEqual(list(CoursePageViewInstance.objects.values_list('pk', flat=True)), [recent.pk])
+        rollups = {rollup.url: rollup for rollup in self.course_view_instance.course_page_view_rollups.all()}
+        self.assertEqual(len(rollups), 2)
+        self.assertEqual(rollups[self.pages[0].course_url].view_count, 2)
+        self.assertEqual(rollups[self.pages[0].course_url].total_seconds_spent, 120)
+        self.assertEqual(rollups[self.pages[1].course_url].course_page, self.pages[1])
+
+    def test_course_time_is_unchanged_by_archiving(self):
+        for days_ago in (100, 100, 1):
+            self.old_page_view(days_ago=days_ago)
+        total = self.refresh_course_seconds()
+        self.archive(days=90)
+        self.assertFalse(CourseViewInstance.objects.drifted().exists())
+        self.assertEqual(self.course_view_instance.calculate_time_spent(), total)
+
+    def test_batches_add_to_the_days_rollup(self):
+        for i in range(3):
+            self.old_page_view(days_ago=100)
+        self.archive(days=90, batch_size=1)
+        rollup = self.course_view_instance.course_page_view_rollups.get()
+        self.assertEqual((rollup.view_count, rollup.total_seconds_spent), (3, 180))
+
+    def test_dry_run_archives_nothing(self):
+        self.old_page_view(days_ago=100)
+        stdout = StringIO()
+        call_command('archive_page_views', days=90, dry_run=True, stdout=stdout)
+        self.assertIn('1 page views', stdout.getvalue())
+        self.assertEqual(CoursePageViewInstance.objects.count(), 1)
+
+
+@override_settings(ACTIVITY_ROLLUP_FLUSH_SECONDS=60)
+class ActivityRollupTests(CourseTestCase):
+    COUNTS = ('seconds_credited', 'pages_viewed', 'tests_started', 'tests_finished', 'tests_passed')
+
+    def setUp(self):
+        super().setUp()
+        activity_buffer._reset()
+        self.today = activity_day(timezone.now())
+
+    def rollups(self):
+        return (list(StudentCourseActivityDay.objects.filter(course=self.course).values_list('day',
+            'student', *self.COUNTS)), list(CourseActivityDay.objects.filter(course=self.course
+            ).values_list('day', *self.COUNTS)))
+
+    def test_tracking_adds_up_in_the_buffer_until_it_flushes(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            page_view_instance = record_page_view_start(self.page_view())
+            record_page_view_stop(page_view_instance.guid, timezone.now())
+        self.assertEqual(self.rollups(), ([], []))
+        activity_buffer.flush()
+        self.assertEqual(self.rollups(), ([(self.today, self.student.pk, 60, 1, 0, 0, 0)],
+            [(self.today, 60, 1, 0, 0, 0)]))
+
+    def test_finished_live_tests_are_counted(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            test_instance = self.course_test.get_or_generate_test_instance_for_student(self.student,
+                is_practice=False)
+            test_instance.start()
+            test_instance.finish()
+        activity_buffer.flush()
+        self.assertEqual(self.rollups()[1], [(self.today, 0, 0, 1, 1, 0)])
+
+    def test_rebuild_matches_what_tracking_recorded(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            for seconds in (30, 90):
+                page_view_instance = record_page_view_start(self.page_view(started_seconds_ago=seconds))
+                record_page_view_stop(page_view_instance.guid, timezone.now())
+        activity_buffer.flush()
+        recorded = self.rollups()
+        self.assertEqual(rebuild_activity(self.today, self.today), 1)
+        self.assertEqual(self.rollups(), recorded)
+
+    def test_a_failed_flush_keeps_the_counts(self):
+        buffer = ActivityBuffer()
+        buffer.add({(self.today, self.course.pk, self.student.pk): {'pages_viewed': 1}})
+        with mock.patch('core.reporting.record_activity', side_effect=Exception), \
+                self.assertLogs('core.reporting', 'ERROR'):
+            buffer.flush()
+        buffer.add({(self.today, self.course.pk, self.student.pk): {'pages_viewed': 2}})
+        buffer.flush()
+        self.assertEqual(self.rollups()[1], [(self.today, 0, 3, 0, 0, 0)])
+
+
+class CacheVersionTests(CourseTestCase):
+
+    def test_saving_a_page_bumps_its_course(self):
+        version = cache_version(course_content(self.course.pk))
+        self.pages[0].page_title = 'Renamed'
+        self.pages[0].save()
+        self.assertNotEqual(cache_version(course_content(self.course.pk)), version)
+
+    def test_question_changes_bump_the_test_and_course(self):
+        versions = (cache_version(course_test_content(self.course_test.pk)),
+            cache_version(course_content(self.course.pk)))
+        MultipleChoiceTestQuestion.objects.filter(course_test=self.course_test).first().delete()
+        self.assertNotEqual(cache_version(course_test_content(self.course_test.pk)), versions[0])
+        self.assertNotEqual(cache_version(course_content(self.course.pk)), versions[1])
+
+    def test_entries_under_an_old_version_are_not_read(self):
+        key = versioned_cache_key(course_content(self.course.pk), 'course_page_nav', self.course.pk)
+        self.assertEqual(get_or_build(key, lambda: 'old', None), 'old')
+        bump_cache_version(course_content(self.course.pk))
+        key = versioned_cache_key(course_content(self.course.pk), 'course_page_nav', self.course.pk)
+        self.assertEqual(get_or_build(key, lambda: 'new', None), 'new')
+
+
+@override_settings(CACHE_STATS_FLUSH_SECONDS=60)
+class CacheStatsTests(TestCase):
+
+    def setUp(self):
+        cache.clear()
+        self.stats = CacheStats()
+
+    def test_reads_are_counted_per_namespace(self):
+        for key in (cache_key('markdown', 'a'), cache_key('markdown', 'b'), cache_key('unlisted', 'a')):
+            self.stats.record(key, hit=False)
+        self.stats.record(cache_key('markdown', 'a'), hit=True)
+        self.assertEqual(self.stats.shared(), {})
+        self.stats.flush()
+        self.assertEqual(self.stats.shared(), {'markdown': (1, 2), 'other': (0, 1)})
+
+    def test_flushes_from_every_process_add_up(self):
+        other_process = CacheStats()
+        for stats in (self.stats, other_process):
+            stats.record(cache_key('markdown', 'a'), hit=True)
+            stats.flush()
+        self.assertEqual(self.stats.shared(), {'markdown': (2, 0)})
+
+    def test_the_command_shows_and_resets_the_counts(self):
+        self.stats.record(cache_key('markdown', 'a'), hit=True)
+        self.stats.flush()
+        stdout = StringIO()
+        call_command('cache_stats', reset=True, stdout=stdout)
+        self.assertIn('markdown', stdout.getvalue())
+        self.assertEqual(self.stats.shared(), {})
+
+
+class CourseStructureTests(CourseTestCase):
+
+    def test_structure_is_shared_until_the_version_changes(self):
+        structure = get_course_structure(self.course.pk)
+        self.assertIs(get_course_structure(self.course.pk), structure)
+        CoursePage.objects.create(course=self.course, page_number=4, page_title='Page 4')
+        self.assertEqual(get_course_structure(self.course.pk).last_page_number, 4)
+
+    def test_page_positions_follow_the_page_order(self):
+        structure = get_course_structure(self.course.pk)
+        self.assertEqual([structure.page_position(page.guid) for page in self.pages], [0, 1, 2])
+        self.assertIsNone(structure.page_position(uuid.uuid4()))
+
+    def test_question_counts_follow_question_changes(self):
+        self.assertEqual(get_course_structure(self.course.pk).tests[0].question_count, 6)
+        MultipleChoiceTestQuestion.objects.filter(course_test=self.course_test).first().delete()
+        self.assertEqual(get_course_structure(self.course.pk).tests[0].question_count, 5)
+
+    def test_a_shared_structure_costs_no_queries(self):
+        get_course_structure(self.course.pk)
+        with self.assertNumQueries(0):
+            get_course_structure(self.course.pk)
+
+
+class TrackingCursorTests(CourseTestCase):
+
+    def browse(self, *pages):
+        for page in pages:
+            self.assertEqual(self.client.get(reverse('course_page', kwargs={'page_guid':page.guid})
+                ).status_code, 200)
+
+    def session_writes(self, *pages):
+        with CaptureQueriesContext(connection) as queries:
+            self.browse(*pages)
+        return [query['sql'] for query in queries if query['sql'].startswith('UPDATE "django_session"')]
+
+    @override_settings(TRACKING_CURSOR_STORE='cache')
+    def test_cache_cursors_leave_the_session_alone(self):
+        self.browse(self.pages[0])
+        self.assertEqual(self.session_writes(self.pages[1], self.pages[2]), [])
+        self.assertNotIn('page_view_instance_guid', self.client.session)
+        # every page view but the last has been closed out by the request after it
+        self.assertEqual([page_view_stop is None for page_view_stop in CoursePageViewInstance.objects
+            .order_by('created').values_list('page_view_stop', flat=True)], [False, False, True])
+
+    @override_settings(TRACKING_CURSOR_STORE='session')
+    def test_session_cursors_live_in_the_session(self):
+        self.browse(self.pages[0])
+        page_view_instance = CoursePageViewInstance.objects.get()
+        self.assertEqual(self.client.session['page_view_instance_guid'], str(page_view_instance.guid))
+
+    @override_settings(TRACKING_CURSOR_STORE='cache')
+    def test_unchanged_cursors_are_not_written(self):
+        request = RequestFactory().get('/')
+        request.session = self.client.session
+        cursor = TrackingCursor(request)
+        cursor['live_test_guid'] = None
+        cursor.save()
+        cursor = TrackingCursor(request)
+        cursor['live_test_guid'] = None
+        self.assertFalse(cursor.modified)
+        self.assertIsNone(cursor.pop('page_view_instance_guid'))
+        self.assertFalse(cursor.modified)
@@ -0,0 +1,252 @@
+import atexit
+import logging
+import os
+import queue
+import threading
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.utils import timezone
+
+from .dashboard import invalidate_student_dashboard
+from .reporting import page_view_activity, queue_activity, record_activity
+
+logger = logging.getLogger(__name__)
+
+TRACKING_MODE_SYNC = 'sync'
+TRACKING_MODE_BUFFERED = 'buffered'
+
+PAGE_VIEW_START = 'start'
+PAGE_VIEW_STOP = 'stop'
+
+
+def tracking_is_buffered():
+    return settings.PAGE_VIEW_TRACKING_MODE == TRACKING_MODE_BUFFERED
+
+
+def write_page_view_events(events):
+    '''
+    Persist a batch of (kind, payload) page view events. Starts are bulk inserted, stops
+    are applied to the rows they close out and bulk updated. Both halves are idempotent
+    so a batch that is retried after a failure can't double insert or double credit time.
+    Returns the stop events whose page view isn't written yet, e.g. because its start is
+    still queued in another worker, so the caller can retry them.
+    '''
+    from .models import CoursePageViewInstance, CourseViewInstance
+
+    starts = [payload for kind, payload in events if kind == PAGE_VIEW_START]
+    stops = {}
+    for kind, payload in events:
+        if kind == PAGE_VIEW_STOP:
+            guid, stop_time = payload
+            stops[str(guid)] = stop_time
+
+    with transaction.atomic():
+        activity = {}
+        if starts:
+            CoursePageViewInstance.objects.bulk_create(starts, ignore_conflicts=True)
+            CourseViewInstance.objects.record_resume_pointers(starts)
+            for instance in starts:
+                page_view_activity(activity, instance, pages_viewed=1)
+            invalidate_student_dashboard(*{instance.student_id for instance in starts})
+        if not stops:
+            record_activity(activity)
+            return []
+
+        page_view_instances = CoursePageViewInstance.objects.filter(guid__in=stops.keys()).select_related(
+            'course_view_instance__course', 'course_test_instance')
+        found, credited = set(), []
+        for page_view_instance in page_view_instances:
+            found.add(str(page_view_instance.guid))
+            # already closed by an earlier try of this batch
+            if page_view_instance.page_view_stop is not None:
+                continue
+            if page_view_instance.mark_stopped(stops[str(page_view_instance.guid)]):
+                credited.append(page_view_instance)
+        unmatched = [(PAGE_VIEW_STOP, (guid, stop_time)) for guid, stop_time in stops.items()
+            if guid not in found]
+        if not credited:
+            record_activity(activity)
+            return unmatched
+
+        CoursePageViewInstance.objects.bulk_update(credited,
+            ['page_view_stop', 'total_seconds_spent'])
+        # bulk_update skips post_save, so the whole batch is credited to the course totals here
+        deltas = {}
+        for instance in credited:
+            delta = instance.pop_credited_seconds_delta()
+            deltas[instance.course_view_instance_id] = deltas.get(instance.course_view_instance_id, 0) + delta
+            page_view_activity(activity, instance, seconds_credited=delta)
+        CourseViewInstance.objects.credit_seconds(deltas)
+        record_activity(activity)
+        invalidate_student_dashboard(*{instance.course_view_instance.student_id for instance in credited})
+    return unmatched
+
+
+class PageViewEventBuffer:
+    '''
+    Bounded in process queue of page view events drained by a daemon flusher thread.
+
+    The flusher writes every PAGE_VIEW_TRACKING_BATCH_SIZE events or every
+    PAGE_VIEW_TRACKING_FLUSH_INTERVAL_MS milliseconds, whichever comes first. When the queue
+    is full the request thread drains it itself (backpressure) rather than dropping events.
+    Failed batches are kept and retried, and whatever is left is flushed at interpreter exit.
+
+    Every worker has its own buffer, so a stop can be flushed before the start it closes out
+    if the two requests were served by different workers. Those stops are kept and retried on
+    every flush for PAGE_VIEW_TRACKING_UNMATCHED_STOP_SECONDS.
+
+    The queue only lives in memory. A worker that is killed outright (SIGKILL, the OOM
+    killer) loses whatever it hadn't written yet, up to PAGE_VIEW_TRACKING_MAX_QUEUE events
+    but normally about PAGE_VIEW_TRACKING_FLUSH_INTERVAL_MS worth of traffic. Use 'sync' mode
+    where that isn't acceptable.
+    '''
+
+    def __init__(self, max_size, batch_size, flush_interval_ms):
+        self.max_size = max_size
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval_ms / 1000
+        self._flush_lock = threading.Lock()
+        self._start_lock = threading.Lock()
+        self._reset()
+
+    def _reset(self):
+        self.queue = queue.Queue(maxsize=self.max_size)
+        self._pending = []
+        self._unmatched_stops = []
+        self._failures = 0
+        self._thread = None
+        self._pid = os.getpid()
+
+    def put(self, kind, payload):
+        self._ensure_flusher()
+        try:
+            self.queue.put_nowait((kind, payload))
+        except queue.Full:
+            logger.warning('page view buffer full, flushing on the request thread')
+            self.flush(extra_events=[(kind, payload)])
+
+    def _ensure_flusher(self):
+        if self._thread is not None and self._thread.is_alive() and self._pid == os.getpid():
+            return
+        with self._start_lock:
+            # forked workers inherit the parent's queue but not its thread
+            if self._pid != os.getpid():
+                self._reset()
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='page-view-flusher',
+                    daemon=True)
+                self._thread.start()
+
+    def _drain(self, limit=None, timeout=0):
+        events = []
+        deadline = time.monotonic() + timeout
+        while limit is None or len(events) < limit:
+            remaining = deadline - time.monotonic()
+            try:
+                if remaining > 0:
+                    events.append(self.queue.get(timeout=remaining))
+                else:
+                    events.append(self.queue.get_nowait())
+            except queue.Empty:
+                break
+        return events
+
+    def _keep_unmatched_stops(self, stops):
+        oldest = timezone.now() - timedelta(seconds=settings.PAGE_VIEW_TRACKING_UNMATCHED_STOP_SECONDS)
+        for kind, (guid, stop_time) in stops:
+            if stop_time >= oldest:
+                self._unmatched_stops.append((kind, (guid, stop_time)))
+            else:
+                logger.warning('dropping stop for page view instance %s, it was never written', guid)
+
+    def _write(self, events):
+        # anything that failed last time goes first so starts are always written before stops,
+        # stops still waiting on their start go last
+        events = self._pending + events + self._unmatched_stops
+        self._pending = []
+        self._unmatched_stops = []
+        if not events:
+            return
+        # a full queue is flushed on the request thread, whose connection and transaction
+        # belong to the request and aren't ours to close
+        own_connection = not connection.in_atomic_block
+        try:
+            if own_connection:
+                connection.close_if_unusable_or_obsolete()
+            self._keep_unmatched_stops(write_page_view_events(events))
+            self._failures = 0
+        except Exception:
+            logger.exception('failed to write %s page view events', len(events))
+            if own_connection:
+                connection.close()
+            self._failures += 1
+            if self._failures < settings.PAGE_VIEW_TRACKING_MAX_RETRIES:
+                # keep the newest events if the database stays down long enough to fill up
+                self._pending = events[-self.max_size:]
+                return
+            # the batch keeps failing, write events one by one so a single bad event
+            # can't hold up the rest of the queue forever
+            self._failures = 0
+            for event in events:
+                try:
+                    self._keep_unmatched_stops(write_page_view_events([event]))
+                except Exception:
+                    logger.exception('dropping page view event %s %s', *event)
+
+    def _run(self):
+        while True:
+            with self._flush_lock:
+                self._write(self._drain(limit=self.batch_size, timeout=self.flush_interval))
+            if self._pending:
+                time.sleep(self.flush_interval)
+
+    def flush(self, extra_events=None):
+        with self._flush_lock:
+            self._write(self._drain() + (extra_events or []))
+
+
+page_view_buffer = PageViewEventBuffer(
+    max_size=settings.PAGE_VIEW_TRACKING_MAX_QUEUE,
+    batch_size=settings.PAGE_VIEW_TRACKING_BATCH_SIZE,
+    flush_interval_ms=settings.PAGE_VIEW_TRACKING_FLUSH_INTERVAL_MS,
+)
+
+
+@atexit.register
+def flush_page_view_buffer():
+    if page_view_buffer._pid == os.getpid():
+        page_view_buffer.flush()
+
+
+def record_page_view_start(page_view_instance):
+    from .models import CourseViewInstance
+    if tracking_is_buffered():
+        page_view_buffer.put(PAGE_VIEW_START, page_view_instance)
+    else:
+        page_view_instance.save()
+        CourseViewInstance.objects.record_resume_pointers([page_view_instance])
+        queue_activity(page_view_activity({}, page_view_instance, pages_viewed=1))
+        invalidate_student_dashboard(page_view_instance.student_id)
+    return page_view_instance
+
+
+def record_page_view_stop(page_view_instance_guid, stop_time):
+    if tracking_is_buffered():
+        page_view_buffer.put(PAGE_VIEW_STOP, (page_view_instance_guid, stop_time))
+        return
+    from .models import CoursePageViewInstance
+    try:
+        page_view_instance = CoursePageViewInstance.objects.select_related(
+            'course_view_instance__course', 'course_test_instance').get(guid=page_view_instance_guid)
+    except CoursePageViewInstance.DoesNotExist:
+        logger.warning('page view instance with guid %s does not exist', page_view_instance_guid)
+        return
+    # already closed, stops are only credited once like in buffered mode
+    if page_view_instance.page_view_stop is not None:
+        return
+    # we've detected a previous instance, mark it finished, calculate time credit
+    if page_view_instance.mark_stopped(stop_time):
+        page_view_instance.save(update_fields=['page_view_stop', 'total_seconds_spent'])
@@ -30,4 +30,14 @@ urlpatterns = [
         views.test_final_score_view, name='test_final_score'),
     re_path(r'^course_test_request_retake/(?P<test_instance_guid>[a-zA-Z0-9_-]+)/$',
         views.course_test_request_retake, name='course_test_request_retake'),
+    re_path(r'^course_test_client/(?P<test_instance_guid>[a-zA-Z0-9_-]+)/$',
+        views.course_test_client_view, name='course_test_client'),
+    re_path(r'^api/test_instance/(?P<test_instance_guid>[a-zA-Z0-9_-]+)/$',
+        views.test_instance_payload_api, name='test_instance_payload_api'),
+    re_path(r'^api/test_instance/(?P<test_instance_guid>[a-zA-Z0-9_-]+)/answer/$',
+        views.test_instance_answer_api, name='test_instance_answer_api'),
+    re_path(r'^api/test_instance/(?P<test_instance_guid>[a-zA-Z0-9_-]+)/answers/$',
+        views.test_instance_answers_api, name='test_instance_answers_api'),
+    re_path(r'^api/test_instance/(?P<test_instance_guid>[a-zA-Z0-9_-]+)/dwell/$',
+        views.test_instance_dwell_api, name='test_instance_dwell_api'),
 ]
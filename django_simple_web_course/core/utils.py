@@ -1,3 +1,8 @@
+from django.conf import settings
+from .cache import cache_key, get_or_build
+import hashlib, threading
+import markdown
+
 TIME_DURATION_UNITS = (
     ('week', 60*60*24*7),
     ('day', 60*60*24),
@@ -16,3 +21,25 @@ def human_time_duration(seconds):
         if amount > 0:
             parts.append('{} {}{}'.format(amount, unit, "" if amount == 1 else "s"))
     return ', '.join(parts)
+
+
+_markdown_local = threading.local()
+
+
+def markdown_renderer():
+    # Markdown instances aren't thread safe but are reusable after reset(), keep one per thread
+    renderer = getattr(_markdown_local, 'renderer', None)
+    if renderer is None:
+        renderer = _markdown_local.renderer = markdown.Markdown()
+    return renderer
+
+
+def markdown_cache_key(text):
+    return cache_key('markdown', hashlib.sha256(text.encode('utf-8')).hexdigest())
+
+
+def render_markdown_html(text, refresh=False):
+    # rendered html is cached by content hash, so edited content never serves stale html
+    text = text or ''
+    return get_or_build(markdown_cache_key(text), lambda: markdown_renderer().reset().convert(text),
+        settings.MARKDOWN_CACHE_SECONDS, refresh=refresh)
@@ -1,13 +1,15 @@
 from django.shortcuts import render
-from .decorators import student_login_required, page_tracking_enabled
+from .decorators import (student_login_required, page_tracking_enabled, start_question_view,
+    stop_question_view)
 
 from .forms import (StudentProfileForm, StudentIdentificationDocumentForm, StudentVerificationForm,
     TestQuestionInstanceForm, RetakeApprovalForm)
 
-from .models import (StudentIdentificationDocument, Student, Course, CoursePage, CoursePageMedia,
-    CoursePageMedia, CourseViewInstance, CoursePageViewInstance, CourseTest, MultipleChoiceAnswer,
-    MultipleChoiceTestQuestion, CourseTestQuestionInstance, CourseTestInstance)
-from django.http import HttpResponseRedirect, Http404
+from .models import (StudentIdentificationDocument, Student, CoursePageMedia,
+    CoursePageMedia, CourseViewInstance, CoursePageViewInstance, MultipleChoiceAnswer,
+    MultipleChoiceTestQuestion, CourseTestQuestionInstance, CourseTestInstance, CourseTestQuestionAnswerOption)
+from django.http import HttpResponse, HttpResponseRedirect, Http404, JsonResponse
+from django.core.exceptions import ValidationError
 from django.conf import settings
 from django.contrib import messages
 from django.contrib.admin.views.decorators import staff_member_required
@@ -16,6 +18,9 @@ from django.utils import timezone
 from django.urls import reverse
 from .email_dispatchers import (email_student_reverification, email_student_verification_complete,
     dispatch_test_retake_email, dispatch_test_retake_approved_email, dispatch_test_retake_rejected_email)
+from .dashboard import student_dashboard_cards
+from .test_payload import build_test_payload, answered_question_state, answered_question_states
+from uuid import UUID
 import json
 
 # views should be class based, for dev speed writing functions to convert later
@@ -93,6 +98,8 @@ def student_verification(request, student_guid=None):
                 student.verification_ready_on = None
                 student.save()
                 email_student_reverification(student, form['student_note'].value())
+            # the student's cached verification state is stale either way
+            Student.objects.invalidate_principal(student.guid)
             return HttpResponseRedirect(student.admin_change_url)
 
     return render(request, 'internal/student_verification.html',{
@@ -107,7 +114,7 @@ def student_verification(request, student_guid=None):
 def student_dashboard(request):
     return render(request, 'student_dashboard.html', {
         'student':request.student,
-        'available_courses': Course.objects.filter(published=True),
+        'course_cards': student_dashboard_cards(request.student_principal['pk']),
     })
 
 @student_login_required
@@ -116,7 +123,7 @@ def course_home_view(request, course_guid=None):
     if not course_guid:
         raise Http404
 
-    course = Course.objects.get(guid=course_guid)
+    course = request.tracking.course
 
     return render(request, 'course_home.html', {
         'student': request.student,
@@ -128,7 +135,7 @@ def course_home_view(request, course_guid=None):
 def course_page_view(request, page_guid=None):
     if not page_guid:
         raise Http404
-    course_page = CoursePage.objects.get(guid=page_guid)
+    course_page = request.tracking.course_page
     return render(request, 'course_page.html', {
         'student':request.student,
         'course_page': course_page,
@@ -142,7 +149,7 @@ def course_page_view(request, page_guid=None):
 def course_practice_test_home_view(request, test_guid=None):
     if not test_guid:
         raise Http404
-    course_test = CourseTest.objects.get(guid=test_guid)
+    course_test = request.tracking.course_test
     course_test_instance = course_test.get_or_generate_test_instance_for_student(request.student,
         is_practice=True)
 
@@ -151,6 +158,7 @@ def course_practice_test_home_view(request, test_guid=None):
         kwargs={'question_instance_guid':starting_question.guid})
     return render(request, 'course_practice_test_home.html', {
         'student':request.student,
+        'course_test_instance':course_test_instance,
         'course_test': course_test,
         'course': course_test.course,
         'course_view_instance':request.course_view_instance,
@@ -163,12 +171,11 @@ def course_practice_test_home_view(request, test_guid=None):
 def course_practice_test_question_view(request, question_instance_guid=None):
     if not question_instance_guid:
         raise Http404
-    course_test_question_instance = CourseTestQuestionInstance.objects.get(guid=question_instance_guid)
-    course_test_instance = course_test_question_instance.course_test_instance
+    course_test_question_instance = request.tracking.test_question_instance
+    course_test_instance = request.tracking.course_test_instance
     # if the test hasn't been marked started, we're on a question start it
     if not course_test_instance.test_started_on:
-        course_test_instance.test_started_on = timezone.now()
-        course_test_instance.save()
+        course_test_instance.start()
 
     answer_instance = course_test_question_instance.answer_instance
 
@@ -196,7 +203,7 @@ def course_practice_test_question_view(request, question_instance_guid=None):
 def course_test_home_view(request, test_guid=None):
     if not test_guid:
         raise Http404
-    course_test = CourseTest.objects.get(guid=test_guid)
+    course_test = request.tracking.course_test
     course_test_instance = course_test.get_or_generate_test_instance_for_student(request.student,
         is_practice=False)
 
@@ -221,15 +228,14 @@ def course_test_home_view(request, test_guid=None):
 def course_test_question_view(request, question_instance_guid=None):
     if not question_instance_guid:
         raise Http404
-    course_test_question_instance = CourseTestQuestionInstance.objects.get(guid=question_instance_guid)
-    course_test_instance = course_test_question_instance.course_test_instance
+    course_test_question_instance = request.tracking.test_question_instance
+    course_test_instance = request.tracking.course_test_instance
     # if the test hasn't been marked started, we're on a question start it
     if not course_test_instance.test_started_on:
-        course_test_instance.test_started_on = timezone.now()
-        course_test_instance.save()
-        # since we're starting a test, add it to the session so the middleware
+        course_test_instance.start()
+        # since we're starting a test, add it to the tracking cursor so the middleware
         # locks the url down to the test
-        request.session['live_test_guid'] = str(course_test_instance.guid)
+        request.tracking_cursor['live_test_guid'] = str(course_test_instance.guid)
 
     answer_instance = course_test_question_instance.answer_instance
 
@@ -257,7 +263,8 @@ def test_final_score_view(request, test_instance_guid=None):
     if not test_instance_guid:
         raise Http404
 
-    course_test_instance = CourseTestInstance.objects.get(guid=test_instance_guid)
+    course_test_instance = CourseTestInstance.objects.select_related('course_test__course').get(
+        guid=test_instance_guid)
     # can't get here if query is empty, no need to catch
     course_view_instance = CourseViewInstance.objects.filter(student=course_test_instance.student,
         course=course_test_instance.course).order_by('-created')[0]
@@ -268,9 +275,129 @@ def test_final_score_view(request, test_instance_guid=None):
         'course':course_test_instance.course_test.course,
         'instance':course_test_instance,
         'course_view_instance':course_view_instance,
-        'page_view_instance':request.page_view_instance,
+        # the score page isn't page tracked
+        'page_view_instance':getattr(request, 'page_view_instance', None),
+    })
+
+def get_student_test_instance(request, test_instance_guid):
+    try:
+        return CourseTestInstance.objects.select_related('course_test__course').get(
+            guid=test_instance_guid, student_id=request.student_principal['pk'])
+    except (CourseTestInstance.DoesNotExist, ValidationError):
+        raise Http404
+
+def start_test_instance(request, course_test_instance):
+    # same as landing on the first question page
+    if course_test_instance.test_started_on:
+        return
+    course_test_instance.start()
+    if not course_test_instance.is_practice:
+        request.tracking_cursor['live_test_guid'] = str(course_test_instance.guid)
+
+@student_login_required
+def course_test_client_view(request, test_instance_guid=None):
+    # whole test on one page, questions come from the payload api and are navigated client side
+    course_test_instance = get_student_test_instance(request, test_instance_guid)
+    start_test_instance(request, course_test_instance)
+    return render(request, 'course_test_client.html', {
+        'student':request.student,
+        'course_test_instance':course_test_instance,
+        'course_test':course_test_instance.course_test,
+        'course':course_test_instance.course_test.course,
+        'start_clock':True,
+        'payload_url':reverse('test_instance_payload_api',
+            kwargs={'test_instance_guid':course_test_instance.guid}),
     })
 
+@student_login_required
+def test_instance_payload_api(request, test_instance_guid=None):
+    course_test_instance = get_student_test_instance(request, test_instance_guid)
+    start_test_instance(request, course_test_instance)
+    return JsonResponse(build_test_payload(course_test_instance))
+
+@student_login_required
+def test_instance_answer_api(request, test_instance_guid=None):
+    if request.method != 'POST':
+        return JsonResponse({'error':'POST required'}, status=405)
+    course_test_instance = get_student_test_instance(request, test_instance_guid)
+    # the option has to belong to the posted question, and the question to this test
+    try:
+        option = CourseTestQuestionAnswerOption.objects.select_related('answer_option',
+            'question_instance').get(guid=request.POST.get('option_guid'),
+            question_instance__guid=request.POST.get('question_instance_guid'),
+            question_instance__course_test_instance=course_test_instance)
+    except (CourseTestQuestionAnswerOption.DoesNotExist, ValidationError):
+        return JsonResponse({'error':'Invalid multiple choice answer'}, status=400)
+    question_instance = option.question_instance
+    question_instance.course_test_instance = course_test_instance
+    # a resent answer gets the state of the answer already recorded
+    answer_instance = question_instance.choose_answer(option.answer_option)
+    if answer_instance is None:
+        return JsonResponse({'error':'Time has expired', 'is_complete':True}, status=403)
+
+    state = answered_question_state(course_test_instance, question_instance.guid,
+        answer_instance.answer_chosen_id)
+    state['is_complete'] = course_test_instance.is_complete
+    return JsonResponse(state)
+
+@student_login_required
+def test_instance_answers_api(request, test_instance_guid=None):
+    # batch of {question_instance_guid, option_guid} answers, safe to resend
+    if request.method != 'POST':
+        return JsonResponse({'error':'POST required'}, status=405)
+    course_test_instance = get_student_test_instance(request, test_instance_guid)
+    try:
+        posted_answers = json.loads(request.body)['answers']
+        option_questions = {
+            str(UUID(answer['option_guid'])): str(UUID(answer['question_instance_guid']))
+            for answer in posted_answers
+        }
+    except (ValueError, KeyError, TypeError, AttributeError):
+        return JsonResponse({'error':'Invalid answers'}, status=400)
+
+    # only options of the posted question, in this test, are accepted
+    choices = []
+    for option in CourseTestQuestionAnswerOption.objects.select_related('answer_option',
+        'question_instance').filter(guid__in=option_questions.keys(),
+        question_instance__course_test_instance=course_test_instance):
+        if option_questions[str(option.guid)] == str(option.question_instance.guid):
+            option.question_instance.course_test_instance = course_test_instance
+            choices.append((option.question_instance, option.answer_option))
+    recorded_answers = course_test_instance.record_answers(choices)
+    if choices and not recorded_answers:
+        return JsonResponse({'error':'Time has expired', 'is_complete':True}, status=403)
+
+    answers = answered_question_states(course_test_instance, {
+        question_instance.guid: recorded_answers[question_instance.pk].answer_chosen_id
+        for question_instance, answer_chosen in choices if question_instance.pk in recorded_answers
+    })
+    accepted = {answer['guid'] for answer in answers}
+    return JsonResponse({
+        'is_complete':course_test_instance.is_complete,
+        'answers':answers,
+        'rejected':sorted(set(option_questions.values()) - accepted),
+    })
+
+@student_login_required
+def test_instance_dwell_api(request, test_instance_guid=None):
+    if request.method != 'POST':
+        return JsonResponse({'error':'POST required'}, status=405)
+    event = request.POST.get('event')
+    if event == 'hidden':
+        stop_question_view(request, request.POST.get('question_instance_guid', ''))
+        return HttpResponse(status=204)
+    if event != 'shown':
+        return JsonResponse({'error':'Invalid dwell beacon'}, status=400)
+    try:
+        question_instance = CourseTestQuestionInstance.objects.select_related(
+            'course_test_instance__course_test__course', 'course_test_question').get(
+            guid=request.POST.get('question_instance_guid'), course_test_instance__guid=test_instance_guid,
+            course_test_instance__student_id=request.student_principal['pk'])
+    except (ValueError, CourseTestQuestionInstance.DoesNotExist, ValidationError):
+        return JsonResponse({'error':'Invalid dwell beacon'}, status=400)
+    start_question_view(request, request.student_principal['pk'], question_instance)
+    return HttpResponse(status=204)
+
 @student_login_required
 def course_test_request_retake(request, test_instance_guid=None):
     course_test_instance = CourseTestInstance.objects.get(guid=test_instance_guid)
@@ -302,7 +429,7 @@ def course_test_request_retake(request, test_instance_guid=None):
 def course_complete_view(request, course_guid=None):
     if not course_guid:
         raise Http404
-    course = Course.objects.get(guid=course_guid)
+    course = request.tracking.course
 
     return render(request, 'course_complete.html', {
         'student': request.student,
@@ -10,6 +10,7 @@ For the full list of settings and their values, see
 https://docs.djangoproject.com/en/4.1/ref/settings/
 """
 from django.contrib.messages import constants as messages
+from django.core.exceptions import ImproperlyConfigured
 from pathlib import Path
 import os
 # Build paths inside the project like this: BASE_DIR / 'subdir'.
@@ -69,6 +70,7 @@ MIDDLEWARE = [
     'django.contrib.auth.middleware.AuthenticationMiddleware',
     'django.contrib.messages.middleware.MessageMiddleware',
     'django.middleware.clickjacking.XFrameOptionsMiddleware',
+    'core.middleware.TrackingCursorMiddleware',
     'core.middleware.PageViewInstanceMiddleware',
     'core.middleware.LiveTestRoutingMiddleware',
 ]
@@ -94,6 +96,36 @@ TEMPLATES = [
 WSGI_APPLICATION = 'django_simple_web_course.wsgi.application'
 MESSAGE_STORAGE = 'django.contrib.messages.storage.cookie.CookieStorage'
 
+# redis from the compose 'cache' service, shared by every worker. Without USE_DOCKER_CACHE each
+# process gets its own local memory cache, fine for tests and runserver
+USE_DOCKER_CACHE = os.environ.get("USE_DOCKER_CACHE", "False") == "True"
+if USE_DOCKER_CACHE:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.redis.RedisCache',
+            'LOCATION': os.environ.get("CACHE_URL", "redis://cache:6379/0"),
+        }
+    }
+else:
+    CACHES = {
+        'default': {
+            'BACKEND': 'django.core.cache.backends.locmem.LocMemCache',
+            'OPTIONS': {'MAX_ENTRIES': 10000},
+        }
+    }
+# how often each process adds its cache hit and miss counts to the shared counters
+CACHE_STATS_FLUSH_SECONDS = 30
+
+# with a shared cache sessions are read through it and only written to the database when they
+# change, which after login is rare since the tracking cursors live outside the session. Per
+# process caches would serve stale sessions, so without one sessions stay in the database
+SESSION_ENGINE = os.environ.get("SESSION_ENGINE", "django.contrib.sessions.backends.cached_db"
+    if USE_DOCKER_CACHE else "django.contrib.sessions.backends.db")
+# where the per session page view and live test cursors live, 'cache' or 'session'. 'cache'
+# needs a cache every worker shares, see the check at the bottom
+TRACKING_CURSOR_STORE = os.environ.get("TRACKING_CURSOR_STORE", "cache" if USE_DOCKER_CACHE else "session")
+TRACKING_CURSOR_CACHE_SECONDS = 12 * 60 * 60
+
 # SQLite no longer enough. Some features require postgres
 # Will dockerize in the future, but you'll need to setup postgres for now
 
@@ -105,6 +137,12 @@ DATABASES = {
         'PASSWORD': os.environ.get("DB_PASS", "SecureDjangoPassword12345"),
         'HOST': os.environ.get("DB_HOST", "db"),
         'PORT': os.environ.get("DB_PORT", 5432),
+        # keep connections open between requests instead of connecting per request, checked
+        # before reuse so a connection dropped by the server or the pooler isn't handed out
+        'CONN_MAX_AGE': int(os.environ.get("DB_CONN_MAX_AGE", 60)),
+        'CONN_HEALTH_CHECKS': True,
+        # pgbouncer in transaction mode can't keep a server side cursor open across transactions
+        'DISABLE_SERVER_SIDE_CURSORS': os.environ.get("DB_USE_POOLER", "False") == "True",
     }   
 }
 
@@ -145,6 +183,11 @@ USE_TZ = True
 MINIMUM_COURSE_SECONDS_DEFAULT = 2 * 60 * 60
 MAXIMUM_TEST_SECONDS_DEFAULT = 1 * 60 * 60
 DEFAULT_MULTIPLE_CHOICE_LENGTH = 4
+# ready made practice tests kept per course test by the refill_practice_test_pools worker
+PRACTICE_TEST_POOL_DEPTH = 5
+PRACTICE_TEST_POOL_REFILL_INTERVAL_SECONDS = 30
+# how often finalize_expired_tests --loop finishes and scores timed tests past their deadline
+EXPIRED_TEST_SWEEP_INTERVAL_SECONDS = 15
 MAX_COURSE_IDLE_TIME_SECONDS = 15 * 60
 # Static files (CSS, JavaScript, Images)
 # https://docs.djangoproject.com/en/4.1/howto/static-files/
@@ -173,12 +216,58 @@ IDENTIFICATION_DOCUMENTS = [
 
 LOGIN_REDIRECT_URL = '/student_dashboard/'
 STUDENT_PROFILE_URL = '/student_profile/'
+# how long a student's identity and verification state is cached between requests
+STUDENT_PRINCIPAL_CACHE_SECONDS = 5 * 60
+# dashboard course cards are rebuilt when tracking or test events invalidate them
+STUDENT_DASHBOARD_CACHE_SECONDS = 10 * 60
 
 STATIC_URL = 'static/'
 
 ACCOUNT_ACTIVATION_DAYS = 7
 
+# rendered markdown is cached by content hash so entries never go stale, this only
+# lets content that is no longer used fall out of the cache
+MARKDOWN_CACHE_SECONDS = 7 * 24 * 60 * 60
+
 LEFT_NAV_HISTORY_MAX = 5
+# cached left nav history is updated as pages are viewed, this bounds how long it lives
+LEFT_NAV_HISTORY_CACHE_SECONDS = 60 * 60
+
+# how long the routing record for a student's live test is cached. The record is updated
+# as answers come in, this only bounds how long an abandoned one lingers
+LIVE_TEST_ROUTING_CACHE_SECONDS = 6 * 60 * 60
+
+# question navigation map for a test instance, updated as answers come in
+TEST_NAVIGATION_CACHE_SECONDS = 6 * 60 * 60
+# question content half of the test payload api response, it never changes for a test instance
+TEST_PAYLOAD_CACHE_SECONDS = 6 * 60 * 60
+
+# course structure snapshots and page navigation bars, both keyed by the course content version
+COURSE_STRUCTURE_CACHE_SECONDS = 24 * 60 * 60
+
+# page view tracking ingest. 'sync' writes page views on the request thread,
+# 'buffered' queues them in process and a background thread bulk writes them
+# every PAGE_VIEW_TRACKING_BATCH_SIZE events or PAGE_VIEW_TRACKING_FLUSH_INTERVAL_MS.
+# The queue is in worker memory, a killed worker loses the events it hadn't flushed yet
+PAGE_VIEW_TRACKING_MODE = os.environ.get('PAGE_VIEW_TRACKING_MODE', 'sync')
+PAGE_VIEW_TRACKING_BATCH_SIZE = 200
+PAGE_VIEW_TRACKING_FLUSH_INTERVAL_MS = 500
+# when the queue is full requests flush it themselves instead of dropping events
+PAGE_VIEW_TRACKING_MAX_QUEUE = 5000
+# failed batches are retried this many times before events are written one at a time
+PAGE_VIEW_TRACKING_MAX_RETRIES = 5
+# stops flushed before their start (queued in another worker) are retried for this long
+PAGE_VIEW_TRACKING_UNMATCHED_STOP_SECONDS = 10 * 60
+
+# page views older than this are rolled up into daily CoursePageViewRollup rows and deleted
+# by archive_page_views, in batches of PAGE_VIEW_ARCHIVE_BATCH_SIZE
+PAGE_VIEW_RETENTION_DAYS = 90
+PAGE_VIEW_ARCHIVE_BATCH_SIZE = 5000
+PAGE_VIEW_ARCHIVE_INTERVAL_SECONDS = 60 * 60
+
+# tracking and test activity is added up in each worker and written to the daily activity
+# rollups this often, backfill_activity_rollups rebuilds days a killed worker left short
+ACTIVITY_ROLLUP_FLUSH_SECONDS = 30
 
 # Default primary key field type
 # https://docs.djangoproject.com/en/4.1/ref/settings/#default-auto-field
@@ -192,3 +281,9 @@ try:
     from .local_settings import *
 except ImportError as e:
     print(e)
+
+# a worker can't see cursors another worker left in its own local memory cache, the stops
+# would go missing along with their time credit
+if TRACKING_CURSOR_STORE == 'cache' and CACHES['default']['BACKEND'].endswith('.LocMemCache'):
+    raise ImproperlyConfigured("TRACKING_CURSOR_STORE = 'cache' needs a cache shared by every worker, "
+        "set USE_DOCKER_CACHE=True or TRACKING_CURSOR_STORE=session")
@@ -0,0 +1,237 @@
+// One page test UI. The whole test is loaded from the payload api in one request, questions
+// are navigated in the browser, answers are queued and sent to the batch answers api (resent
+// until they're acknowledged) and the dwell api is told by beacon when a question is shown and
+// hidden, the server times the question view from those.
+(function () {
+    var root = document.getElementById('test-client');
+    if (!root) {
+        return;
+    }
+    var csrfToken = root.dataset.csrfToken;
+    var test = null;
+    var position = 0;
+    var shown = false;
+    var pendingAnswers = {};
+    var sending = false;
+    var RETRY_MILLISECONDS = 5000;
+
+    function byId(id) {
+        return document.getElementById(id);
+    }
+
+    function formData(fields) {
+        var data = new FormData();
+        data.append('csrfmiddlewaretoken', csrfToken);
+        Object.keys(fields).forEach(function (name) {
+            data.append(name, fields[name]);
+        });
+        return data;
+    }
+
+    function toggle(element, visible) {
+        element.classList.toggle('d-none', !visible);
+    }
+
+    function nextUnanswered() {
+        var count = test.questions.length;
+        for (var offset = 1; offset < count; offset++) {
+            var index = (position + offset) % count;
+            if (!test.questions[index].answered) {
+                return index;
+            }
+        }
+        return null;
+    }
+
+    function sendDwell(event) {
+        // showing a question closes the one shown before it on the server
+        shown = event === 'shown';
+        navigator.sendBeacon(test.dwell_url, formData({
+            question_instance_guid: test.questions[position].guid,
+            event: event
+        }));
+    }
+
+    function show(index) {
+        position = index;
+        sendDwell('shown');
+        render();
+    }
+
+    function renderAnswer(question) {
+        var answer = byId('test-client-answer');
+        answer.innerHTML = '';
+        if (question.answered) {
+            var option = question.options.filter(function (option) {
+                return option.guid === question.chosen_option;
+            })[0];
+            if (question.post_answer_comments_html) {
+                var comments = document.createElement('div');
+                comments.innerHTML = question.post_answer_comments_html;
+                answer.appendChild(comments);
+            }
+            var yours = document.createElement('h5');
+            yours.innerHTML = '<b>Your answer:</b> ';
+            yours.appendChild(document.createTextNode(option ? option.value : ''));
+            var correct = document.createElement('h5');
+            correct.innerHTML = '<b>Correct answer:</b> ';
+            correct.appendChild(document.createTextNode(question.correct_answer));
+            var result = document.createElement('div');
+            result.className = 'alert ' + (question.is_correct ? 'alert-success' : 'alert-danger');
+            result.textContent = question.is_correct ? 'You got this question correct!' : 'Incorrect answer';
+            answer.appendChild(yours);
+            answer.appendChild(correct);
+            answer.appendChild(result);
+            return;
+        }
+        if (test.is_complete) {
+            answer.textContent = 'Time has expired';
+            return;
+        }
+        if (pendingAnswers[question.guid]) {
+            answer.textContent = 'Saving your answer...';
+            return;
+        }
+        var form = document.createElement('form');
+        question.options.forEach(function (option) {
+            var label = document.createElement('label');
+            label.className = 'd-block';
+            var input = document.createElement('input');
+            input.type = 'radio';
+            input.name = 'option_guid';
+            input.value = option.guid;
+            label.appendChild(input);
+            label.appendChild(document.createTextNode(' ' + option.value));
+            form.appendChild(label);
+        });
+        var submit = document.createElement('input');
+        submit.type = 'submit';
+        submit.className = 'btn btn-primary';
+        form.appendChild(submit);
+        form.addEventListener('submit', function (event) {
+            event.preventDefault();
+            var chosen = form.querySelector('input[name=option_guid]:checked');
+            if (chosen) {
+                submitAnswer(question, chosen.value);
+            }
+        });
+        answer.appendChild(form);
+    }
+
+    function renderPalette() {
+        var palette = byId('test-client-palette');
+        palette.innerHTML = '';
+        test.questions.forEach(function (question, index) {
+            var link = document.createElement('a');
+            link.href = '#';
+            link.className = 'btn btn-sm ' + (index === position ? 'btn-primary' :
+                question.answered ? 'btn-success' : 'btn-outline-secondary');
+            link.textContent = question.number;
+            link.addEventListener('click', function (event) {
+                event.preventDefault();
+                show(index);
+            });
+            palette.appendChild(link);
+        });
+    }
+
+    function render() {
+        var question = test.questions[position];
+        var unanswered = nextUnanswered();
+        byId('test-client-question-number').textContent = question.number;
+        byId('test-client-question').innerHTML = question.question_html;
+        renderAnswer(question);
+        toggle(byId('test-client-previous'), position > 0);
+        toggle(byId('test-client-next'), position < test.questions.length - 1);
+        toggle(byId('test-client-final-score'), test.is_complete);
+        toggle(byId('test-client-next-unanswered'), !test.is_complete && unanswered !== null &&
+            unanswered !== position + 1);
+        renderPalette();
+    }
+
+    function submitAnswer(question, optionGuid) {
+        pendingAnswers[question.guid] = optionGuid;
+        render();
+        sendAnswers();
+    }
+
+    function sendAnswers() {
+        var guids = Object.keys(pendingAnswers);
+        if (sending || !guids.length) {
+            return;
+        }
+        sending = true;
+        fetch(test.answers_url, {
+            method: 'POST',
+            credentials: 'same-origin',
+            headers: {'Content-Type': 'application/json', 'X-CSRFToken': csrfToken},
+            body: JSON.stringify({answers: guids.map(function (guid) {
+                return {question_instance_guid: guid, option_guid: pendingAnswers[guid]};
+            })})
+        }).then(function (response) {
+            return response.json().then(function (data) {
+                sending = false;
+                // answered, rejected or out of time, these won't be sent again
+                guids.forEach(function (guid) {
+                    delete pendingAnswers[guid];
+                });
+                if (data.is_complete) {
+                    test.is_complete = true;
+                }
+                (data.answers || []).forEach(function (state) {
+                    test.questions.forEach(function (question) {
+                        if (question.guid === state.guid) {
+                            Object.assign(question, state);
+                        }
+                    });
+                });
+                if (!response.ok && !data.is_complete) {
+                    window.alert(data.error || 'Your answer could not be saved, please try again');
+                }
+                render();
+                sendAnswers();
+            });
+        }).catch(function () {
+            // bad network, keep the answers and resend them, the server ignores duplicates
+            sending = false;
+            window.setTimeout(sendAnswers, RETRY_MILLISECONDS);
+        });
+    }
+
+    [['test-client-previous', -1], ['test-client-next', 1]].forEach(function (link) {
+        byId(link[0]).addEventListener('click', function (event) {
+            event.preventDefault();
+            show(position + link[1]);
+        });
+    });
+    byId('test-client-next-unanswered').addEventListener('click', function (event) {
+        event.preventDefault();
+        show(nextUnanswered());
+    });
+    document.addEventListener('visibilitychange', function () {
+        if (!test) {
+            return;
+        }
+        if (document.visibilityState === 'hidden' && shown) {
+            sendDwell('hidden');
+        } else if (document.visibilityState === 'visible' && !shown) {
+            sendDwell('shown');
+        }
+    });
+    window.addEventListener('pagehide', function () {
+        if (test && shown) {
+            sendDwell('hidden');
+        }
+    });
+
+    fetch(root.dataset.payloadUrl, {credentials: 'same-origin'}).then(function (response) {
+        return response.json();
+    }).then(function (payload) {
+        test = payload;
+        byId('test-client-final-score').href = test.final_score_url;
+        var firstUnanswered = test.questions.findIndex(function (question) {
+            return !question.answered;
+        });
+        show(firstUnanswered === -1 ? 0 : firstUnanswered);
+    });
+})();
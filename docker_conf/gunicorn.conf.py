@@ -0,0 +1,11 @@
+import multiprocessing
+import os
+
+# Each worker thread keeps one persistent database connection (DB_CONN_MAX_AGE), and with
+# PAGE_VIEW_TRACKING_MODE=buffered each worker's flusher thread keeps one more. Size postgres
+# max_connections, or the pgbouncer pool, to at least
+#     GUNICORN_WORKERS * (GUNICORN_THREADS + 1) + 2
+# the + 2 being the practice test pool and expired test sweeper commands under supervisor.
+workers = int(os.environ.get('GUNICORN_WORKERS', multiprocessing.cpu_count() * 2 + 1))
+threads = int(os.environ.get('GUNICORN_THREADS', 1))
+bind = '0.0.0.0:8000'
@@ -13,5 +13,5 @@ then
     /home/django/.env/bin/python /home/django/app/django_simple_web_course/manage.py runserver 0.0.0.0:8000
 else
     echo "Starting gunicorn server"
-    /home/django/.env/bin/gunicorn --bind 0.0.0.0:8000 django_simple_web_course.django_simple_web_course.wsgi
+    /home/django/.env/bin/gunicorn --config /home/django/app/docker_conf/gunicorn.conf.py django_simple_web_course.django_simple_web_course.wsgi
 fi
\ No newline at end of file